@@ -7,6 +7,7 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QPushButton, QL
                            QFrame, QSizePolicy)
 from PyQt5.QtGui import QPixmap, QImage, QPainter, QPen, QColor, QFont, QIcon
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QPoint, QRect, QSize, QCoreApplication
+from Performance_Metrics import metrics
 
 class FlowMapUI(QMainWindow):
     """主UI視窗類"""
@@ -312,11 +313,23 @@ class PoolShapePage(QWidget):
         rectangle_btn.setToolTip("Select <b>Rectangle Pool Button</b> if your pool is square or rectangular")
         rectangle_btn.setCursor(Qt.PointingHandCursor) # 滑鼠停滯於按鈕上變成手指形狀[代表可點擊，進行選擇]
         rectangle_btn.clicked.connect(lambda: self.select_pool_shape("rectangle"))
+
+        # 多邊形水池按鈕(依序點選水池輪廓的頂點，至少3個點)
+        polygon_btn = QPushButton("Polygon Pool")
+        polygon_btn.setMinimumHeight(100)
+        polygon_btn.setMinimumWidth(220)
+        polygon_btn.setFont(QFont("Arial"))
+        polygon_btn.setStyleSheet("font-size: 24px; font-weight: bold; color: #2D2D30; border: 2px solid #CCCCCC; border-radius: 10px;")
+        # ToolTip 提示
+        polygon_btn.setToolTip("Select <b>Polygon Pool Button</b> if your pool is L-shaped, kidney-shaped or irregular")
+        polygon_btn.setCursor(Qt.PointingHandCursor) # 滑鼠停滯於按鈕上變成手指形狀[代表可點擊，進行選擇]
+        polygon_btn.clicked.connect(lambda: self.select_pool_shape("polygon"))
         
         # 添加按鈕到形狀選擇佈局
         shape_layout.addStretch(1) # 左側彈性空間
         shape_layout.addWidget(circle_btn)
         shape_layout.addWidget(rectangle_btn)
+        shape_layout.addWidget(polygon_btn)
         shape_layout.addStretch(1) # 右側彈性空間
         
         # 創建底部按鈕區域
@@ -362,6 +375,7 @@ class PerspectiveCalibrationPage(QWidget):
         self.parent = parent
         self.annotation_points = []  # 存儲標註點
         self.max_points = 4  # 最大標註點數量
+        self.min_points = 4  # 可送出的最少標註點數量 (多邊形水池為3)
         self.current_frame = None  # 當前幀
         self.display_frame = None  # 顯示用的幀
         self.is_frame_captured = False  # 是否已擷取幀
@@ -639,6 +653,14 @@ class PerspectiveCalibrationPage(QWidget):
         '''根據在水池形狀選擇頁面選擇的結果更新'''
         self.pool_shape = shape
         self.title_label.setText(f"Second Stage: Perspective transformation reference points edit for {self.pool_shape} pool")
+        # 多邊形水池依序點選輪廓頂點(3~16個點)，其他形狀固定4個參考點
+        if shape == "polygon":
+            self.min_points, self.max_points = 3, 16
+            self.step2_label.setText(f"Step 2: Click {self.min_points}-{self.max_points} pool outline vertices\nin order in the image on the left")
+        else:
+            self.min_points, self.max_points = 4, 4
+            self.step2_label.setText(f"Step 2: Select {self.max_points} reference points\nin the image on the left")
+        self.points_counter.setText(f"Points: {len(self.annotation_points)} / {self.max_points}")
     
     def update_camera_frame(self, frame):
         """從攝像頭更新幀"""
@@ -686,6 +708,11 @@ class PerspectiveCalibrationPage(QWidget):
             self.display_frame = blank_frame
         
         frame_with_annotations = self.display_frame.copy()
+
+        # 多邊形水池: 連接輪廓頂點
+        if getattr(self, "pool_shape", None) == "polygon" and len(self.annotation_points) >= 2:
+            cv2.polylines(frame_with_annotations, [np.array(self.annotation_points, dtype=np.int32)],
+                          len(self.annotation_points) >= self.min_points, (0, 255, 255), 2)
         
         # 繪製標註點
         for i, point in enumerate(self.annotation_points):
@@ -745,8 +772,8 @@ class PerspectiveCalibrationPage(QWidget):
                 count = len(self.annotation_points)
                 self.points_counter.setText(f"Points: {count} / {self.max_points}")
                 
-                # 檢查是否完成
-                if count == self.max_points:
+                # 檢查是否完成(多邊形水池達到最少點數即可送出)
+                if count == self.min_points:
                     self.update_step_status(3) # 進入步驟 3
                     self.confirm_btn.setEnabled(True)
                     self.confirm_btn.setStyleSheet(self.confirm_btn.styleSheet().replace("background-color: #BDBDBD;", ""))
@@ -762,7 +789,7 @@ class PerspectiveCalibrationPage(QWidget):
     
     def send_annotations(self):
         """發送標註點"""
-        if len(self.annotation_points) != self.max_points:
+        if not self.min_points <= len(self.annotation_points) <= self.max_points:
             return
         
         print(f"發送標註點: {self.annotation_points}")
@@ -1382,13 +1409,14 @@ class WaterJetCalibrationPage(QWidget):
             # 調整大小以適應 240x240 的顯示區域
             # display_frame = cv2.resize(frame, (240, 240), interpolation=cv2.INTER_LANCZOS4)
             
-            height, width, channel = frame.shape
-            bytes_per_line = 3 * width
-            q_img = QImage(frame.data, width, height, bytes_per_line, QImage.Format_RGB888).rgbSwapped()
-            pixmap = QPixmap.fromImage(q_img)
-            scaled_pixmap = pixmap.scaled(self.tracking_display.size(), 
-                                        Qt.KeepAspectRatio, 
-                                        Qt.SmoothTransformation)
+            with metrics.timer("ui.tracking_convert"):
+                height, width, channel = frame.shape
+                bytes_per_line = 3 * width
+                q_img = QImage(frame.data, width, height, bytes_per_line, QImage.Format_RGB888).rgbSwapped()
+                pixmap = QPixmap.fromImage(q_img)
+                scaled_pixmap = pixmap.scaled(self.tracking_display.size(), 
+                                            Qt.KeepAspectRatio, 
+                                            Qt.SmoothTransformation)
             self.tracking_display.setPixmap(scaled_pixmap)
 
     def update_flowmap_display(self, flowmap):
@@ -1396,15 +1424,16 @@ class WaterJetCalibrationPage(QWidget):
         if flowmap is not None and self.tracking_active:
             # display_flowmap = cv2.resize(flowmap, (240, 240), interpolation=cv2.INTER_LANCZOS4)
             
-            height, width, channel = flowmap.shape
-            bytes_per_line = 3 * width
-            q_img = QImage(flowmap.data, width, height, bytes_per_line, QImage.Format_RGB888).rgbSwapped()
+            with metrics.timer("ui.flowmap_convert"):
+                height, width, channel = flowmap.shape
+                bytes_per_line = 3 * width
+                q_img = QImage(flowmap.data, width, height, bytes_per_line, QImage.Format_RGB888).rgbSwapped()
 
-            pixmap = QPixmap.fromImage(q_img)
+                pixmap = QPixmap.fromImage(q_img)
 
-            scaled_pixmap = pixmap.scaled(self.flowmap_display.size(), 
-                                        Qt.KeepAspectRatio, 
-                                        Qt.SmoothTransformation)
+                scaled_pixmap = pixmap.scaled(self.flowmap_display.size(), 
+                                            Qt.KeepAspectRatio, 
+                                            Qt.SmoothTransformation)
             
             self.flowmap_display.setPixmap(scaled_pixmap)
 
@@ -4,7 +4,23 @@ import numpy as np
 import time
 import threading
 import sys
+import os
 from TCP_Server import FlowMapServer
+from Frame_Pipeline import FramePipeline
+from Quality_Governor import QualityGovernor
+from Performance_Metrics import metrics
+from Camera_Calibration import DEFAULT_PROFILE_PATH, load_calibration_profile
+from Session_Recorder import SessionRecorder
+from FlowMap_Archive import FlowMapArchiveWriter
+from Velocity_Field import VelocityFieldInterpolator, encode_velocity_field
+from Flow_Solver import FlowSolver
+from Pool_Mask import PoolMask
+from Pool_Coordinates import PoolCoordinates
+from Parallel_Detector import ParallelDetector
+from Homography_Drift import HomographyDriftCorrector
+from Multi_Camera import MultiCameraRig
+from Snapshot_Service import SnapshotService
+from Camera_Capture import CameraCapture
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtCore import QTimer
 from ArUcoFlowMap_UI import FlowMapUI
@@ -12,7 +28,7 @@ from ArUcoFlowMap_UI import FlowMapUI
 class KalmanMarkerTracker:
     """使用卡爾曼濾波器追蹤 ArUco 標記"""
     
-    def __init__(self, marker_id, initial_position, initial_rotation, dt=1/30.0):
+    def __init__(self, marker_id, initial_position, initial_rotation, dt=1/30.0, timestamp=None):
         """
         初始化標記追蹤器
         
@@ -21,10 +37,12 @@ class KalmanMarkerTracker:
         initial_position: 初始位置 [x, y]
         initial_rotation: 初始旋轉角度
         dt: 時間步長（預設為30FPS的倒數）
+        timestamp: 初始測量的擷取時間 (time.perf_counter，None 表示使用當前時間)
         """
         
         self.marker_id = marker_id
-        self.last_update_time = time.time()
+        self.dt = dt
+        self.last_update_time = timestamp if timestamp is not None else time.perf_counter()
         self.missed_frames = 0
         self.max_missed_frames = 30  # 最多允許連續丟失30幀
         
@@ -72,18 +90,19 @@ class KalmanMarkerTracker:
             [0]                     # rotation velocity
         ], np.float32)
     
-    def update(self, position, rotation):
+    def update_time_step(self, timestamp=None):
         """
-        使用新的測量值更新濾波器
+        依照擷取時間計算時間差，並更新狀態轉移矩陣中的時間步長
         
         參數:
-        position: [x, y] 位置
-        rotation: 旋轉角度
+        timestamp: 測量的擷取時間 (time.perf_counter，None 表示使用當前時間)
         """
         # 計算時間差
-        current_time = time.time()
+        current_time = timestamp if timestamp is not None else time.perf_counter()
         dt = current_time - self.last_update_time
         self.last_update_time = current_time
+        if dt <= 0:
+            dt = self.dt  # 時間戳記異常(相同或倒退)時使用預設時間步長
         
         # 更新狀態轉移矩陣中的時間步長
         self.kf.transitionMatrix[0, 2] = dt
@@ -93,6 +112,17 @@ class KalmanMarkerTracker:
         self.kf.transitionMatrix[2, 4] = dt
         self.kf.transitionMatrix[3, 5] = dt
         self.kf.transitionMatrix[6, 7] = dt
+
+    def update(self, position, rotation, timestamp=None):
+        """
+        使用新的測量值更新濾波器
+        
+        參數:
+        position: [x, y] 位置
+        rotation: 旋轉角度
+        timestamp: 測量的擷取時間 (time.perf_counter)
+        """
+        self.update_time_step(timestamp)
         
         # 預測
         self.kf.predict()
@@ -106,23 +136,14 @@ class KalmanMarkerTracker:
         
         return self.get_state()
     
-    def predict(self):
+    def predict(self, timestamp=None):
         """
         預測下一個狀態（當標記未被檢測到時使用）
-        """
-        # 計算時間差
-        current_time = time.time()
-        dt = current_time - self.last_update_time
-        self.last_update_time = current_time
         
-        # 更新狀態轉移矩陣中的時間步長
-        self.kf.transitionMatrix[0, 2] = dt
-        self.kf.transitionMatrix[1, 3] = dt
-        self.kf.transitionMatrix[0, 4] = 0.5 * dt * dt
-        self.kf.transitionMatrix[1, 5] = 0.5 * dt * dt
-        self.kf.transitionMatrix[2, 4] = dt
-        self.kf.transitionMatrix[3, 5] = dt
-        self.kf.transitionMatrix[6, 7] = dt
+        參數:
+        timestamp: 當前幀的擷取時間 (time.perf_counter)
+        """
+        self.update_time_step(timestamp)
         
         # 預測
         self.kf.predict()
@@ -167,6 +188,14 @@ class PoolDetector:
         self.pool_rect = None             # 矩形水池邊界
         self.output_width = None          # 矩形水池透視變換輸出寬度
         self.output_height = None          # 矩形水池透視變換輸出高度
+        # 針對[多邊形水池]的參數 (座標系統與矩形水池相同，以多邊形輪廓決定水池範圍)
+        self.pool_polygon = None          # 多邊形水池輪廓 (透視變換後座標)
+        # 水池範圍遮罩(用於排除水池外的誤檢測)
+        self.detection_margin = 0.02      # 水池邊緣的容許範圍 (輸出大小的比例)
+        self.warped_mask = None           # 透視變換後畫面的水池遮罩
+        self.warped_mask_key = None       # 用於判斷遮罩是否需要重新計算
+        self.coordinates = None           # 座標轉換 (PoolCoordinates，校準結果改變時重新計算)
+        self.coordinates_key = None
         # ArUco 設定
         self.fixed_marker_ids = fixed_marker_ids # 固定Marker ID
         self.aruco_dict = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
@@ -175,6 +204,226 @@ class PoolDetector:
         self.aruco_params.adaptiveThreshWinSizeMin = 3
         self.aruco_params.adaptiveThreshWinSizeMax = 40
         self.aruco_params.adaptiveThreshWinSizeStep = 2
+        # 相機內部參數 (鏡頭畸變校正)
+        self.camera_matrix = None         # 相機內部參數矩陣
+        self.dist_coeffs = None           # 鏡頭畸變係數
+        self.rectify_maps = None          # 畸變校正+透視變換合併後的remap表
+        self.rectify_maps_key = None      # 用於判斷remap表是否需要重新計算
+        # 校準結果或檢測參數的版本 (每次改變時遞增，並行檢測依此判斷工作程序是否需要重新載入)
+        self.profile_version = 0
+
+    def set_camera_calibration(self, camera_matrix, dist_coeffs):
+        """設置相機內部參數與畸變係數"""
+        self.profile_version += 1
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64).ravel()
+        self.rectify_maps = None
+        self.rectify_maps_key = None
+        self.coordinates = None
+        print("已設置相機內部參數，將進行鏡頭畸變校正")
+
+    def load_camera_calibration(self, profile):
+        """從校準設定檔(dict)載入相機內部參數"""
+        if "camera_matrix" not in profile or "dist_coeffs" not in profile:
+            return False
+        self.set_camera_calibration(profile["camera_matrix"], profile["dist_coeffs"])
+        return True
+
+    def get_detector_parameters(self):
+        """取得目前的 ArUco 檢測參數 (dict，可寫入 JSON；DetectorParameters 本身無法 pickle/序列化)"""
+        return {name: getattr(self.aruco_params, name) for name in dir(self.aruco_params)
+                if not name.startswith("_") and not callable(getattr(self.aruco_params, name))}
+
+    def set_detector_parameters(self, values):
+        """套用 ArUco 檢測參數 (get_detector_parameters() 或 Detector_Tuner.py 產生的 dict)"""
+        self.profile_version += 1
+        for name, value in values.items():
+            setattr(self.aruco_params, name, value)
+
+    def load_detector_parameters(self, profile):
+        """從校準設定檔(dict)載入 Detector_Tuner.py 調整後的 ArUco 檢測參數"""
+        if profile.get("detector_parameters") is None:
+            return False
+        self.set_detector_parameters(profile["detector_parameters"])
+        print("已載入調整後的 ArUco 檢測參數")
+        return True
+
+    def to_profile(self):
+        """將水池校準結果(透視變換、水池參數與相機內部參數)轉換為可寫入 JSON 的 dict"""
+        def to_list(value):
+            return np.asarray(value).tolist() if value is not None else None
+
+        return {
+            "pool_shape": self.pool_shape,
+            "world_radius": self.world_radius,
+            "fixed_marker_ids": [int(marker_id) for marker_id in self.fixed_marker_ids],
+            "transform_matrix": to_list(self.transform_matrix),
+            "target_size": self.target_size,
+            "pool_center": to_list(self.pool_center),
+            "pool_radius": self.pool_radius,
+            "pool_rect": to_list(self.pool_rect),
+            "output_width": self.output_width,
+            "output_height": self.output_height,
+            "pool_polygon": to_list(self.pool_polygon),
+            "camera_matrix": to_list(self.camera_matrix),
+            "dist_coeffs": to_list(self.dist_coeffs),
+            "detector_parameters": self.get_detector_parameters(),
+        }
+
+    def load_profile(self, profile):
+        """從 to_profile() 產生的 dict 還原水池校準結果"""
+        self.profile_version += 1
+        self.pool_shape = profile["pool_shape"]
+        self.world_radius = profile["world_radius"]
+        self.fixed_marker_ids = profile["fixed_marker_ids"]
+        if profile["transform_matrix"] is not None:
+            self.transform_matrix = np.array(profile["transform_matrix"], dtype=np.float64)
+        self.target_size = profile["target_size"]
+        self.pool_center = tuple(profile["pool_center"]) if profile["pool_center"] is not None else None
+        self.pool_radius = profile["pool_radius"]
+        self.pool_rect = tuple(profile["pool_rect"]) if profile["pool_rect"] is not None else None
+        self.output_width = profile["output_width"]
+        self.output_height = profile["output_height"]
+        if profile.get("pool_polygon") is not None:
+            self.pool_polygon = np.array(profile["pool_polygon"], dtype=np.float32)
+        if profile.get("camera_matrix") is not None:
+            self.set_camera_calibration(profile["camera_matrix"], profile["dist_coeffs"])
+        if profile.get("detector_parameters") is not None:
+            self.set_detector_parameters(profile["detector_parameters"])
+
+    def undistort_points(self, points):
+        """
+        將原始影像中的點進行畸變校正 (批次處理)
+        points: (N, 2) 原始影像像素座標
+        回傳: (N, 2) 無畸變影像像素座標
+        """
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+        if self.camera_matrix is None or len(points) == 0:
+            return points.reshape(-1, 2)
+        undistorted = cv2.undistortPoints(points, self.camera_matrix, self.dist_coeffs, P=self.camera_matrix)
+        return undistorted.reshape(-1, 2)
+
+    def image_points_to_warped(self, points):
+        """將原始影像中的點一次轉換到透視變換後的座標系統(含畸變校正)"""
+        return self.get_coordinates().image_to_warped(points)
+
+    def get_coordinates(self):
+        """取得(必要時重新計算)水池座標轉換 (PoolCoordinates)"""
+        key = (self.pool_shape, self.pool_center, self.pool_radius, self.pool_rect, self.world_radius,
+               self.transform_matrix.tobytes() if self.transform_matrix is not None else None)
+        if self.coordinates is None or self.coordinates_key != key:
+            self.coordinates = PoolCoordinates(self)
+            self.coordinates_key = key
+        return self.coordinates
+
+    def get_output_size(self):
+        """取得透視變換後的輸出大小 (寬, 高)"""
+        if self.pool_shape in ("rectangle", "polygon") and self.output_width is not None and self.output_height is not None:
+            return self.output_width, self.output_height
+        return self.target_size, self.target_size
+
+    def get_pool_mask(self, canvas_width, canvas_height):
+        """
+        取得 FlowMap 畫布上的水池遮罩 (uint8，255 為水池內)
+        圓形水池為內切於畫布的圓；多邊形水池為輪廓映射到畫布後填滿的多邊形；
+        矩形水池佔滿整個畫布，回傳 None
+        """
+        mask = np.zeros((canvas_height, canvas_width), dtype=np.uint8)
+        if self.pool_shape == "circle":
+            cv2.ellipse(mask, (canvas_width // 2, canvas_height // 2), (canvas_width // 2, canvas_height // 2),
+                        0, 0, 360, 255, -1)
+            return mask
+        if self.pool_shape == "polygon" and self.pool_polygon is not None and self.pool_rect is not None:
+            polygon = self.get_coordinates().warped_to_canvas(self.pool_polygon, canvas_width, canvas_height)
+            cv2.fillPoly(mask, [polygon], 255)
+            return mask
+        return None
+
+    def get_warped_pool_mask(self):
+        """取得(必要時重新計算)透視變換後畫面的水池遮罩 (含邊緣容許範圍)，矩形水池回傳 None"""
+        if self.pool_shape == "rectangle" or self.transform_matrix is None:
+            return None
+        polygon = self.pool_polygon.tobytes() if self.pool_polygon is not None else None
+        key = (self.pool_shape, self.pool_center, self.pool_radius, polygon, self.get_output_size(), self.detection_margin)
+        if self.warped_mask is None or self.warped_mask_key != key:
+            width, height = self.get_output_size()
+            margin = int(round(max(width, height) * self.detection_margin))
+            mask = np.zeros((height, width), dtype=np.uint8)
+            if self.pool_shape == "circle" and self.pool_radius is not None:
+                cv2.circle(mask, tuple(int(c) for c in self.pool_center), int(self.pool_radius) + margin, 255, -1)
+            elif self.pool_shape == "polygon" and self.pool_polygon is not None:
+                cv2.fillPoly(mask, [np.round(self.pool_polygon).astype(np.int32)], 255)
+                if margin > 0:
+                    mask = cv2.dilate(mask, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * margin + 1, 2 * margin + 1)))
+            else:
+                mask[:] = 255
+            self.warped_mask = mask
+            self.warped_mask_key = key
+        return self.warped_mask
+
+    def is_inside_pool(self, u, v):
+        """判斷透視變換後畫面上的點是否位於水池內 (用於排除水池外的誤檢測)"""
+        mask = self.get_warped_pool_mask()
+        if mask is None:
+            return True
+        height, width = mask.shape
+        if not (0 <= u < width and 0 <= v < height):
+            return False
+        return mask[int(v), int(u)] > 0
+
+    def warp_frame(self, frame, interpolation=cv2.INTER_NEAREST):
+        """
+        對影像進行透視變換[依照圓形/矩形水池決定最終透視變換後的圖片大小]
+        若已設置相機內部參數，畸變校正與透視變換合併為單一的remap(只需一次全畫面處理)
+        """
+        output_size = self.get_output_size()
+        if self.camera_matrix is None:
+            return cv2.warpPerspective(
+                frame,
+                self.transform_matrix,
+                output_size,
+                flags=interpolation,
+                borderMode=cv2.BORDER_CONSTANT,
+                borderValue=(0, 0, 0)
+            )
+
+        map1, map2 = self.get_rectify_maps(output_size)
+        return cv2.remap(
+            frame, map1, map2, interpolation,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=(0, 0, 0)
+        )
+
+    def get_rectify_maps(self, output_size):
+        """取得(必要時重新計算)畸變校正與透視變換合併後的remap表"""
+        key = (self.transform_matrix.tobytes(), tuple(output_size))
+        if self.rectify_maps is None or self.rectify_maps_key != key:
+            self.rectify_maps = self.compute_rectify_maps(self.transform_matrix, output_size)
+            self.rectify_maps_key = key
+        return self.rectify_maps
+
+    def compute_rectify_maps(self, transform_matrix, output_size):
+        """計算指定透視變換矩陣的remap表 (不更新快取，可在背景執行緒預先計算)"""
+        # 輸出像素 p -> 無畸變影像座標 H^-1 p -> 正規化相機座標 K^-1 H^-1 p -> 套用畸變 -> 原始影像座標
+        # 因此以 H*K 作為 initUndistortRectifyMap 的新相機矩陣
+        new_camera_matrix = np.asarray(transform_matrix, dtype=np.float64) @ self.camera_matrix
+        return cv2.initUndistortRectifyMap(
+            self.camera_matrix, self.dist_coeffs, None,
+            new_camera_matrix, tuple(output_size), cv2.CV_16SC2
+        )
+
+    def set_transform_matrix(self, transform_matrix, rectify_maps=None):
+        """
+        替換透視變換矩陣 (追蹤中的偏移校正，透視變換後的座標系統不變)
+        rectify_maps: 預先以 compute_rectify_maps 計算好的remap表 (None 時於下一次 warp_frame 重新計算)
+        """
+        transform_matrix = np.asarray(transform_matrix, dtype=np.float64)
+        if rectify_maps is not None:
+            # 先設置 key 再替換矩陣，確保 get_rectify_maps 不會將新的remap表視為過期
+            self.rectify_maps = rectify_maps
+            self.rectify_maps_key = (transform_matrix.tobytes(), tuple(self.get_output_size()))
+        self.transform_matrix = transform_matrix
+        self.profile_version += 1
 
     def image_to_canvas_coords(self, img_x, img_y, canvas_width, canvas_height=None):
         """將圖像座標轉換為畫布座標[用於訂定FlowMap的畫布大小]"""
@@ -182,30 +431,8 @@ class PoolDetector:
         if canvas_height is None:
             canvas_height = canvas_width # 針對圓形水池的處理(透視變換結果為方形)
 
-        if self.pool_shape == "circle":
-            # 原有的圓形處理邏輯
-            u_c, v_c = self.pool_center
-            dx, dy = img_x - u_c, img_y - v_c
-            
-            rho = np.sqrt(dx**2 + dy**2) / self.pool_radius
-            theta = np.arctan2(dy, dx)
-            
-            canvas_x = int(canvas_width/2 + canvas_width/2 * rho * np.cos(theta))
-            canvas_y = int(canvas_height/2 + canvas_height/2 * rho * np.sin(theta))
-            
-        elif self.pool_shape == "rectangle" and self.pool_rect is not None:
-            # 矩形處理邏輯
-            rect_x, rect_y, rect_w, rect_h = self.pool_rect
-            
-            # 計算輸入點在矩形內的相對位置 (0~1)
-            rel_x = max(0, min(1, (img_x - rect_x) / rect_w))
-            rel_y = max(0, min(1, (img_y - rect_y) / rect_h))
-
-            # 直接映射到畫布座標
-            canvas_x = int(rel_x * canvas_width)
-            canvas_y = int(rel_y * canvas_height)
-            
-        return canvas_x, canvas_y
+        canvas_x, canvas_y = self.get_coordinates().warped_to_canvas([img_x, img_y], canvas_width, canvas_height)[0]
+        return int(canvas_x), int(canvas_y)
     
     def fit_rectangle_to_points(self, points):
         """使用標註點擬合矩形"""
@@ -231,8 +458,14 @@ class PoolDetector:
     def setup_perspective_transform_with_client_points(self, frame, client_points):
         """使用Client傳送的標註點設置透視變換矩陣"""
         print("使用Client傳送的標註點建立透視變換...")
+        self.profile_version += 1
         
-        if len(client_points) != 4:
+        if self.pool_shape == "polygon":
+            # 多邊形水池: 標註點為水池輪廓(至少3個點)
+            if len(client_points) < 3:
+                print(f"錯誤: 多邊形水池需要至少3個點，但收到 {len(client_points)} 個點")
+                return False
+        elif len(client_points) != 4:
             print(f"錯誤: 需要4個點，但收到 {len(client_points)} 個點")
             return False
         
@@ -242,8 +475,14 @@ class PoolDetector:
         # 顯示原始畫面與標註點
         display_frame = frame.copy()
         
-        # 將標註點轉換為numpy數組
-        points = np.array(client_points, dtype=np.float32)
+        # 將標註點轉換為numpy數組(若有相機內部參數，先進行畸變校正)
+        points = self.undistort_points(np.array(client_points, dtype=np.float32))
+
+        outline = None
+        if self.pool_shape == "polygon":
+            # 以輪廓的最小外接矩形作為透視變換的參考點，之後與矩形水池的處理相同
+            outline = points
+            points = cv2.boxPoints(cv2.minAreaRect(outline)).astype(np.float32)
         
         if self.pool_shape == "circle":
             # 原有的圓形處理邏輯
@@ -309,7 +548,7 @@ class PoolDetector:
 
             return True # 代表圓形水池透視變換成功
             
-        elif self.pool_shape == "rectangle":
+        elif self.pool_shape in ("rectangle", "polygon"):
             print("處理矩形水池透視變換...")
         
             # ===== 排序點的順序 =====
@@ -396,6 +635,11 @@ class PoolDetector:
             print("透視變換矩陣計算完成:")
             print(self.transform_matrix)
             print(f"矩形水池參數: {self.pool_rect}")
+
+            if outline is not None:
+                # 多邊形輪廓轉換到透視變換後的座標
+                self.pool_polygon = cv2.perspectiveTransform(outline.reshape(-1, 1, 2), self.transform_matrix).reshape(-1, 2)
+                print(f"多邊形水池輪廓: {len(self.pool_polygon)} 個頂點")
              
             return True # 代表矩形水池透視變換成功
         
@@ -502,7 +746,8 @@ class PoolDetector:
     def calibrate_pool_with_water_jets(self, water_jet_vectors):
         """使用射水向量的起點來校準水池參數"""
         print("使用射水向量起點校準水池參數...")
-        
+        self.profile_version += 1
+
         if not water_jet_vectors or len(water_jet_vectors) < 6:
             print(f"錯誤: 需要6個射水向量，但收到 {len(water_jet_vectors)} 個")
             return False
@@ -547,7 +792,7 @@ class PoolDetector:
                 print(f"使用預設值 - 水池圓心: {self.pool_center}, 半徑: {self.pool_radius}")
                 return False
             
-        elif self.pool_shape == "rectangle":
+        elif self.pool_shape in ("rectangle", "polygon"):
             # 矩形處理邏輯
             rect_info = self.fit_rectangle_to_points(points)
             print(f"矩形參數:{rect_info}")
@@ -563,18 +808,19 @@ class PoolDetector:
                     warped_aspect_ratio = self.output_width / self.output_height
                     print(f"透視變換後圖像寬高比: {warped_aspect_ratio:.2f} (寬={self.output_width}, 高={self.output_height})")
                     
+                    # 透視變換後的畫面即為水池範圍(輸出大小為 output_width x output_height，不需置中)
                     if warped_aspect_ratio > 1:
                         # 透視變換後的圖像是橫向的
                         rect_width = self.target_size
                         rect_height = int(self.target_size / warped_aspect_ratio)
                         rect_x = 0
-                        rect_y = (self.target_size - rect_height) // 2
+                        rect_y = 0
                         print("根據透視變換後的圖像判斷: 寬大於高(橫矩形)")
                     else:
                         # 透視變換後的圖像是縱向的
                         rect_height = self.target_size
                         rect_width = int(self.target_size * warped_aspect_ratio)
-                        rect_x = (self.target_size - rect_width) // 2
+                        rect_x = 0
                         rect_y = 0
                         print("根據透視變換後的圖像判斷: 高大於寬(縱矩形)")
                 else:
@@ -610,17 +856,37 @@ class PoolDetector:
 class FlowMapGenerator:
     """FlowMap 生成器類"""
     
-    def __init__(self, canvas_width=1024, canvas_height=None, sample_frames=30):
-        """初始化 FlowMap 生成器"""
+    def __init__(self, canvas_width=1024, canvas_height=None, sample_frames=30, mode="brush"):
+        """
+        初始化 FlowMap 生成器
+        mode: "brush" (FlowMap 衰減趨近背景色，只有筆刷軌跡經過的位置有顏色)
+              "interpolate" (由所有 Marker 的速度內插出整個水池的速度場，FlowMap 衰減趨近該速度場)
+              "physics" (以網格流體模擬演算水流，Marker 速度與射水動量作為外力，FlowMap 直接顯示模擬的速度場)
+        """
         self.canvas_width = canvas_width
         self.canvas_height = canvas_height if canvas_height is not None else canvas_width
         self.sample_frames = sample_frames
+        self.mode = mode
+        self.interpolation_method = "idw"   # 速度場內插方法 ("idw" 或 "rbf")
+        self.interpolation_grid_size = 64   # 速度場內插網格的長邊大小
+        self.velocity_interpolator = None   # 第一次使用時建立
+        self.physics_grid_size = 128        # 流體模擬網格的長邊大小
+        self.world_radius = 2.5             # 歸一化座標 1 對應的世界距離 (由 ArUcoTracker 設定)
+        self.flow_solver = None             # 流體模擬 (第一次使用時建立)
+        self.pending_jets = []              # 本幀要加入流體模擬的射水 [(起點x, 起點y, 方向x, 方向y), ...]
         
         self.background_color = (0,128,128) # 背景色
+        self.metrics = metrics # 效能指標紀錄
         self.reset_flow_map()  # 使用方法來初始化和重置
         self.marker_history = {}  # 記錄每個 marker 的歷史位置
         self.current_frame = 0
         self.last_saved_frame = 0  # 追蹤上次儲存的幀號
+        self.last_frame_seq = None     # 最近一次累積到 FlowMap 的幀序號
+        self.last_capture_time = None  # 最近一次累積到 FlowMap 的幀擷取時間 (time.perf_counter)
+        self.archiver = None           # FlowMap 歷史封存 (FlowMapArchiveWriter，None 表示不封存)
+        self.base_pool_mask = None     # 初始畫布大小的水池遮罩 (None 表示整個畫布皆為水池)
+        self.pool_mask = None          # 目前畫布大小的水池遮罩 (PoolMask)
+        self.mask_background = None    # 水池外固定使用的背景影像
 
         # ** 速度追蹤 **
         self.velocity_history = []  # 用於記錄所有 marker 的速度歷史資料
@@ -631,16 +897,36 @@ class FlowMapGenerator:
         #筆刷半徑大小設定(圓形筆刷)
         self.brush_radius = 20
 
+        # 高斯模糊設定(模糊次數與核心大小)
+        self.blur_passes = 3
+        self.blur_kernel_size = 31
+
+        # 初始畫布大小與筆刷/模糊設定(用於依品質等級縮放畫布)
+        self.base_canvas_width = self.canvas_width
+        self.base_canvas_height = self.canvas_height
+        self.base_brush_radius = self.brush_radius
+        self.base_blur_kernel_size = self.blur_kernel_size
+
         # 平滑過度處理
         self.decay_factor = 0.95
         # 初始化累積用的FlowMap
         self.accumulated_flowmap = np.zeros((self.canvas_height, self.canvas_width, 3), dtype=np.uint8)
         self.accumulated_flowmap[:, :] = self.background_color
+        self.allocate_workspaces()
         
     def reset_flow_map(self):
         """重置 FlowMap 為初始狀態"""
         self.flow_map = np.ones((self.canvas_height, self.canvas_width, 3), dtype=np.uint8)
         self.flow_map[:, :] = self.background_color
+
+    def allocate_workspaces(self):
+        """
+        配置與畫布大小相同的工作緩衝區 (畫布大小改變時重新配置)
+        每幀的衰減、模糊與累積直接寫入這些緩衝區，不在熱路徑上配置新的陣列
+        """
+        self.background_image = np.empty_like(self.flow_map)  # 背景色影像 (衰減的目標與水池外的固定背景)
+        self.background_image[:, :] = self.background_color
+        self.blur_buffer = np.empty_like(self.flow_map)       # 高斯模糊交替寫入的緩衝區
     
     def add_marker_data(self, marker_id, position, velocity):
         """
@@ -661,8 +947,8 @@ class FlowMapGenerator:
             'frame': self.current_frame
         })
 
-        # 只保留最近 sample_frames 幀的數據
-        if len(self.marker_history[marker_id]) > self.sample_frames:
+        # 只保留最近 sample_frames 幀的數據(sample_frames 可能在執行中被調低)
+        while len(self.marker_history[marker_id]) > self.sample_frames:
             self.marker_history[marker_id].pop(0)
         
         # ** 紀錄速度大小至Globa1 歷史資料中
@@ -684,16 +970,35 @@ class FlowMapGenerator:
         
         # 如果沒有足夠的歷史數據，則不更新
         if self.current_frame < self.sample_frames:
+            self.pending_jets.clear()
             return
         
-        background = np.ones_like(self.flow_map, dtype=np.uint8)
-        background[:, :] = self.background_color
+        stage_start = time.perf_counter()
+        if self.mode == "physics":
+            # 流體模擬的速度場已經平滑，不需要衰減、筆刷與模糊
+            self.simulate_flow()
+            if self.pool_mask is not None:
+                self.pool_mask.pin_outside(self.flow_map, self.mask_background)
+            stage_start = self.record_stage("flowmap.physics", stage_start)
+            self.accumulate_flow_map(stage_start)
+            return
 
-        self.flow_map = cv2.addWeighted(
-            self.flow_map, self.decay_factor,
-            background, 1 - self.decay_factor,
-            0
-        )
+        if self.mode == "interpolate":
+            background = self.interpolate_velocity_field()
+            stage_start = self.record_stage("flowmap.interpolate", stage_start)
+        else:
+            background = self.background_image
+
+        if self.pool_mask is not None:
+            # 只衰減與水池重疊的區塊
+            self.pool_mask.add_weighted(self.flow_map, self.decay_factor, background, 1 - self.decay_factor, self.flow_map)
+        else:
+            cv2.addWeighted(
+                self.flow_map, self.decay_factor,
+                background, 1 - self.decay_factor,
+                0, dst=self.flow_map
+            )
+        stage_start = self.record_stage("flowmap.decay", stage_start)
         
         for marker_id, history in self.marker_history.items():
             if len(history) < 2 :  # 至少要有兩個點的位置資訊，才能繪製ArUco Marker的移動軌跡
@@ -769,17 +1074,155 @@ class FlowMapGenerator:
                         y = int(prev_y + alpha * (curr_y - prev_y))
                         cv2.circle(self.flow_map, (x, y), self.brush_radius, color, -1)
 
+        stage_start = self.record_stage("flowmap.brush", stage_start)
+
         # 應用高斯模糊使 FlowMap 更平滑
-        temp = self.flow_map.copy()
-        for _ in range(3):
-            temp = cv2.GaussianBlur(temp, (31,31), 0)
-        self.flow_map = temp
+        if self.pool_mask is not None:
+            # 畫到水池外的筆刷軌跡恢復為背景色，只模糊水池的外接區塊範圍
+            self.pool_mask.pin_outside(self.flow_map, self.mask_background)
+            roi = self.flow_map[self.pool_mask.roi]
+            blurred = self.blur(roi, self.blur_buffer[self.pool_mask.roi])
+            if blurred is not roi:
+                np.copyto(roi, blurred)
+            self.pool_mask.pin_outside(self.flow_map, self.mask_background)
+        else:
+            blurred = self.blur(self.flow_map, self.blur_buffer)
+            if blurred is not self.flow_map:
+                # 模糊結果在緩衝區時交換兩者，不需複製
+                self.flow_map, self.blur_buffer = self.blur_buffer, self.flow_map
+        stage_start = self.record_stage("flowmap.blur", stage_start)
+        self.accumulate_flow_map(stage_start)
+
+    def accumulate_flow_map(self, stage_start):
+        """將本幀 FlowMap 與過去累積的結果結合，並寫入歷史封存"""
+        if self.pool_mask is not None:
+            self.pool_mask.add_weighted(self.accumulated_flowmap, 0.5, self.flow_map, 0.5, self.accumulated_flowmap)
+            self.pool_mask.pin_outside(self.accumulated_flowmap, self.mask_background)  # 射水直接繪製在累積的FlowMap上
+        else:
+            # 將過去累積的FlowMap結果與當前FlowMap結合(uint8 輸出已飽和至 0~255，不需再 clip)
+            cv2.addWeighted(self.accumulated_flowmap, 0.5, self.flow_map, 0.5, 0, dst=self.accumulated_flowmap)
+        stage_start = self.record_stage("flowmap.accumulate", stage_start)
 
-        self.accumulated_flowmap = cv2.addWeighted(self.accumulated_flowmap,0.5,self.flow_map,0.5,0) # 將過去累積的FlowMap結果與當前FlowMap結合
-        self.accumulated_flowmap = np.clip(self.accumulated_flowmap, 0, 255)  # 確保不超過 255
+        # 將累積的FlowMap寫入歷史封存
+        if self.archiver is not None:
+            self.archiver.append(self.current_frame, self.accumulated_flowmap)
+            self.record_stage("flowmap.archive", stage_start)
+
+    def blur(self, image, buffer):
+        """
+        對 image 做 blur_passes 次高斯模糊，每次在 image 與 buffer 之間交替寫入 (兩者大小相同)
+        回傳結果所在的陣列 (image 或 buffer)
+        """
+        ksize = (self.blur_kernel_size, self.blur_kernel_size)
+        src, dst = image, buffer
+        for _ in range(self.blur_passes):
+            cv2.GaussianBlur(src, ksize, 0, dst=dst)
+            src, dst = dst, src
+        return src
+
+    def current_marker_data(self):
+        """本幀所有 Marker 的位置與速度 (只使用本幀加入的資料，已消失的 Marker 不會再更新歷史記錄)"""
+        positions = []
+        velocities = []
+        for history in self.marker_history.values():
+            if history and history[-1]['frame'] >= self.current_frame - 1:
+                positions.append(history[-1]['position'])
+                velocities.append(history[-1]['velocity'])
+        return positions, velocities
+
+    def add_jet_force(self, start_x, start_y, dir_x, dir_y):
+        """加入本幀的射水動量 (physics 模式，起點為歸一化座標，方向為單位向量)"""
+        self.pending_jets.append((start_x, start_y, dir_x, dir_y))
+
+    def simulate_flow(self):
+        """前進一步流體模擬，並將速度場編碼為 FlowMap 顏色後放大到畫布大小 (直接寫入 flow_map)"""
+        if self.flow_solver is None:
+            grid_scale = self.physics_grid_size / max(self.base_canvas_width, self.base_canvas_height)
+            self.flow_solver = FlowSolver(
+                grid_width=max(8, int(round(self.base_canvas_width * grid_scale))),
+                grid_height=max(8, int(round(self.base_canvas_height * grid_scale))),
+                world_radius=self.world_radius,
+                mask=self.base_pool_mask
+            )
+        positions, velocities = self.current_marker_data()
+        grid_velocity = self.flow_solver.step(positions, velocities, self.pending_jets)
+        self.pending_jets.clear()
+        encoded = encode_velocity_field(grid_velocity, self.max_velocity, self.background_color)
+        return cv2.resize(encoded, (self.canvas_width, self.canvas_height), dst=self.flow_map,
+                          interpolation=cv2.INTER_LINEAR)
+
+    def interpolate_velocity_field(self):
+        """
+        由本幀所有 Marker 的位置與速度內插出稠密速度場，並編碼為與筆刷軌跡相同的 FlowMap 顏色
+        (在粗網格上內插與編碼後再放大到畫布大小)；沒有 Marker 時回傳背景色
+        """
+        positions, velocities = self.current_marker_data()
+        if not positions:
+            return self.background_image
+
+        if self.velocity_interpolator is None or self.velocity_interpolator.method != self.interpolation_method:
+            grid_scale = self.interpolation_grid_size / max(self.base_canvas_width, self.base_canvas_height)
+            self.velocity_interpolator = VelocityFieldInterpolator(
+                grid_width=max(2, int(round(self.base_canvas_width * grid_scale))),
+                grid_height=max(2, int(round(self.base_canvas_height * grid_scale))),
+                method=self.interpolation_method
+            )
+        grid_velocity = self.velocity_interpolator.interpolate(positions, velocities)
+        encoded = encode_velocity_field(grid_velocity, self.max_velocity, self.background_color)
+        # 放大寫入模糊緩衝區 (速度場只在衰減時使用，之後模糊才會覆寫緩衝區)
+        return self.velocity_interpolator.upsample(encoded, self.canvas_width, self.canvas_height, dst=self.blur_buffer)
+
+    def set_pool_mask(self, mask):
+        """
+        設定水池遮罩 (初始畫布大小，255 為水池內；None 表示整個畫布皆為水池)
+        之後衰減、模糊與累積只處理水池範圍，水池外固定為背景色
+        """
+        self.base_pool_mask = mask
+        if self.flow_solver is not None:
+            self.flow_solver.set_mask(mask)
+        self.update_pool_mask()
+
+    def update_pool_mask(self):
+        """依目前畫布大小重新計算水池遮罩"""
+        if self.base_pool_mask is None:
+            self.pool_mask = None
+            self.mask_background = None
+            return
+        mask = self.base_pool_mask
+        if mask.shape[:2] != (self.canvas_height, self.canvas_width):
+            mask = cv2.resize(mask, (self.canvas_width, self.canvas_height), interpolation=cv2.INTER_NEAREST)
+        self.pool_mask = PoolMask(mask)
+        self.mask_background = self.background_image
+        self.pool_mask.pin_outside(self.flow_map, self.mask_background)
+        self.pool_mask.pin_outside(self.accumulated_flowmap, self.mask_background)
+
+    def record_stage(self, name, stage_start):
+        """記錄從 stage_start 到現在的處理時間，回傳現在時間作為下一段的起點"""
+        now = time.perf_counter()
+        self.metrics.record(name, now - stage_start)
+        return now
+
+    def set_canvas_scale(self, scale):
+        """
+        依照初始畫布大小的比例調整畫布解析度(保留目前的 FlowMap 內容)
+        筆刷半徑與模糊核心大小隨畫布等比例縮放
+        """
+        width = max(1, int(round(self.base_canvas_width * scale)))
+        height = max(1, int(round(self.base_canvas_height * scale)))
+        if (width, height) == (self.canvas_width, self.canvas_height):
+            return
+
+        self.canvas_width = width
+        self.canvas_height = height
+        self.flow_map = cv2.resize(self.flow_map, (width, height), interpolation=cv2.INTER_LINEAR)
+        self.accumulated_flowmap = cv2.resize(self.accumulated_flowmap, (width, height), interpolation=cv2.INTER_LINEAR)
+        self.allocate_workspaces()
+        self.brush_radius = max(1, int(round(self.base_brush_radius * scale)))
+        self.blur_kernel_size = max(3, int(self.base_blur_kernel_size * scale) | 1)  # 高斯核心大小必須為奇數
+        self.update_pool_mask()
 
     def get_flow_map(self):
-        """獲取當前的 FlowMap"""
+        """獲取當前的 FlowMap (工作緩衝區，之後的幀會直接覆寫，需要保留時請複製)"""
         return self.flow_map
     
     def should_save_and_reset(self, save_interval=30 ,image_server=None):
@@ -816,21 +1259,20 @@ class WaterJet:
         print(f"已更新射水向量: {len(self.water_jet_vectors)} 個")
     
     def apply_water_jets(self, frame):
-        """在畫面上應用射水效果並更新FlowMap"""
+        """在畫面上應用射水效果並更新FlowMap (frame 為 None 時只更新FlowMap)"""
         if not self.water_jet_vectors:
             return frame  # 如果沒有射水向量，直接返回原始幀
         
-        output_frame = frame.copy()
+        output_frame = frame.copy() if frame is not None else None
 
         canvas_width = self.flow_map_generator.canvas_width
         canvas_height = self.flow_map_generator.canvas_height
 
-        if self.pool_detector.pool_shape == "rectangle":
-            # 獲取原始透視變換後的圖片尺寸
-            orig_width = self.pool_detector.output_width
-            orig_height = self.pool_detector.output_height
+        # 一次將所有射水起點轉換為FlowMap畫布座標
+        vectors = np.asarray(self.water_jet_vectors, dtype=np.float64).reshape(-1, 4)
+        canvas_starts = self.pool_detector.get_coordinates().warped_to_canvas(vectors[:, :2], canvas_width, canvas_height)
         
-        for start_x, start_y, end_x, end_y in self.water_jet_vectors:
+        for (start_x, start_y, end_x, end_y), (start_canvas_x, start_canvas_y) in zip(self.water_jet_vectors, canvas_starts):
             # 計算射水方向向量
             jet_dx = end_x - start_x
             jet_dy = end_y - start_y
@@ -842,21 +1284,12 @@ class WaterJet:
                 # 歸一化方向向量
                 jet_dx /= jet_length
                 jet_dy /= jet_length
-                
-                if self.pool_detector.pool_shape == "circle":
-                    # 將畫面座標轉換為FlowMap座標[原始圓形水池處理邏輯]
-                    start_canvas_x, start_canvas_y = self.pool_detector.image_to_canvas_coords(
-                        start_x, start_y, canvas_width, canvas_height)
-                    
-                if self.pool_detector.pool_shape == "rectangle":
-                    # 將畫面座標轉換為FlowMap座標
-                    # 確保起點座標在原始透視變換後的圖片範圍內
-                    start_x_norm = min(max(0, start_x), orig_width - 1) / orig_width
-                    start_y_norm = min(max(0, start_y), orig_height - 1) / orig_height
-                    
-                    # 將歸一化座標映射到FlowMap畫布
-                    start_canvas_x = int(start_x_norm * canvas_width)
-                    start_canvas_y = int(start_y_norm * canvas_height)
+
+                if self.flow_map_generator.mode == "physics":
+                    # 射水動量交由流體模擬處理，不直接繪製
+                    self.flow_map_generator.add_jet_force(
+                        start_canvas_x / canvas_width * 2 - 1, start_canvas_y / canvas_height * 2 - 1, jet_dx, jet_dy)
+                    continue
                 
                 # 繪製射水效果
                 for i in range(1, self.jet_length_pixels + 1):
@@ -900,13 +1333,16 @@ class WaterJet:
 class ArUcoTracker:
     """ArUco Marker 追蹤"""
     
-    def __init__(self, pool_detector):
-        """初始化 ArUco 追蹤器"""
+    def __init__(self, pool_detector, flow_mode="brush"):
+        """
+        初始化 ArUco 追蹤器
+        flow_mode: FlowMap 生成模式 ("brush"、"interpolate" 或 "physics"，見 FlowMapGenerator)
+        """
         self.pool_detector = pool_detector
         self.marker_trackers = {}  # 儲存所有標記的卡爾曼濾波器
         self.last_seen = {}        # 儲存最後一次看到的標記信息
         # 根據水池形狀決定畫布尺寸
-        if pool_detector.pool_shape == "rectangle" and pool_detector.pool_rect is not None:
+        if pool_detector.pool_shape in ("rectangle", "polygon") and pool_detector.pool_rect is not None:
             rect_x, rect_y, rect_w, rect_h = pool_detector.pool_rect
             
             # 使用與水池相同的寬高比例，但最大尺寸限制為1024
@@ -925,7 +1361,8 @@ class ArUcoTracker:
             self.flow_map_generator = FlowMapGenerator(
                 canvas_width=canvas_width, 
                 canvas_height=canvas_height, 
-                sample_frames=30
+                sample_frames=30,
+                mode=flow_mode
             )
             print(f"創建矩形FlowMap畫布: {canvas_width}x{canvas_height}")
         else:
@@ -933,85 +1370,85 @@ class ArUcoTracker:
             self.flow_map_generator = FlowMapGenerator(
                 canvas_width=1024, 
                 canvas_height=1024, 
-                sample_frames=30
+                sample_frames=30,
+                mode=flow_mode
             )
+        self.flow_map_generator.world_radius = pool_detector.world_radius
+        self.flow_map_generator.set_pool_mask(pool_detector.get_pool_mask(
+            self.flow_map_generator.canvas_width, self.flow_map_generator.canvas_height))
         self.water_jet = WaterJet(pool_detector, self.flow_map_generator)  # 射水模擬class
         self.running = True  # 控制追蹤執行緒的標誌
+        self.detection_scale = 1.0  # 檢測解析度比例(小於1時先縮小影像再檢測)
+        # 檢測模式: "full" 以 detection_scale 的解析度檢測；
+        # "pyramid" 依 Marker 的像素大小自動選擇金字塔層級，在縮小的影像上檢測後於原始解析度精細化角點
+        self.detection_mode = "full"
+        self.pyramid_min_marker_size = 24    # 檢測層級上 Marker 邊長的最小像素數 (決定可縮小的層級)
+        self.pyramid_max_level = 3           # 最多縮小的層級 (每一層為上一層的 1/2)
+        self.pyramid_refresh_interval = 30   # 每隔多少幀以原始解析度檢測一次 (重新量測 Marker 大小並找回較小的 Marker)
+        self.pyramid_state = {}              # 每種影像(original/warped)最近量測的最小 Marker 邊長與距離上次原始解析度檢測的幀數
+        self.drift_corrector = None # 透視變換偏移校正 (HomographyDriftCorrector，None 表示不校正)
+        self.metrics = metrics      # 效能指標紀錄
     
     def world_to_image(self, X, Y):
         """將世界座標轉換為影像座標"""
-        if self.pool_detector.pool_shape == "circle":
-            # 從世界座標轉回極座標
-            rho = np.sqrt(X**2 + Y**2) / self.pool_detector.world_radius
-            theta = np.arctan2(Y, X)
-            
-            # 從極座標轉回畫面座標
-            u = int(self.pool_detector.pool_center[0] + 
-                self.pool_detector.pool_radius * rho * np.cos(theta))
-            v = int(self.pool_detector.pool_center[1] + 
-                self.pool_detector.pool_radius * rho * np.sin(theta))
-            
-        elif self.pool_detector.pool_shape == "rectangle" and self.pool_detector.pool_rect is not None:
-            # 矩形水池處理邏輯
-            rect_x, rect_y, rect_w, rect_h = self.pool_detector.pool_rect
-            
-            # 將世界座標 (-world_radius ~ world_radius) 映射到矩形水池座標 (0 ~ rect_w/rect_h)
-            norm_x = (X / self.pool_detector.world_radius + 1) / 2
-            norm_y = (Y / self.pool_detector.world_radius + 1) / 2
-            
-            u = int(rect_x + norm_x * rect_w)
-            v = int(rect_y + norm_y * rect_h)
-            
-        else:
+        coordinates = self.pool_detector.get_coordinates()
+        if not coordinates.valid:
             # 參數未正確初始化，使用預設值
             print(f"警告: 水池參數未正確初始化 (形狀: {self.pool_detector.pool_shape})")
-            u, v = 0, 0
-        return u, v
+            return 0, 0
+        u, v = coordinates.world_to_warped([X, Y])[0]
+        return int(u), int(v)
     
     def update_water_jet_vectors(self, vectors):
         """更新射水向量"""
         self.water_jet.update_water_jet_vectors(vectors)
         print("已更新射水向量")
         
-    def process_frame(self, frame):
+    def process_frame(self, frame, capture_time=None):
         """處理一幀並追蹤 ArUco 標記"""
+        warped_frame, corners, ids_list = self.detect_markers(frame)
+        return self.track_markers(warped_frame, corners, ids_list, capture_time)
+
+    def detect_markers(self, frame):
+        """
+        [檢測階段] 在原始影像與透視變換後的影像中檢測 ArUco Marker
+        (OpenCV 運算期間會釋放 GIL，可與其他執行緒並行)
+        frame: BGR 影像，或相機直接提供的灰階(亮度)影像 (CameraCapture.read_luma，不需灰階轉換)
+
+        回傳:
+        warped_frame: 透視變換後的影像 (與 frame 相同的通道數)
+        corners: 角點列表 (皆位於透視變換後的座標系統)
+        ids_list: 對應的 Marker ID 列表
+        """
+        if self.drift_corrector is not None:
+            self.drift_corrector.apply_pending()  # 在幀與幀之間替換偏移校正後的透視變換
+
         # 先在原始影像中檢測 ArUco Marker
-        gray_original = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        corners_original, ids_original, _ = cv2.aruco.detectMarkers(
-            gray_original, self.pool_detector.aruco_dict, 
-            parameters=self.pool_detector.aruco_params
-        )
+        with self.metrics.timer("detect.original"):
+            gray_original = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            corners_original, ids_original = self.detect_aruco(gray_original, "original")
+        if self.drift_corrector is not None:
+            self.drift_corrector.observe_image(corners_original, ids_original)
 
         # 應用透視變換[依照圓形/矩形水池決定最終透視變換後的圖片大小]
-        if self.pool_detector.pool_shape == "rectangle" and self.pool_detector.output_width is not None and self.pool_detector.output_height is not None:
-            # 矩形水池使用指定的寬高
-            warped_frame = cv2.warpPerspective(
-                frame, 
-                self.pool_detector.transform_matrix, 
-                (self.pool_detector.output_width, self.pool_detector.output_height),
-                flags=cv2.INTER_NEAREST,
-                borderMode=cv2.BORDER_CONSTANT,
-                borderValue=(0, 0, 0)
-            )
-        else:
-            # 圓形水池使用正方形輸出
-            warped_frame = cv2.warpPerspective(
-                frame, 
-                self.pool_detector.transform_matrix, 
-                (self.pool_detector.target_size, self.pool_detector.target_size),
-                flags=cv2.INTER_NEAREST,
-                borderMode=cv2.BORDER_CONSTANT,
-                borderValue=(0, 0, 0)
-            )
+        with self.metrics.timer("detect.warp"):
+            warped_frame = self.pool_detector.warp_frame(frame)
         
         # 在變換後的影像中檢測 ArUco Marker
-        gray_warped = cv2.cvtColor(warped_frame, cv2.COLOR_BGR2GRAY)
-        corners_warped, ids_warped, _ = cv2.aruco.detectMarkers(
-            gray_warped, self.pool_detector.aruco_dict, 
-            parameters=self.pool_detector.aruco_params
-        )
-        
-        # 合併兩次檢測結果
+        with self.metrics.timer("detect.warped"):
+            gray_warped = warped_frame if warped_frame.ndim == 2 else cv2.cvtColor(warped_frame, cv2.COLOR_BGR2GRAY)
+            corners_warped, ids_warped = self.detect_aruco(gray_warped, "warped")
+
+        corners, ids_list = self.merge_detections(corners_warped, ids_warped, corners_original, ids_original)
+        return warped_frame, corners, ids_list
+
+    def merge_detections(self, corners_warped, ids_warped, corners_original, ids_original):
+        """
+        合併透視變換後影像與原始影像的檢測結果 (detectMarkers 的輸出格式)
+        以透視變換後影像的結果為主，原始影像中額外檢測到的 Marker 轉換到透視變換後的座標系統
+
+        回傳: (corners, ids_list)
+        """
         corners = []
         ids_list = []
 
@@ -1023,28 +1460,110 @@ class ArUcoTracker:
 
         # 處理原始影像中的檢測結果
         if ids_original is not None:
-            for i, marker_id in enumerate(ids_original.flatten()):
-                # 檢查這個 marker 是否已經在變換後的影像中檢測到
-                if ids_list and marker_id in np.array(ids_list).flatten():
-                    continue
+            # 只保留未在變換後影像中檢測到的 marker
+            warped_ids = set(np.array(ids_list).flatten()) if ids_list else set()
+            extra_indices = [i for i, marker_id in enumerate(ids_original.flatten()) if marker_id not in warped_ids]
 
-                # 將原始影像中的角點轉換到變換後的座標系統
-                marker_corners = corners_original[i][0]
-                transformed_corners = []
-
-                for corner in marker_corners:
-                    # 應用透視變換到每個角點
-                    corner_homogeneous = np.array([corner[0], corner[1], 1])
-                    transformed = np.dot(self.pool_detector.transform_matrix, corner_homogeneous)
-                    transformed = transformed / transformed[2]  # 歸一化
-                    transformed_corners.append([transformed[0], transformed[1]])
+            if extra_indices:
+                # 將原始影像中的角點一次批次轉換到變換後的座標系統(畸變校正+透視變換)
+                original_corners = np.concatenate([corners_original[i][0] for i in extra_indices])
+                transformed_corners = self.pool_detector.image_points_to_warped(original_corners).reshape(-1, 1, 4, 2)
 
                 # 將轉換後的角點添加到結果中
-                corners.append(np.array([transformed_corners], dtype=np.float32))
-                ids_list.append([marker_id])
+                for j, i in enumerate(extra_indices):
+                    corners.append(transformed_corners[j].astype(np.float32))
+                    ids_list.append([ids_original.flatten()[i]])
+
+        return corners, ids_list
+
+    def detect_aruco(self, gray, kind=None):
+        """
+        在灰階影像中檢測 ArUco Marker
+        detection_scale 小於1時，先縮小影像再檢測，並將角點換算回原始解析度
+        kind: 影像種類 ("original" / "warped")，pyramid 模式依種類分別記錄 Marker 大小
+        """
+        if self.detection_mode == "pyramid" and kind is not None:
+            return self.detect_aruco_pyramid(gray, kind)
+
+        scale = self.detection_scale
+        if scale >= 1.0:
+            corners, ids, _ = cv2.aruco.detectMarkers(
+                gray, self.pool_detector.aruco_dict,
+                parameters=self.pool_detector.aruco_params
+            )
+            return corners, ids
+
+        small_gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        corners, ids, _ = cv2.aruco.detectMarkers(
+            small_gray, self.pool_detector.aruco_dict,
+            parameters=self.pool_detector.aruco_params
+        )
+        # 像素中心對齊的座標換算
+        corners = tuple((c + 0.5) / scale - 0.5 for c in corners)
+        return corners, ids
+
+    def select_pyramid_level(self, kind):
+        """
+        依最近量測的最小 Marker 邊長選擇金字塔層級 (縮小後的 Marker 邊長不小於 pyramid_min_marker_size)
+        尚未量測、上一幀未檢測到 Marker 或到達重新量測的間隔時回傳0(原始解析度)
+        品質調整器降低 detection_scale 時，允許縮小到較小的 Marker 邊長 (最少16像素)
+        """
+        state = self.pyramid_state.setdefault(kind, {"marker_size": None, "frames": 0})
+        if state["marker_size"] is None or state["frames"] >= self.pyramid_refresh_interval:
+            return 0
+        min_size = max(16.0, self.pyramid_min_marker_size * min(self.detection_scale, 1.0))
+        level = int(np.floor(np.log2(max(state["marker_size"] / min_size, 1.0))))
+        return min(level, self.pyramid_max_level)
+
+    def detect_aruco_pyramid(self, gray, kind):
+        """
+        [pyramid 模式] 在高斯金字塔的縮小層級上檢測 ArUco Marker，
+        將角點換算回原始解析度後，以 cornerSubPix 在原始影像的角點附近(小範圍視窗)精細化
+        """
+        level = self.select_pyramid_level(kind)
+        small_gray = gray
+        for _ in range(level):
+            small_gray = cv2.pyrDown(small_gray)
+        corners, ids, _ = cv2.aruco.detectMarkers(
+            small_gray, self.pool_detector.aruco_dict,
+            parameters=self.pool_detector.aruco_params
+        )
+
+        if level > 0 and len(corners) > 0:
+            factor = 2 ** level
+            # 像素中心對齊的座標換算 (pyrDown 每一層縮小為一半)
+            points = (np.concatenate(corners).reshape(-1, 1, 2).astype(np.float32) + 0.5) * factor - 0.5
+            height, width = gray.shape[:2]
+            np.clip(points[:, 0, 0], 0, width - 1, out=points[:, 0, 0])
+            np.clip(points[:, 0, 1], 0, height - 1, out=points[:, 0, 1])
+            # 搜尋視窗(半徑)涵蓋換算後約兩個縮小層級像素的誤差，且小於 Marker 的一個格子 (邊長的1/6)
+            window = 2 * factor + 1
+            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.03)
+            cv2.cornerSubPix(gray, points, (window, window), (-1, -1), criteria)
+            corners = tuple(points.reshape(-1, 1, 4, 2))
+
+        # 記錄本幀最小的 Marker 邊長 (原始解析度)，作為下一幀選擇層級的依據
+        state = self.pyramid_state[kind]
+        state["frames"] = 0 if level == 0 else state["frames"] + 1
+        if len(corners) > 0:
+            quads = np.concatenate(corners).reshape(-1, 4, 2)
+            sides = np.linalg.norm(quads - np.roll(quads, 1, axis=1), axis=2).mean(axis=1)
+            state["marker_size"] = float(sides.min())
+        else:
+            state["marker_size"] = None
+        return corners, ids
 
+    def track_markers(self, warped_frame, corners, ids_list, capture_time=None):
+        """
+        [追蹤階段] 使用檢測結果更新卡爾曼濾波器、繪製追蹤畫面、應用射水效果並更新 FlowMap
+        capture_time: 該幀的擷取時間 (time.perf_counter)，用於計算卡爾曼濾波的時間步長
+        warped_frame 為 None 時不繪製追蹤畫面(離線批次處理)，output_frame 回傳 None
+
+        回傳: (output_frame, flow_map)
+        """
+        stage_start = time.perf_counter()
         # 標記水池圓心和邊界
-        output_frame = warped_frame.copy()
+        output_frame = warped_frame.copy() if warped_frame is not None else None
       
         # 追蹤到的標記ID集合
         detected_markers = set()
@@ -1054,41 +1573,32 @@ class ArUcoTracker:
             # 將 ids_list 轉換為 numpy 數組
             ids = np.array(ids_list)
             # 在變換後的畫面上標記檢測到的 Marker
-            cv2.aruco.drawDetectedMarkers(output_frame, corners, ids)
+            if output_frame is not None:
+                cv2.aruco.drawDetectedMarkers(output_frame, corners, ids)
             
+            # 一次計算所有 Marker 的中心座標與世界座標
+            centers = np.asarray(corners, dtype=np.float32).reshape(-1, 4, 2).mean(axis=1).astype(np.int32)
+            coordinates = self.pool_detector.get_coordinates()
+            world_points = coordinates.warped_to_world(centers) if coordinates.valid else None
+
             for i, marker_id in enumerate(ids.flatten()):
                     # 計算 Marker 中心座標
                     marker_corner = corners[i][0]
-                    u = int(np.mean(marker_corner[:, 0]))
-                    v = int(np.mean(marker_corner[:, 1]))
-                    
-                    # 轉換為世界座標 (極座標轉換)
-                    if self.pool_detector.pool_shape == "circle" and self.pool_detector.pool_radius is not None:
-                        u_c, v_c = self.pool_detector.pool_center
-                        dx, dy = u - u_c, v - v_c
-                        
-                        rho = np.sqrt(dx**2 + dy**2) / self.pool_detector.pool_radius
-                        theta = np.arctan2(dy, dx)
-                        X = float(rho * self.pool_detector.world_radius * np.cos(theta))
-                        Y = float(rho * self.pool_detector.world_radius * np.sin(theta))
+                    u = int(centers[i, 0])
+                    v = int(centers[i, 1])
+
+                    # 排除水池範圍外的浮動 Marker 誤檢測
+                    if marker_id not in self.pool_detector.fixed_marker_ids and not self.pool_detector.is_inside_pool(u, v):
+                        self.metrics.increment("rejected_detections")
+                        continue
                     
-                    elif self.pool_detector.pool_shape == "rectangle" and self.pool_detector.pool_rect is not None:
-                        # 矩形水池處理邏輯
-                        rect_x, rect_y, rect_w, rect_h = self.pool_detector.pool_rect
-                        
-                        # 計算在矩形內的相對位置 (0~1)
-                        rel_x = max(0, min(1, (u - rect_x) / rect_w))
-                        rel_y = max(0, min(1, (v - rect_y) / rect_h))
-                        
-                        # 轉換為世界座標 (-world_radius ~ world_radius)
-                        X = float((2 * rel_x - 1) * self.pool_detector.world_radius)
-                        Y = float((2 * rel_y - 1) * self.pool_detector.world_radius)
-                    else:
-                        # 參數未正確初始化，使用預設值
+                    # 轉換為世界座標
+                    if world_points is None:
+                        # 參數未正確初始化
                         print(f"警告: 水池參數未正確初始化 (形狀: {self.pool_detector.pool_shape})")
-                        # 使用預設值
-                        X, Y = 0.0, 0.0
                         continue  # 跳過此標記
+                    X = float(world_points[i, 0])
+                    Y = float(world_points[i, 1])
 
                     if marker_id not in self.pool_detector.fixed_marker_ids:
                         '''處理浮動Marker'''
@@ -1104,11 +1614,11 @@ class ArUcoTracker:
                         # 更新或創建卡爾曼濾波器
                         if marker_id in self.marker_trackers:
                             # 更新現有的追蹤器
-                            state = self.marker_trackers[marker_id].update([X, Y], unity_rotation)
+                            state = self.marker_trackers[marker_id].update([X, Y], unity_rotation, capture_time)
                         else:
                             # 創建新的追蹤器
                             self.marker_trackers[marker_id] = KalmanMarkerTracker(
-                                marker_id, [X, Y], unity_rotation
+                                marker_id, [X, Y], unity_rotation, timestamp=capture_time
                             )
                             state = self.marker_trackers[marker_id].get_state()
                     
@@ -1127,7 +1637,8 @@ class ArUcoTracker:
                         }
                         
                         # 在畫面上標記浮動 Marker
-                        cv2.circle(output_frame, (u, v), 5, (0, 0, 255), -1)
+                        if output_frame is not None:
+                            cv2.circle(output_frame, (u, v), 5, (0, 0, 255), -1)
                         
                         # 將位置和速度轉換為 FlowMap 所需的歸一化格式 (-1 到 1)
                         norm_x = X_filtered / self.pool_detector.world_radius
@@ -1141,14 +1652,16 @@ class ArUcoTracker:
                         )
         
         # 處理未檢測到但仍在追蹤的標記
+        predicted_positions = []  # 預測的 Marker 世界座標 (繪製用，迴圈結束後一次轉換)
         for marker_id, tracker in list(self.marker_trackers.items()):
             if marker_id not in detected_markers:
                 # 預測標記位置
-                state = tracker.predict()
+                state = tracker.predict(capture_time)
                 
                 # 檢查追蹤器是否仍然有效
                 if not tracker.is_valid():
                     del self.marker_trackers[marker_id]
+                    self.metrics.increment("lost_markers")
                     continue
                 
                 # 獲取預測的位置和旋轉
@@ -1157,9 +1670,6 @@ class ArUcoTracker:
                 unity_rotation_pred = state["rotation"]
                 missed_frames = state["missed_frames"]
                 
-                # 反向計算畫面上的位置
-                u, v = self.world_to_image(X_pred, Y_pred)
-                
                 # 更新最後一次看到的訊息
                 marker_key = f"marker_id_{marker_id}"
                 self.last_seen[marker_key] = {
@@ -1170,8 +1680,7 @@ class ArUcoTracker:
                     "missed_frames": missed_frames
                 }
                 
-                # 在畫面上標記預測的 Marker 位置(使用相同顏色)
-                cv2.circle(output_frame, (u, v), 5, (0, 0, 255), -1)
+                predicted_positions.append((X_pred, Y_pred))
                 
                 # 將位置和速度轉換為 FlowMap 所需的歸一化格式 (-1 到 1)
                 norm_x = X_pred / self.pool_detector.world_radius
@@ -1183,15 +1692,26 @@ class ArUcoTracker:
                 self.flow_map_generator.add_marker_data(
                     marker_id, [norm_x, norm_y], [norm_vx, norm_vy]
                 )
+
+        # 在畫面上標記預測的 Marker 位置(使用相同顏色，反向計算畫面上的位置)
+        coordinates = self.pool_detector.get_coordinates()
+        if output_frame is not None and predicted_positions and coordinates.valid:
+            for u, v in coordinates.world_to_warped(predicted_positions).astype(np.int32):
+                cv2.circle(output_frame, (int(u), int(v)), 5, (0, 0, 255), -1)
         
+        self.metrics.record("track.kalman", time.perf_counter() - stage_start)
+
         # 應用射水效果
-        output_frame = self.water_jet.apply_water_jets(output_frame)
+        with self.metrics.timer("track.jets"):
+            output_frame = self.water_jet.apply_water_jets(output_frame)
 
         # 更新 FlowMap
-        self.flow_map_generator.update_flow_map()
+        with self.metrics.timer("track.flowmap"):
+            self.flow_map_generator.update_flow_map()
         
         # 獲取當前的 FlowMap
         flow_map = self.flow_map_generator.get_flow_map()
+        self.metrics.increment("frames_processed")
         
         return output_frame, flow_map
 
@@ -1201,16 +1721,24 @@ def main():
     app = QApplication(sys.argv) # 建立app物件，PyQt創建GUI應用程式必要實例
     ui = FlowMapUI()# 呼叫ArUcoFlowMap_UI_v2.py當中的FlowMapUI Class建立ui物件，自動執行建構子(初始化變數)
     
+    # 相機影像來源(第一台為主相機，用於透視變換與射水向量校準)
+    # 註: 設定多台時啟用多相機模式(大型水池)，其他相機在開始追蹤時以共同可見的固定 Marker 自動校準到主相機的水池座標；
+    #     每一項可為 VideoCapture 的來源，或 {"source": 來源, "profile": 此相機的校準設定檔(鏡頭畸變參數)}
+    camera_sources = [4]  # (原始值為0)
+
+    # 主相機的影像格式 (fourcc: 例如 "YUYV"、"MJPG"；width/height/fps: 解析度與幀率；None 表示使用相機預設值)
+    camera_format = {"fourcc": None, "width": None, "height": None, "fps": None}
+    # 追蹤時直接以相機提供的亮度(YUYV 的 Y 通道或 MJPEG 只解碼亮度)檢測 Marker，
+    # 彩色影像只在顯示追蹤畫面、Client 請求快照或錄影時才轉換
+    capture_luma = True
+
     # 初始化相機
-    cap = cv2.VideoCapture(4)  # (原始值為0)
+    cap = CameraCapture(camera_sources[0], luma=capture_luma, **camera_format)
     
     # 檢查相機是否能夠成功開啟
     if not cap.isOpened():
         print("無法開啟攝像頭")
         return # 無法返回則退出
-    
-    # cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
-    # cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 1080)
 
     frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) # 相機捕捉影像寬度
     frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) # 相機捕捉影像高度
@@ -1221,14 +1749,51 @@ def main():
     image_server = FlowMapServer(host='0.0.0.0', port=8888)
 
     image_server.start()  # 啟動Server
+    # Client 請求的畫面快照(命令1/6)，依Client選擇的解析度與品質編碼並快取
+    snapshots = SnapshotService(image_server)
+    snapshots.start()
+
+    # 啟用效能指標紀錄，並啟動本機指標服務(http://127.0.0.1:9100/metrics)
+    metrics.enable()
+    metrics.start_http_server(host='127.0.0.1', port=9100)
     print("TCP Server 已啟動，等待Client連線...")
     
     # 固定 Marker ID(在當前測試的水池串流影片中，在進行ArUco Marker追蹤時僅針對水面浮動Marker，將固定Marker排除)
     # 註: 事後實際應用若無擺放固定Marker後可移除
     fixed_marker_ids = [11, 12, 13, 14, 16, 17]
+
+    # 工作階段錄製資料夾(設定後每次開始追蹤時錄製原始影像、校準資訊與檢測結果，供 Session_Recorder.py 離線重播)
+    # 註: None 表示不錄製
+    record_dir = None
+
+    # FlowMap 歷史封存路徑(設定後每次開始追蹤時將累積FlowMap寫入記憶體映射的環狀檔案，可用 FlowMap_Archive.py 查看/匯出)
+    # 註: None 表示不封存；預設保存最近 1800 筆(每2幀一筆、縮小為一半，約2分鐘)
+    archive_path = None
+
+    # 並行檢測的工作程序數量(設定後 ArUco Marker 檢測分配給多個程序同時處理多幀，提高多核心機器的吞吐量)
+    # 註: 0 表示在檢測執行緒中直接檢測；None 表示使用所有 CPU 核心
+    detection_workers = 0
+
+    # ArUco Marker 檢測模式("full" 或 "pyramid")
+    # 註: pyramid 依 Marker 的像素大小在縮小的影像上檢測，再於原始解析度精細化角點(適合 1080p/4K 相機)
+    detection_mode = "full"
+
+    # FlowMap 生成模式("brush"、"interpolate" 或 "physics")
+    # 註: brush 只有筆刷軌跡經過的位置有顏色；interpolate 由所有 Marker 的速度內插整個水池的速度場；physics 以網格流體模擬演算水流
+    flow_mode = "brush"
+
+    # 追蹤中以固定 Marker 持續校正透視變換(相機被碰撞或腳架偏移時自動重新估計，不需中斷追蹤或重新校準)
+    # 註: 校正會記錄在錄製的工作階段中(transform_updates)，重播時在相同的幀套用；預設關閉
+    drift_correction = False
     
     # 初始化水池檢測器
     pool_detector = PoolDetector(fixed_marker_ids, world_radius=2.5,pool_shape="circle")
+
+    # 載入相機校準設定檔(若存在)，用於鏡頭畸變校正與調整後的 ArUco 檢測參數(Detector_Tuner.py)
+    if os.path.exists(DEFAULT_PROFILE_PATH):
+        calibration_profile = load_calibration_profile(DEFAULT_PROFILE_PATH)
+        pool_detector.load_camera_calibration(calibration_profile)
+        pool_detector.load_detector_parameters(calibration_profile)
     
     # 儲存編輯後產生的射水向量
     water_jet_vectors = []
@@ -1236,19 +1801,22 @@ def main():
     # [UI介面訊號傳遞控制相關方法]
 
     # [水池形狀選擇]連接水池形狀選擇訊號
-    # 使用者在UI介面中選擇水池形狀時調用update_pool_shape函式，更新PoolDetector Class的傳入參數pool_shape[circle/rectangle]
+    # 使用者在UI介面中選擇水池形狀時調用update_pool_shape函式，更新PoolDetector Class的傳入參數pool_shape[circle/rectangle/polygon]
     def update_pool_shape(shape):
         # 更新水池形狀
         pool_detector.pool_shape = shape
+        image_server.pool_shape = shape  # Client 傳送的參考點數量依水池形狀檢查
         # 重置關鍵參數
         pool_detector.transform_matrix = None
         pool_detector.pool_center = None
         pool_detector.target_size = None
+        pool_detector.profile_version += 1
         # 根據形狀重置特定參數
         if shape == "circle":
             pool_detector.pool_radius = None
-        else:  # rectangle
+        else:  # rectangle / polygon
             pool_detector.pool_rect = None
+            pool_detector.pool_polygon = None
             pool_detector.output_width = None
             pool_detector.output_height = None
         print(f"水池檢測器形狀已更新為: {shape}")
@@ -1277,21 +1845,23 @@ def main():
     # 點擊射水編輯頁面中的"Apply Water Jet Vector"按鈕後觸發訊號
     # 調用setup_water_jets函式(傳入編輯的射水向量(vectors))
     ui.water_jet_page.water_jet_vectors_signal.connect(
-        lambda vectors: setup_water_jets(pool_detector, vectors, water_jet_vectors, ui, cap,image_server))
+        lambda vectors: setup_water_jets(pool_detector, vectors, water_jet_vectors, ui, cap,image_server, record_dir, archive_path,
+                                         detection_workers, detection_mode, flow_mode, drift_correction, camera_sources[1:]))
     
     # [射水向量編輯]
     # 點擊射水編輯頁面中的"Capture Image"按鈕後觸發訊號
     # 調用update_transformed_frame(用於更新透視變換後的Frame)
     ui.water_jet_page.request_transformed_frame_signal.connect(
-        lambda: update_transformed_frame(ui, cap, pool_detector))
+        lambda: update_transformed_frame(ui, cap, pool_detector, snapshots))
     
     # [編輯皆完成後開始Marker的追蹤並產生FlowMap]
     ui.start_tracking_signal.connect(
-        lambda: start_tracking_mode(ui, cap, pool_detector, water_jet_vectors, image_server))
+        lambda: start_tracking_mode(ui, cap, pool_detector, water_jet_vectors, image_server, record_dir, archive_path,
+                                    detection_workers, detection_mode, flow_mode, drift_correction, camera_sources[1:]))
     
     # 創建定時器用於更新原始Frame
     frame_timer = QTimer()
-    frame_timer.timeout.connect(lambda: update_original_frame(ui, cap))
+    frame_timer.timeout.connect(lambda: update_original_frame(ui, cap, snapshots))
     frame_timer.start(30)  # 每30ms更新一次
     
     # 顯示 UI
@@ -1310,7 +1880,9 @@ def setup_perspective_transform(pool_detector, cap, points):
     print("設置透視變換失敗")
     return False
 
-def setup_water_jets(pool_detector, vectors, water_jet_vectors, ui=None, cap=None, image_server=None):
+def setup_water_jets(pool_detector, vectors, water_jet_vectors, ui=None, cap=None, image_server=None, record_dir=None,
+                     archive_path=None, detection_workers=0, detection_mode="full", flow_mode="brush",
+                     drift_correction=False, extra_cameras=()):
     """設置射水向量"""
     # 使用射水向量起點重新校準水池
     if pool_detector.calibrate_pool_with_water_jets(vectors):
@@ -1322,42 +1894,36 @@ def setup_water_jets(pool_detector, vectors, water_jet_vectors, ui=None, cap=Non
 
         # 如果提供了UI和cap參數，則啟動追蹤
         if ui is not None and cap is not None:
-            start_tracking_mode(ui, cap, pool_detector, water_jet_vectors, image_server)
+            start_tracking_mode(ui, cap, pool_detector, water_jet_vectors, image_server, record_dir, archive_path,
+                                detection_workers, detection_mode, flow_mode, drift_correction, extra_cameras)
         return True
     print("校準水池參數失敗")
     return False
 
-def update_original_frame(ui, cap):
+def update_original_frame(ui, cap, snapshots=None):
     """更新原始Frame到UI"""
     ret, frame = cap.read()
     if ret:
         ui.update_original_frame(frame)
+        if snapshots is not None:
+            snapshots.publish("raw", frame)
 
-def update_transformed_frame(ui, cap, pool_detector):
+def update_transformed_frame(ui, cap, pool_detector, snapshots=None):
     """更新透視變換後的Frame到UI"""
     ret, frame = cap.read()
     # 應用透視變換[依照圓形/矩形水池決定最終透視變換後的圖片大小]
     if ret and pool_detector.transform_matrix is not None:
-        if pool_detector.pool_shape == "rectangle" and pool_detector.output_width is not None and pool_detector.output_height is not None:
-            # 矩形水池使用指定的寬高
-            warped_frame = cv2.warpPerspective(
-                frame, 
-                pool_detector.transform_matrix, 
-                (pool_detector.output_width, pool_detector.output_height)
-            )
-        else:
-            # 圓形水池使用正方形輸出
-            warped_frame = cv2.warpPerspective(
-                frame, 
-                pool_detector.transform_matrix, 
-                (pool_detector.target_size, pool_detector.target_size)
-            )
+        warped_frame = pool_detector.warp_frame(frame, interpolation=cv2.INTER_LINEAR)
         ui.update_transformed_frame(warped_frame)
+        if snapshots is not None:
+            snapshots.publish("warped", warped_frame)
         print("已更新透視變換後的Frame")
     else:
         print("無法獲取Frame或透視變換矩陣未設置")
 
-def start_tracking_mode(ui, cap, pool_detector, water_jet_vectors, image_server=None):
+def start_tracking_mode(ui, cap, pool_detector, water_jet_vectors, image_server=None, record_dir=None, archive_path=None,
+                        detection_workers=0, detection_mode="full", flow_mode="brush", drift_correction=False,
+                        extra_cameras=()):
     """開始追蹤模式"""
     print("開始追蹤模式")
     
@@ -1371,7 +1937,7 @@ def start_tracking_mode(ui, cap, pool_detector, water_jet_vectors, image_server=
         print("錯誤: 圓形水池半徑未設置，請先完成水池校準")
         return None
     
-    if pool_detector.pool_shape == "rectangle" and pool_detector.pool_rect is None:
+    if pool_detector.pool_shape in ("rectangle", "polygon") and pool_detector.pool_rect is None:
         print("錯誤: 矩形水池邊界未設置，請先完成水池校準")
         return None
     
@@ -1382,11 +1948,11 @@ def start_tracking_mode(ui, cap, pool_detector, water_jet_vectors, image_server=
         # 停止舊的追蹤執行緒
         start_tracking_mode.current_tracker.running = False
         # 等待舊執行緒結束
-        import time
         time.sleep(0.1)
     
     # 初始化 ArUco 追蹤器
-    tracker = ArUcoTracker(pool_detector)
+    tracker = ArUcoTracker(pool_detector, flow_mode=flow_mode)
+    tracker.detection_mode = detection_mode
     
     # 如果有射水向量，則更新到追蹤器
     if water_jet_vectors:
@@ -1398,11 +1964,44 @@ def start_tracking_mode(ui, cap, pool_detector, water_jet_vectors, image_server=
     
     # 保存當前追蹤器的引用
     start_tracking_mode.current_tracker = tracker
+
+    # 若有設定其他相機，建立多相機擷取與檢測融合(同時作為管線的影像來源與檢測後端)
+    capture = cap
+    detector = None
+    if extra_cameras:
+        rig = MultiCameraRig(tracker, cap, list(extra_cameras))
+        if rig.start():
+            capture = detector = rig
+        else:
+            print("[多相機] 其他相機校準失敗，僅使用主相機追蹤")
+
+    # 若有設定錄製資料夾，建立新的工作階段錄製(錄製單一相機的原始影像，多相機模式不錄製)
+    recorder = None
+    if record_dir is not None and detector is None:
+        recorder = SessionRecorder(os.path.join(record_dir, time.strftime("session_%Y%m%d_%H%M%S")))
+        recorder.start(pool_detector, water_jet_vectors)
+
+    # 若有設定封存路徑，將累積的FlowMap寫入歷史封存
+    if archive_path is not None:
+        tracker.flow_map_generator.archiver = FlowMapArchiveWriter(
+            archive_path, capacity=1800, frame_shape=tracker.flow_map_generator.accumulated_flowmap.shape,
+            decimate=2, scale=0.5
+        )
+
+    # 以固定 Marker 持續校正透視變換(背景執行緒重新估計，檢測階段在幀與幀之間替換)
+    if drift_correction:
+        tracker.drift_corrector = HomographyDriftCorrector(pool_detector)
+        tracker.drift_corrector.start()
+
+    # 若有設定並行檢測的工作程序數量，建立多程序檢測後端(多相機模式中各相機已有自己的檢測執行緒)
+    if detection_workers != 0 and detector is None:
+        detector = ParallelDetector(tracker, workers=detection_workers, mode="frame")
     
     # 啟動一個新的執行緒來執行追蹤邏輯
     tracking_thread = threading.Thread(
         target=run_tracking,
-        args=(ui, cap, tracker, image_server),
+        args=(ui, capture, tracker, image_server),
+        kwargs={"recorder": recorder, "detector": detector},
         daemon=True
     )
     tracking_thread.start()
@@ -1410,58 +2009,28 @@ def start_tracking_mode(ui, cap, pool_detector, water_jet_vectors, image_server=
     # 返回追蹤器，以便在需要時可以停止追蹤
     return tracker
 
-def run_tracking(ui, cap, tracker, image_server=None):
+def run_tracking(ui, cap, tracker, image_server=None, target_fps=30.0, recorder=None, detector=None):
     """
     [執行追蹤邏輯]
     在背景執行緒中運行的主追蹤迴圈
     主要作用:
-    從相機(cap)持續讀取影像 -> 讓tracker(ArUcoTracker Class)處理影像(追蹤ArUco Marker) ->
-    更新UI介面的Marker追蹤畫面&FlowMap -> 控制執行速度，並處理執行過程的錯誤 -> 結束時安全的停止tracker
+    建立多執行緒處理管線(FramePipeline)，各階段分別在自己的執行緒中執行:
+    從相機(cap)持續讀取影像 -> 讓tracker(ArUcoTracker Class)檢測ArUco Marker ->
+    卡爾曼濾波追蹤並更新FlowMap -> 更新UI介面的Marker追蹤畫面&FlowMap並傳送FlowMap ->
+    等待tracker停止後，安全的結束所有階段
+    target_fps 為 None 時不限制幀率(例如離線重播錄製的工作階段時盡可能快速處理)
+    detector 為 ParallelDetector 時，檢測階段分配給多個工作程序處理
     """
     try:
-        save_interval = 30  # 每30幀檢查一次是否需要傳送FlowMap
-        last_saved_frame = 0  # 上次傳送FlowMap的幀數
-
-        while tracker.running:
-            try:
-                ret, frame = cap.read()
-                if not ret:
-                    print("無法讀取影像，嘗試重新獲取...")
-                    time.sleep(0.1)  # 短暫暫停後重試
-                    continue
-                
-                # 處理當前幀
-                output_frame, flow_map = tracker.process_frame(frame)
-
-                # 更新UI中的透視變換後幀
-                ui.update_transformed_frame(output_frame)
-
-                # 更新UI中的追蹤畫面和FlowMap
-                ui.update_tracking_display(output_frame)
-                ui.update_flowmap_display(flow_map)
-
-                # 檢查是否需要傳送FlowMap給Client
-                current_frame = tracker.flow_map_generator.current_frame
-                if image_server and current_frame - last_saved_frame >= save_interval:
-                    # 檢查Client是否請求傳送FlowMap
-                    if image_server.should_stream_flowmap():
-                        # 將FlowMap轉換為jpg格式的bytes
-                        _, img_encoded = cv2.imencode('.jpg', tracker.flow_map_generator.accumulated_flowmap)
-                        img_bytes = img_encoded.tobytes()
-                        
-                        # 透過Server傳送FlowMap給Client
-                        image_server.send_flowmap(img_bytes)
-                        last_saved_frame = current_frame
-                        print(f"已傳送FlowMap給Client於Frame {current_frame}")
-
-                # 短暫暫停
-                time.sleep(0.03)  # 約 30 FPS
-                    
-            except Exception as e:
-                print(f"追蹤過程中發生錯誤: {e}")
-                import traceback
-                traceback.print_exc()
-                time.sleep(1)  # 錯誤後暫停一下再繼續
+        # 品質調整器: CPU 負載過高時自動降低品質以維持目標幀率(不限制幀率時不調整)
+        governor = QualityGovernor(tracker, target_fps=target_fps) if target_fps else None
+        # 畫面快照服務隨 image_server 建立(Client 請求命令1/6時才編碼)
+        snapshots = image_server.snapshot_service if image_server is not None else None
+        pipeline = FramePipeline(cap, tracker, ui, image_server, save_interval=30, target_fps=target_fps,
+                                 governor=governor, recorder=recorder, detector=detector, snapshots=snapshots)
+        pipeline.start()
+        # 等待所有階段結束(tracker.running 設為 False 時結束)
+        pipeline.join()
                 
     except Exception as e:
         print(f"追蹤執行緒發生嚴重錯誤: {e}")
@@ -1471,6 +2040,14 @@ def run_tracking(ui, cap, tracker, image_server=None):
         print("追蹤執行緒結束")
         # 確保追蹤器狀態被正確設置
         tracker.running = False
+        if recorder is not None:
+            recorder.close()
+        if detector is not None:
+            detector.close()
+        if tracker.drift_corrector is not None:
+            tracker.drift_corrector.stop()
+        if tracker.flow_map_generator.archiver is not None:
+            tracker.flow_map_generator.archiver.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
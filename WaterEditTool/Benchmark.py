@@ -0,0 +1,631 @@
+import argparse
+import atexit
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from Synthetic_Pool import SyntheticPoolScene, load_ground_truth, ground_truth_path
+from Velocity_Field import VelocityFieldInterpolator, encode_velocity_field
+from Flow_Solver import FlowSolver
+from Parallel_Detector import ParallelDetector
+from Session_Recorder import SESSION_FILE
+from ArUco_to_FlowMap import PoolDetector, FlowMapGenerator, ArUcoTracker, KalmanMarkerTracker
+
+# 預設的基準測試結果資料夾(與主程式位於同一資料夾，已列於 .gitignore)
+DEFAULT_RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results")
+
+# 已註冊的基準測試 (名稱 -> (setup 函式, 參數組合))
+BENCHMARKS = {}
+
+def benchmark(name, **params):
+    """
+    註冊基準測試 (asv 風格)
+    被裝飾的函式接收一組參數並完成準備工作，回傳執行一次測試的函式 run()；
+    參數值為列表時會展開為所有組合
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = (setup, params)
+        return setup
+    return decorator
+
+# ===== 測試資料 =====
+
+FRAME_CACHE = {}  # (水池形狀, Marker數量, 影片路徑) -> (frames, 場景描述, 每一幀的真實軌跡)
+
+def load_frames(shape, markers, count=30, video=None):
+    """
+    取得重播用的影像(預先載入記憶體，避免解碼時間影響測量)
+    video 為 None 時使用合成水池場景；否則讀取錄製或合成的影片與對應的 _ground_truth.json，
+    影片沒有真實軌跡時(例如實際錄製的影片)只測量時間，以同一資料夾中工作階段(session.json)的校準資訊建立追蹤器
+    """
+    key = (shape, markers, video)
+    if key in FRAME_CACHE:
+        return FRAME_CACHE[key][:2]
+
+    frames = []
+    truths = []
+    if video is None:
+        scene = SyntheticPoolScene(pool_shape=shape, num_markers=markers, seed=0)
+        for _ in range(count):
+            frame, truth = scene.next_frame()
+            frames.append(frame)
+            truths.append(truth)
+        description = scene.describe()
+    else:
+        if os.path.exists(ground_truth_path(video)):
+            ground_truth = load_ground_truth(ground_truth_path(video))
+            description = ground_truth["scene"]
+        else:
+            ground_truth = None
+            description = load_session_calibration(video)
+        cap = cv2.VideoCapture(video)
+        while len(frames) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+        if not frames:
+            raise RuntimeError(f"無法讀取影片: {video}")
+        truths = ground_truth["frames"][:len(frames)] if ground_truth is not None else None
+
+    FRAME_CACHE.clear()  # 只保留一組影像，避免佔用過多記憶體
+    FRAME_CACHE[key] = (frames, description, truths)
+    return frames, description
+
+def load_session_calibration(video):
+    """讀取影片所在資料夾中工作階段的校準資訊 (沒有真實軌跡的影片使用)"""
+    path = os.path.join(os.path.dirname(os.path.abspath(video)), SESSION_FILE)
+    if not os.path.exists(path):
+        raise RuntimeError(f"影片沒有對應的 _ground_truth.json 或 {SESSION_FILE}，無法校準水池: {video}")
+    with open(path, "r", encoding="utf-8") as f:
+        return {"session": json.load(f)}
+
+def create_tracker(shape, markers, video=None):
+    """建立完成透視變換與射水向量校準的追蹤器 (回傳 tracker, frames)"""
+    frames, description = load_frames(shape, markers, video=video)
+    if "session" in description:
+        # 以錄製時的校準結果建立追蹤器 (射水向量已是透視變換後的座標)
+        session = description["session"]
+        profile = session["pool"]
+        with contextlib.redirect_stdout(io.StringIO()):
+            pool_detector = PoolDetector(profile["fixed_marker_ids"], world_radius=profile["world_radius"],
+                                         pool_shape=profile["pool_shape"])
+            pool_detector.load_profile(profile)
+            tracker = ArUcoTracker(pool_detector)
+            tracker.update_water_jet_vectors([tuple(vector) for vector in session.get("water_jet_vectors", [])])
+        return tracker, frames
+    if video is not None:
+        shape = description["pool_shape"]
+
+    with contextlib.redirect_stdout(io.StringIO()):  # 忽略校準過程的輸出
+        pool_detector = PoolDetector(description["fixed_marker_ids"], world_radius=description["world_radius"], pool_shape=shape)
+        if not pool_detector.setup_perspective_transform_with_client_points(frames[0], description["client_points"]):
+            raise RuntimeError("透視變換校準失敗")
+        # 將原始影像座標的射水向量轉換到透視變換後的畫面
+        vectors = np.array(description["water_jet_vectors"], dtype=np.float32)
+        starts = pool_detector.image_points_to_warped(vectors[:, :2])
+        ends = pool_detector.image_points_to_warped(vectors[:, 2:])
+        water_jet_vectors = [(int(sx), int(sy), int(ex), int(ey)) for (sx, sy), (ex, ey) in zip(starts, ends)]
+        pool_detector.calibrate_pool_with_water_jets(water_jet_vectors)
+        tracker = ArUcoTracker(pool_detector)
+        tracker.update_water_jet_vectors(water_jet_vectors)
+    return tracker, frames
+
+def fill_marker_history(flow_map_generator, markers, seed=0):
+    """以隨機的移動軌跡填滿 FlowMap 的 Marker 歷史資料"""
+    rng = np.random.default_rng(seed)
+    for marker_id in range(markers):
+        position = rng.uniform(-0.6, 0.6, 2)
+        velocity = rng.uniform(-0.3, 0.3, 2)
+        for _ in range(flow_map_generator.sample_frames):
+            position = position + velocity / 30.0
+            flow_map_generator.add_marker_data(marker_id, position.tolist(), velocity.tolist())
+    flow_map_generator.current_frame = flow_map_generator.sample_frames
+
+# ===== 基準測試 =====
+
+@benchmark("tracker.process_frame", shape=["circle", "rectangle"], markers=[1, 5, 10])
+def bench_process_frame(shape, markers, video=None):
+    """完整的單幀處理 (檢測 + 卡爾曼濾波 + 射水 + FlowMap 更新)"""
+    tracker, frames = create_tracker(shape, markers, video)
+    state = {"index": 0}
+
+    def run():
+        index = state["index"]
+        tracker.process_frame(frames[index % len(frames)], index / 30.0)
+        state["index"] = index + 1
+    return run
+
+@benchmark("tracker.detect_markers", shape=["circle", "rectangle"], markers=[1, 5, 10])
+def bench_detect_markers(shape, markers, video=None):
+    """透視變換與 ArUco Marker 檢測"""
+    tracker, frames = create_tracker(shape, markers, video)
+    state = {"index": 0}
+
+    def run():
+        tracker.detect_markers(frames[state["index"] % len(frames)])
+        state["index"] += 1
+    return run
+
+@benchmark("detector.parallel", shape=["circle", "rectangle"], mode=["frame", "strip"], workers=[2, 4])
+def bench_parallel_detector(shape, mode, workers, video=None):
+    """多程序檢測的吞吐量，每次執行連續處理 8 幀 (同時處理的幀數達上限時取回最舊的結果)"""
+    tracker, frames = create_tracker(shape, 10, video)
+    detector = ParallelDetector(tracker, workers=workers, mode=mode)
+    atexit.register(detector.close)
+    state = {"index": 0}
+
+    def run():
+        in_flight = []
+        for _ in range(8):
+            in_flight.append(detector.submit(frames[state["index"] % len(frames)]))
+            state["index"] += 1
+            if len(in_flight) >= detector.max_in_flight:
+                in_flight.pop(0).result()
+        for handle in in_flight:
+            handle.result()
+    return run
+
+@benchmark("tracker.detect_markers_pyramid", shape=["circle", "rectangle"], markers=[1, 5, 10])
+def bench_detect_markers_pyramid(shape, markers, video=None):
+    """pyramid 模式的檢測 (依 Marker 大小縮小影像檢測，再於原始解析度以 cornerSubPix 精細化角點)"""
+    tracker, frames = create_tracker(shape, markers, video)
+    tracker.detection_mode = "pyramid"
+    state = {"index": 0}
+
+    def run():
+        tracker.detect_markers(frames[state["index"] % len(frames)])
+        state["index"] += 1
+    return run
+
+@benchmark("flowmap.update_flow_map", canvas=[512, 1024], markers=[1, 5, 10])
+def bench_update_flow_map(canvas, markers, video=None):
+    """FlowMap 更新 (衰減、筆刷、模糊、累積)"""
+    flow_map_generator = FlowMapGenerator(canvas_width=canvas, canvas_height=canvas)
+    fill_marker_history(flow_map_generator, markers)
+    return flow_map_generator.update_flow_map
+
+@benchmark("flowmap.update_flow_map_pool_mask", canvas=[512, 1024], markers=[1, 5, 10])
+def bench_update_flow_map_pool_mask(canvas, markers, video=None):
+    """FlowMap 更新 (圓形水池遮罩，只處理與水池重疊的區塊)"""
+    flow_map_generator = FlowMapGenerator(canvas_width=canvas, canvas_height=canvas)
+    flow_map_generator.set_pool_mask(PoolDetector([], pool_shape="circle").get_pool_mask(canvas, canvas))
+    fill_marker_history(flow_map_generator, markers)
+    return flow_map_generator.update_flow_map
+
+@benchmark("flowmap.update_flow_map_interpolate", canvas=[512, 1024], markers=[10, 50])
+def bench_update_flow_map_interpolate(canvas, markers, video=None):
+    """FlowMap 更新 (速度場內插模式)"""
+    flow_map_generator = FlowMapGenerator(canvas_width=canvas, canvas_height=canvas, mode="interpolate")
+    fill_marker_history(flow_map_generator, markers)
+
+    def run():
+        # 使歷史資料維持為最新一幀的資料
+        for history in flow_map_generator.marker_history.values():
+            history[-1]['frame'] = flow_map_generator.current_frame
+        flow_map_generator.update_flow_map()
+    return run
+
+@benchmark("velocity_field.interpolate", method=["idw", "rbf"], markers=[10, 50, 200])
+def bench_velocity_field(method, markers, video=None):
+    """稀疏 Marker 速度內插為 64x64 速度場並編碼"""
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(-0.9, 0.9, (markers, 2))
+    velocities = rng.uniform(-0.5, 0.5, (markers, 2))
+    interpolator = VelocityFieldInterpolator(64, 64, method=method)
+    return lambda: encode_velocity_field(interpolator.interpolate(positions, velocities), 0.5)
+
+@benchmark("flow_solver.step", grid=[128, 256], markers=[10, 50])
+def bench_flow_solver_step(grid, markers, video=None):
+    """流體模擬單步 (外力、平流、壓力投影) 與速度場編碼，6 個射水"""
+    rng = np.random.default_rng(0)
+    positions = rng.uniform(-0.8, 0.8, (markers, 2))
+    velocities = rng.uniform(-0.3, 0.3, (markers, 2))
+    angles = np.linspace(0, 2 * np.pi, 6, endpoint=False)
+    jets = [(0.9 * np.cos(a), 0.9 * np.sin(a), -np.sin(a), np.cos(a)) for a in angles]
+    solver = FlowSolver(grid, grid)
+    return lambda: encode_velocity_field(solver.step(positions, velocities, jets), 0.5)
+
+@benchmark("flowmap.update_flow_map_physics", canvas=[512, 1024], grid=[128, 256])
+def bench_update_flow_map_physics(canvas, grid, video=None):
+    """FlowMap 更新 (流體模擬模式，10 個 Marker)"""
+    flow_map_generator = FlowMapGenerator(canvas_width=canvas, canvas_height=canvas, mode="physics")
+    flow_map_generator.physics_grid_size = grid
+    fill_marker_history(flow_map_generator, 10)
+
+    def run():
+        for history in flow_map_generator.marker_history.values():
+            history[-1]['frame'] = flow_map_generator.current_frame
+        flow_map_generator.update_flow_map()
+    return run
+
+@benchmark("water_jet.apply_water_jets", shape=["circle", "rectangle"], canvas=[512, 1024])
+def bench_apply_water_jets(shape, canvas, video=None):
+    """射水效果繪製"""
+    tracker, frames = create_tracker(shape, 1, video)
+    flow_map_generator = tracker.flow_map_generator
+    flow_map_generator.set_canvas_scale(canvas / flow_map_generator.base_canvas_width)
+    warped_frame = tracker.detect_markers(frames[0])[0]
+    return lambda: tracker.water_jet.apply_water_jets(warped_frame)
+
+@benchmark("kalman.update", markers=[1, 5, 10])
+def bench_kalman_update(markers, video=None):
+    """卡爾曼濾波更新 (每次執行更新所有 Marker)"""
+    trackers = [KalmanMarkerTracker(i, [0.0, 0.0], 0.0, timestamp=0.0) for i in range(markers)]
+    state = {"time": 0.0}
+
+    def run():
+        state["time"] += 1 / 30.0
+        timestamp = state["time"]
+        for i, tracker in enumerate(trackers):
+            tracker.update([np.cos(timestamp + i), np.sin(timestamp + i)], 10.0 * timestamp, timestamp)
+    return run
+
+@benchmark("kalman.predict", markers=[1, 5, 10])
+def bench_kalman_predict(markers, video=None):
+    """卡爾曼濾波預測 (每次執行預測所有 Marker，並重置遺失幀數以免追蹤器失效)"""
+    trackers = [KalmanMarkerTracker(i, [0.0, 0.0], 0.0, timestamp=0.0) for i in range(markers)]
+    state = {"time": 0.0}
+
+    def run():
+        state["time"] += 1 / 30.0
+        for tracker in trackers:
+            tracker.predict(state["time"])
+            tracker.missed_frames = 0
+    return run
+
+@benchmark("transform.image_to_canvas_coords", shape=["circle", "rectangle"])
+def bench_image_to_canvas_coords(shape, video=None):
+    """影像座標 -> 畫布座標 (每次執行轉換100個點)"""
+    tracker, _ = create_tracker(shape, 1, video)
+    pool_detector = tracker.pool_detector
+    points = np.random.default_rng(0).uniform(0, pool_detector.target_size, (100, 2)).tolist()
+
+    def run():
+        for x, y in points:
+            pool_detector.image_to_canvas_coords(x, y, 1024, 1024)
+    return run
+
+@benchmark("transform.world_to_image", shape=["circle", "rectangle"])
+def bench_world_to_image(shape, video=None):
+    """世界座標 -> 透視變換後畫面座標 (每次執行轉換100個點)"""
+    tracker, _ = create_tracker(shape, 1, video)
+    world_radius = tracker.pool_detector.world_radius
+    points = np.random.default_rng(0).uniform(-world_radius, world_radius, (100, 2)).tolist()
+
+    def run():
+        for x, y in points:
+            tracker.world_to_image(x, y)
+    return run
+
+@benchmark("transform.warped_to_canvas_batch", shape=["circle", "rectangle"])
+def bench_warped_to_canvas_batch(shape, video=None):
+    """透視變換後畫面座標 -> 畫布座標 (一次批次轉換100個點)"""
+    tracker, _ = create_tracker(shape, 1, video)
+    coordinates = tracker.pool_detector.get_coordinates()
+    points = np.random.default_rng(0).uniform(0, tracker.pool_detector.target_size, (100, 2))
+    return lambda: coordinates.warped_to_canvas(points, 1024, 1024)
+
+@benchmark("transform.world_to_warped_batch", shape=["circle", "rectangle"])
+def bench_world_to_warped_batch(shape, video=None):
+    """世界座標 -> 透視變換後畫面座標 (一次批次轉換100個點)"""
+    tracker, _ = create_tracker(shape, 1, video)
+    world_radius = tracker.pool_detector.world_radius
+    coordinates = tracker.pool_detector.get_coordinates()
+    points = np.random.default_rng(0).uniform(-world_radius, world_radius, (100, 2))
+    return lambda: coordinates.world_to_warped(points)
+
+@benchmark("transform.image_points_to_warped", shape=["circle", "rectangle"], points=[4, 100])
+def bench_image_points_to_warped(shape, points, video=None):
+    """原始影像座標 -> 透視變換後畫面座標 (批次轉換)"""
+    tracker, frames = create_tracker(shape, 1, video)
+    height, width = frames[0].shape[:2]
+    image_points = np.random.default_rng(0).uniform(0, [width, height], (points, 2)).astype(np.float32)
+    return lambda: tracker.pool_detector.image_points_to_warped(image_points)
+
+@benchmark("encode.flowmap_jpg", canvas=[512, 1024])
+def bench_encode_flowmap(canvas, video=None):
+    """FlowMap JPEG 編碼 (與傳送給Client時相同)"""
+    flow_map_generator = FlowMapGenerator(canvas_width=canvas, canvas_height=canvas)
+    fill_marker_history(flow_map_generator, 5)
+    for _ in range(5):
+        flow_map_generator.update_flow_map()
+    flowmap = flow_map_generator.accumulated_flowmap.copy()
+    return lambda: cv2.imencode('.jpg', flowmap)[1].tobytes()
+
+# ===== 檢測準確度 =====
+
+def detection_accuracy(shape, markers, video=None, modes=("full", "pyramid")):
+    """
+    比較各檢測模式與原始解析度檢測(full)的結果:
+    recall: 原始解析度檢測到的 Marker 中，該模式也檢測到的比例
+    corner_error: 與原始解析度檢測的角點距離 (像素，透視變換後的座標)
+    center_error: Marker 中心與真實軌跡的距離 (像素，透視變換後的座標，只計算未被遮擋的 Marker；
+                  影片沒有真實軌跡時為 None)
+    """
+    tracker, frames = create_tracker(shape, markers, video)
+    truths = FRAME_CACHE[(shape, markers, video)][2]
+    if truths is None:
+        truths = [{"markers": []}] * len(frames)
+    # 真實 Marker 中心轉換到透視變換後的座標
+    truth_positions = []
+    for truth in truths:
+        visible = [marker for marker in truth["markers"] if not marker["occluded"]]
+        points = tracker.pool_detector.image_points_to_warped([marker["image_position"] for marker in visible])
+        truth_positions.append({marker["id"]: point for marker, point in zip(visible, points)})
+
+    detections = {}
+    report = {}
+    for mode in modes:
+        tracker.detection_mode = mode
+        tracker.pyramid_state = {}
+        detections[mode] = []
+        start_time = time.perf_counter()
+        for frame in frames:
+            _, corners, ids_list = tracker.detect_markers(frame)
+            detections[mode].append({int(marker_id[0]): np.asarray(corner, dtype=np.float32).reshape(4, 2)
+                                     for marker_id, corner in zip(ids_list, corners)})
+        elapsed = (time.perf_counter() - start_time) / len(frames)
+
+        expected = matched = 0
+        corner_errors = []
+        center_errors = []
+        for reference, detected, truth in zip(detections[modes[0]], detections[mode], truth_positions):
+            expected += len(reference)
+            for marker_id, corners in detected.items():
+                if marker_id in reference:
+                    matched += 1
+                    corner_errors.extend(np.linalg.norm(corners - reference[marker_id], axis=1))
+                if marker_id in truth:
+                    center_errors.append(np.linalg.norm(corners.mean(axis=0) - truth[marker_id]))
+        report[mode] = {
+            "time": elapsed,
+            "recall": matched / expected if expected else 1.0,
+            "corner_error_mean": float(np.mean(corner_errors)) if corner_errors else 0.0,
+            "corner_error_max": float(np.max(corner_errors)) if corner_errors else 0.0,
+            "center_error_mean": float(np.mean(center_errors)) if center_errors else None,
+        }
+    tracker.detection_mode = "full"
+    return report
+
+def run_accuracy(video=None, shapes=("circle", "rectangle"), marker_counts=(5, 10)):
+    """執行檢測準確度比較 (指定影片時只使用影片)，回傳結果 dict"""
+    results = {}
+    cases = [(None, 5)] if video is not None else list(itertools.product(shapes, marker_counts))
+    for shape, markers in cases:
+        shape = shape or "circle"
+        with contextlib.redirect_stdout(io.StringIO()):
+            report = detection_accuracy(shape, markers, video)
+        for mode, stats in report.items():
+            key = result_key(f"accuracy.{mode}", {"shape": shape, "markers": markers} if video is None else {})
+            results[key] = stats
+            center_error = stats["center_error_mean"]
+            print(f"{key:<50} {stats['time'] * 1000:8.2f} ms  檢出率 {stats['recall']:6.1%}  "
+                  f"角點誤差 {stats['corner_error_mean']:.3f}/{stats['corner_error_max']:.3f} px  "
+                  f"中心誤差 {'-' if center_error is None else f'{center_error:.3f}'} px")
+    return results
+
+# ===== 記憶體配置 =====
+
+# 檢查每幀記憶體配置的 FlowMap 更新測試 (衰減、模糊與累積應寫入預先配置的工作緩衝區)
+ALLOCATION_CHECKS = ("flowmap.update_flow_map", "flowmap.update_flow_map_pool_mask", "flowmap.update_flow_map_interpolate")
+
+def measure_allocations(run, frames=20, warmup=3):
+    """
+    以 tracemalloc 測量每次執行的記憶體配置 (numpy 陣列與 OpenCV 輸出皆會被追蹤)
+    回傳: 每次執行的 (暫時配置的峰值, 執行後仍保留的配置) 列表 (bytes)
+    """
+    for _ in range(warmup):
+        run()
+    samples = []
+    tracemalloc.start()
+    try:
+        for _ in range(frames):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            run()
+            current, peak = tracemalloc.get_traced_memory()
+            samples.append((peak - before, current - before))
+    finally:
+        tracemalloc.stop()
+    return samples
+
+def run_allocation_checks(canvas=1024, markers=5, frames=20, tolerance=4096):
+    """
+    檢查 FlowMap 更新每幀的記憶體配置維持固定:
+    暫時配置的峰值不可達到一張畫布的大小(表示熱路徑上配置了新的畫布陣列)，各幀之間的差異不超過 tolerance，
+    且後半段的幀不可持續保留新的配置；回傳未通過的項目列表
+    """
+    canvas_bytes = canvas * canvas * 3
+    failures = []
+    for name in ALLOCATION_CHECKS:
+        setup, _ = BENCHMARKS[name]
+        key = result_key(f"allocations.{name.split('.', 1)[1]}", {"canvas": canvas, "markers": markers})
+        with contextlib.redirect_stdout(io.StringIO()):
+            samples = measure_allocations(setup(canvas=canvas, markers=markers), frames=frames)
+        peaks = [peak for peak, _ in samples]
+        retained = sum(kept for _, kept in samples[len(samples) // 2:])  # 後半段 (排除第一次使用時建立的快取)
+        passed = max(peaks) < canvas_bytes and max(peaks) - min(peaks) <= tolerance and retained <= tolerance
+        if not passed:
+            failures.append(key)
+        print(f"{key:<70} 每幀峰值 {min(peaks) / 1024:8.1f} ~ {max(peaks) / 1024:8.1f} KB  "
+              f"保留 {retained / 1024:6.1f} KB  (畫布 {canvas_bytes / 1024:.0f} KB){'' if passed else '  <-- 未通過'}")
+    return failures
+
+# ===== 執行與結果 =====
+
+def expand_params(params):
+    """將參數列表展開為所有組合"""
+    keys = list(params)
+    values = [value if isinstance(value, list) else [value] for value in params.values()]
+    return [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+
+def result_key(name, params):
+    """基準測試結果的名稱，例如 tracker.process_frame[shape=circle,markers=5]"""
+    if not params:
+        return name
+    return f"{name}[{','.join(f'{key}={value}' for key, value in params.items())}]"
+
+def measure(run, repeats=5, sample_time=0.1, warmup=3):
+    """
+    測量單次執行時間
+    先執行 warmup 次預熱，再依單次時間決定每組的執行次數(使每組約 sample_time 秒)，共測量 repeats 組
+
+    回傳: 統計資料 dict (秒)
+    """
+    for _ in range(warmup):
+        run()
+
+    start_time = time.perf_counter()
+    run()
+    single_time = max(time.perf_counter() - start_time, 1e-7)
+    number = max(1, int(sample_time / single_time))
+
+    samples = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        for _ in range(number):
+            run()
+        samples.append((time.perf_counter() - start_time) / number)
+
+    samples = np.array(samples)
+    return {
+        "median": float(np.median(samples)),
+        "min": float(samples.min()),
+        "max": float(samples.max()),
+        "mean": float(samples.mean()),
+        "stddev": float(samples.std()),
+        "number": number,
+        "repeats": repeats,
+    }
+
+def git_commit():
+    """取得目前的 git commit (無法取得時回傳 unknown)"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def machine_info():
+    """測試環境資訊"""
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "opencv_threads": cv2.getNumThreads(),
+    }
+
+def run_benchmarks(name_filter=None, repeats=5, sample_time=0.1, video=None):
+    """執行所有(或名稱包含 name_filter 的)基準測試，回傳結果 dict"""
+    results = {}
+    for name, (setup, params) in BENCHMARKS.items():
+        if name_filter and name_filter not in name:
+            continue
+        for combination in expand_params(params):
+            key = result_key(name, combination)
+            try:
+                run = setup(**combination, video=video)
+                with contextlib.redirect_stdout(io.StringIO()):  # 忽略測試過程中的輸出
+                    stats = measure(run, repeats=repeats, sample_time=sample_time)
+            except Exception as e:
+                print(f"{key:<70} 失敗: {e}")
+                continue
+            stats["params"] = combination
+            results[key] = stats
+            print(f"{key:<70} {stats['median'] * 1000:10.3f} ms  (±{stats['stddev'] * 1000:.3f})")
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "video": video,
+        "machine": machine_info(),
+        "results": results,
+    }
+
+def save_results(results, path=None):
+    """將結果寫入 JSON 檔案 (預設為 benchmark_results/<時間>_<commit>.json)"""
+    if path is None:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        filename = f"{time.strftime('%Y%m%d_%H%M%S')}_{results['commit']}.json"
+        path = os.path.join(DEFAULT_RESULTS_DIR, filename)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"已儲存基準測試結果: {path}")
+    return path
+
+def compare_results(baseline, current, threshold=0.1):
+    """
+    比較兩次基準測試結果 (中位數)，輸出變化比例
+    變慢超過 threshold 的項目標記為退步，回傳退步項目列表
+    """
+    print(f"\n比較基準: {baseline.get('commit')} ({baseline.get('timestamp')}) -> {current.get('commit')}")
+    regressions = []
+    for key, stats in current["results"].items():
+        base_stats = baseline["results"].get(key)
+        if base_stats is None:
+            continue
+        ratio = stats["median"] / base_stats["median"]
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "  <-- 退步"
+            regressions.append(key)
+        elif ratio < 1 - threshold:
+            mark = "  (改善)"
+        print(f"{key:<70} {base_stats['median'] * 1000:10.3f} -> {stats['median'] * 1000:10.3f} ms  x{ratio:.2f}{mark}")
+    if regressions:
+        print(f"\n共 {len(regressions)} 項變慢超過 {threshold:.0%}")
+    return regressions
+
+def main():
+    """執行基準測試 (命令列工具)"""
+    parser = argparse.ArgumentParser(description="ArUco 追蹤與 FlowMap 熱點路徑基準測試")
+    parser.add_argument("--filter", default=None, help="只執行名稱包含此字串的測試")
+    parser.add_argument("--repeats", type=int, default=5, help="每項測試的測量組數")
+    parser.add_argument("--sample-time", type=float, default=0.1, help="每組測量的目標時間 (秒)")
+    parser.add_argument("--video", default=None, help="重播的影片路徑 (有對應的 _ground_truth.json 時使用其校準資訊，否則使用同一資料夾的 session.json，只測量時間)；未指定時使用合成場景")
+    parser.add_argument("--output", default=None, help="結果輸出路徑 (預設為 benchmark_results/)")
+    parser.add_argument("--compare", default=None, help="與先前的結果檔案比較")
+    parser.add_argument("--threshold", type=float, default=0.1, help="視為退步的變慢比例")
+    parser.add_argument("--list", action="store_true", help="列出所有測試項目")
+    parser.add_argument("--accuracy", action="store_true", help="比較各檢測模式與原始解析度檢測的檢出率與角點誤差")
+    parser.add_argument("--allocations", action="store_true", help="只檢查 FlowMap 更新每幀的記憶體配置維持固定 (未通過時結束代碼為1)")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (_, params) in BENCHMARKS.items():
+            for combination in expand_params(params):
+                print(result_key(name, combination))
+        return
+
+    if args.allocations:
+        if run_allocation_checks():
+            raise SystemExit(1)
+        return
+
+    results = run_benchmarks(args.filter, args.repeats, args.sample_time, args.video)
+    if args.accuracy:
+        results["accuracy"] = run_accuracy(args.video)
+    save_results(results, args.output)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare_results(baseline, results, args.threshold):
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import argparse
+import glob
+import json
+import os
+import time
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+
+# 預設的相機校準設定檔路徑(與主程式位於同一資料夾)
+DEFAULT_PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "camera_calibration.json")
+
+class CameraCalibrator:
+    """相機內部參數校準類(支援棋盤格與ChArUco校準板)"""
+
+    def __init__(self, pattern="checkerboard", board_size=(9, 6), square_size=0.025, marker_size=0.018):
+        """
+        初始化相機校準器
+
+        參數:
+        pattern: 校準板類型 ("checkerboard" 或 "charuco")
+        board_size: 校準板尺寸 (棋盤格為內角點數量；ChArUco為方格數量)
+        square_size: 方格邊長 (公尺)
+        marker_size: ChArUco 板上 ArUco Marker 的邊長 (公尺)
+        """
+        self.pattern = pattern
+        self.board_size = tuple(board_size)
+        self.square_size = square_size
+        self.marker_size = marker_size
+
+        self.object_points = []  # 每張校準影像的世界座標點
+        self.image_points = []   # 每張校準影像檢測到的影像座標點
+        self.image_size = None   # 校準影像大小 (寬, 高)
+
+        if self.pattern == "checkerboard":
+            # 棋盤格內角點的世界座標 (Z=0 平面)
+            cols, rows = self.board_size
+            self.board_object_points = np.zeros((cols * rows, 3), np.float32)
+            self.board_object_points[:, :2] = np.mgrid[0:cols, 0:rows].T.reshape(-1, 2) * self.square_size
+        elif self.pattern == "charuco":
+            self.aruco_dict = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
+            self.charuco_board = aruco.CharucoBoard(self.board_size, self.square_size, self.marker_size, self.aruco_dict)
+            self.charuco_detector = aruco.CharucoDetector(self.charuco_board)
+        else:
+            raise ValueError(f"不支援的校準板類型: {pattern}")
+
+    def add_frame(self, frame):
+        """檢測影像中的校準板，成功時加入校準資料並回傳 True"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        self.image_size = (gray.shape[1], gray.shape[0])
+
+        if self.pattern == "checkerboard":
+            found, corners = cv2.findChessboardCorners(
+                gray, self.board_size,
+                flags=cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE
+            )
+            if not found:
+                return False
+            # 角點次像素精細化
+            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+            corners = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
+            self.object_points.append(self.board_object_points)
+            self.image_points.append(corners)
+            return True
+
+        # ChArUco: 至少需要6個角點才能提供足夠的約束
+        charuco_corners, charuco_ids, _, _ = self.charuco_detector.detectBoard(gray)
+        if charuco_ids is None or len(charuco_ids) < 6:
+            return False
+        obj_points, img_points = self.charuco_board.matchImagePoints(charuco_corners, charuco_ids)
+        self.object_points.append(obj_points)
+        self.image_points.append(img_points)
+        return True
+
+    def frame_count(self):
+        """已收集的校準影像數量"""
+        return len(self.image_points)
+
+    def calibrate(self):
+        """
+        執行相機校準
+
+        回傳:
+        (rms, camera_matrix, dist_coeffs)，校準影像不足時回傳 None
+        """
+        if self.frame_count() < 3 or self.image_size is None:
+            print(f"錯誤: 校準影像不足 ({self.frame_count()} 張)，至少需要3張")
+            return None
+
+        rms, camera_matrix, dist_coeffs, _, _ = cv2.calibrateCamera(
+            self.object_points, self.image_points, self.image_size, None, None
+        )
+        print(f"相機校準完成，重投影誤差(RMS): {rms:.4f} px")
+        print("相機內部參數矩陣:")
+        print(camera_matrix)
+        print(f"畸變係數: {dist_coeffs.ravel()}")
+        return rms, camera_matrix, dist_coeffs
+
+def save_calibration_profile(path, camera_matrix, dist_coeffs, image_size, rms=None, extra=None):
+    """將相機內部參數與畸變係數儲存為 JSON 校準設定檔"""
+    profile = load_calibration_profile(path) if os.path.exists(path) else {}
+    profile.update({
+        "camera_matrix": np.asarray(camera_matrix, dtype=np.float64).tolist(),
+        "dist_coeffs": np.asarray(dist_coeffs, dtype=np.float64).ravel().tolist(),
+        "image_size": [int(image_size[0]), int(image_size[1])],
+    })
+    if rms is not None:
+        profile["rms"] = float(rms)
+    if extra:
+        profile.update(extra)
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    print(f"已儲存相機校準設定檔: {path}")
+
+def update_calibration_profile(path, values):
+    """更新 JSON 校準設定檔中的指定項目 (保留其他項目，設定檔不存在時建立)"""
+    profile = load_calibration_profile(path) if os.path.exists(path) else {}
+    profile.update(values)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, indent=2)
+    print(f"已更新校準設定檔: {path}")
+
+def load_calibration_profile(path):
+    """讀取 JSON 校準設定檔 (回傳 dict)"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def calibrate_from_images(calibrator, image_paths):
+    """使用已拍攝的校準影像進行校準"""
+    for image_path in image_paths:
+        frame = cv2.imread(image_path)
+        if frame is None:
+            print(f"[警告] 無法讀取影像: {image_path}")
+            continue
+        found = calibrator.add_frame(frame)
+        print(f"{image_path}: {'檢測到校準板' if found else '未檢測到校準板'}")
+
+def calibrate_from_camera(calibrator, camera_index, num_frames, capture_interval=1.0):
+    """從相機即時擷取校準影像 (每隔 capture_interval 秒自動擷取一張檢測到校準板的影像，按 q 結束)"""
+    cap = cv2.VideoCapture(camera_index)
+    if not cap.isOpened():
+        print("無法開啟攝像頭")
+        return
+
+    last_capture_time = 0.0
+    try:
+        while calibrator.frame_count() < num_frames:
+            ret, frame = cap.read()
+            if not ret:
+                continue
+
+            now = time.time()
+            if now - last_capture_time >= capture_interval and calibrator.add_frame(frame):
+                last_capture_time = now
+                print(f"已擷取校準影像 {calibrator.frame_count()}/{num_frames}")
+
+            display_frame = frame.copy()
+            cv2.putText(display_frame, f"Captured: {calibrator.frame_count()}/{num_frames}",
+                        (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+            cv2.imshow("Camera Calibration", display_frame)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        cap.release()
+        cv2.destroyWindow("Camera Calibration")
+
+def main():
+    """相機校準流程 (命令列工具)"""
+    parser = argparse.ArgumentParser(description="相機內部參數校準 (棋盤格 / ChArUco)")
+    parser.add_argument("--pattern", choices=["checkerboard", "charuco"], default="checkerboard")
+    parser.add_argument("--board", default="9x6", help="校準板尺寸，例如 9x6")
+    parser.add_argument("--square", type=float, default=0.025, help="方格邊長 (公尺)")
+    parser.add_argument("--marker", type=float, default=0.018, help="ChArUco Marker 邊長 (公尺)")
+    parser.add_argument("--camera", type=int, default=4, help="相機編號")
+    parser.add_argument("--images", default=None, help="校準影像路徑 (glob)，指定時不使用相機")
+    parser.add_argument("--frames", type=int, default=20, help="從相機擷取的校準影像數量")
+    parser.add_argument("--output", default=DEFAULT_PROFILE_PATH, help="校準設定檔輸出路徑")
+    args = parser.parse_args()
+
+    board_size = tuple(int(v) for v in args.board.lower().split("x"))
+    calibrator = CameraCalibrator(args.pattern, board_size, args.square, args.marker)
+
+    if args.images:
+        calibrate_from_images(calibrator, sorted(glob.glob(args.images)))
+    else:
+        calibrate_from_camera(calibrator, args.camera, args.frames)
+
+    result = calibrator.calibrate()
+    if result is None:
+        return
+    rms, camera_matrix, dist_coeffs = result
+    save_calibration_profile(args.output, camera_matrix, dist_coeffs, calibrator.image_size, rms)
+
+if __name__ == "__main__":
+    main()
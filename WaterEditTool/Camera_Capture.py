@@ -0,0 +1,186 @@
+import threading
+import cv2
+from Performance_Metrics import metrics
+
+def fourcc_code(name):
+    """FOURCC 字串 (例如 "YUYV"、"MJPG") -> VideoCapture 使用的整數代碼"""
+    return cv2.VideoWriter_fourcc(*name)
+
+def fourcc_name(code):
+    """VideoCapture 回報的整數代碼 -> FOURCC 字串 (無法辨識時回傳空字串)"""
+    code = int(code)
+    name = "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4))
+    return name if name.isprintable() and name.strip() else ""
+
+class ColorFrame:
+    """
+    延遲轉換的彩色影像
+    保存相機原始緩衝區 (YUYV/UYVY、MJPEG、灰階或已轉換的 BGR)，亮度(Y)直接取用，
+    只有顯示、快照或錄影需要時才轉換為 BGR (轉換結果快取，同一幀只轉換一次)
+    """
+
+    def __init__(self, raw, layout):
+        """
+        raw: 相機原始緩衝區
+        layout: 緩衝區格式 ("yuyv" / "uyvy": (H, W, 2)；"mjpeg": 壓縮資料；"gray": (H, W)；"bgr": (H, W, 3))
+        """
+        self.raw = raw
+        self.layout = layout
+        self.color = None
+
+    def luma(self):
+        """檢測用的灰階影像 (YUYV/UYVY 直接取出 Y 通道，MJPEG 只解碼亮度，不做色彩轉換)"""
+        if self.layout == "yuyv":
+            return cv2.extractChannel(self.raw, 0)
+        if self.layout == "uyvy":
+            return cv2.extractChannel(self.raw, 1)
+        if self.layout == "mjpeg":
+            return cv2.imdecode(self.raw, cv2.IMREAD_GRAYSCALE)
+        if self.layout == "gray":
+            return self.raw
+        return cv2.cvtColor(self.raw, cv2.COLOR_BGR2GRAY)
+
+    def bgr(self):
+        """BGR 彩色影像 (第一次呼叫時轉換)"""
+        color = self.color
+        if color is None:
+            with metrics.timer("capture.color_convert"):
+                if self.layout == "yuyv":
+                    color = cv2.cvtColor(self.raw, cv2.COLOR_YUV2BGR_YUYV)
+                elif self.layout == "uyvy":
+                    color = cv2.cvtColor(self.raw, cv2.COLOR_YUV2BGR_UYVY)
+                elif self.layout == "mjpeg":
+                    color = cv2.imdecode(self.raw, cv2.IMREAD_COLOR)
+                elif self.layout == "gray":
+                    color = cv2.cvtColor(self.raw, cv2.COLOR_GRAY2BGR)
+                else:
+                    color = self.raw
+            self.color = color
+        return color
+
+class WarpedColorFrame:
+    """延遲計算的透視變換後彩色影像 (只有顯示或快照需要時才轉換並透視變換彩色影像)"""
+
+    def __init__(self, color_frame, pool_detector):
+        self.color_frame = color_frame
+        self.pool_detector = pool_detector
+        self.color = None
+
+    def bgr(self):
+        color = self.color
+        if color is None:
+            with metrics.timer("capture.color_warp"):
+                color = self.pool_detector.warp_frame(self.color_frame.bgr())
+            self.color = color
+        return color
+
+class CameraCapture:
+    """
+    相機擷取 (與 cv2.VideoCapture 相同的 read()/get()/set()/isOpened()/release() 介面)
+    開啟時協商相機的影像格式 (FOURCC、解析度與幀率)，並要求相機回傳未轉換的原始緩衝區；
+    read() 回傳 BGR 影像 (校準頁面與多相機模式使用)，read_luma() 直接取出亮度作為檢測用的灰階影像，
+    彩色影像以 ColorFrame 延遲轉換，追蹤時只有顯示、快照或錄影需要才進行 BGR 轉換
+    相機不支援回傳原始緩衝區時(後端忽略 CAP_PROP_CONVERT_RGB)，以 BGR 影像轉換灰階，結果與原本相同
+    """
+
+    def __init__(self, source, fourcc=None, width=None, height=None, fps=None, luma=True):
+        """
+        source: VideoCapture 的來源 (相機編號或影片路徑)
+        fourcc: 要求的影像格式 (例如 "YUYV"、"MJPG"；None 表示使用相機預設格式)
+        width / height / fps: 要求的解析度與幀率 (None 表示使用相機預設值)
+        luma: 追蹤時是否直接使用亮度檢測 (FramePipeline 依此決定使用 read_luma)
+        """
+        self.source = source
+        self.luma = luma
+        self.metrics = metrics
+        self.lock = threading.Lock()  # 校準頁面的定時器與追蹤管線可能同時讀取
+        self.cap = cv2.VideoCapture(source)
+        self.raw = False            # 相機是否回傳未轉換的原始緩衝區
+        self.fourcc = ""            # 相機實際使用的影像格式
+        self.frame_size = (0, 0)
+        self.fps = 0.0
+        if self.cap.isOpened():
+            self.negotiate(fourcc, width, height, fps)
+
+    def negotiate(self, fourcc, width, height, fps):
+        """設定影像格式並讀回相機實際使用的值 (相機可能改用最接近的格式)"""
+        # FOURCC 需在解析度之前設定，部分相機依格式決定可用的解析度
+        if fourcc:
+            self.cap.set(cv2.CAP_PROP_FOURCC, fourcc_code(fourcc))
+        if width:
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if fps:
+            self.cap.set(cv2.CAP_PROP_FPS, fps)
+        if self.luma:
+            # 要求回傳未轉換的原始緩衝區 (不支援時 set 回傳 False，read 仍回傳 BGR 影像)
+            self.raw = bool(self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+
+        self.fourcc = fourcc_name(self.cap.get(cv2.CAP_PROP_FOURCC))
+        self.frame_size = (int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        if fourcc and self.fourcc and self.fourcc != fourcc:
+            print(f"[相機] 相機不支援 {fourcc} 格式，使用 {self.fourcc}")
+        print(f"[相機] 格式: {self.fourcc or '未知'}  {self.frame_size[0]}x{self.frame_size[1]} @ {self.fps:.1f} fps  "
+              f"{'原始緩衝區' if self.raw else 'BGR'}")
+
+    def buffer_layout(self, raw):
+        """依緩衝區形狀判斷格式 (後端可能以 (H, W, 2) 或一維的位元組回傳原始緩衝區)"""
+        width, height = self.frame_size
+        if raw.ndim == 3:
+            if raw.shape[2] == 3:
+                return raw, "bgr"
+            if raw.shape[2] == 2:
+                return raw, "uyvy" if self.fourcc == "UYVY" else "yuyv"
+        if raw.ndim == 2 and raw.shape[0] > 1:
+            return raw, "gray"
+        if raw.size == width * height * 2 and self.fourcc in ("YUYV", "YUY2", "UYVY"):
+            return raw.reshape(height, width, 2), "uyvy" if self.fourcc == "UYVY" else "yuyv"
+        if raw.size == width * height:
+            return raw.reshape(height, width), "gray"
+        return raw.reshape(-1), "mjpeg"
+
+    def grab_frame(self):
+        """讀取一幀，回傳 ColorFrame (讀取失敗時回傳 None)"""
+        with self.lock:
+            ret, raw = self.cap.read()
+        if not ret or raw is None:
+            return None
+        if not self.raw:
+            return ColorFrame(raw, "bgr")
+        return ColorFrame(*self.buffer_layout(raw))
+
+    def read(self):
+        """讀取一幀 BGR 影像 (與 cv2.VideoCapture.read 相同)"""
+        color_frame = self.grab_frame()
+        if color_frame is None:
+            return False, None
+        frame = color_frame.bgr()
+        return frame is not None, frame
+
+    def read_luma(self):
+        """
+        讀取一幀檢測用的灰階影像
+        回傳: (ret, 灰階影像, ColorFrame)；彩色影像需要時再呼叫 ColorFrame.bgr()
+        """
+        color_frame = self.grab_frame()
+        if color_frame is None:
+            return False, None, None
+        with self.metrics.timer("capture.luma"):
+            gray = color_frame.luma()
+        if gray is None:
+            return False, None, None  # 損毀的 MJPEG 幀
+        return True, gray, color_frame
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def release(self):
+        self.cap.release()
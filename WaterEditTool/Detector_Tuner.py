@@ -0,0 +1,224 @@
+import argparse
+import contextlib
+import io
+import time
+import cv2
+import numpy as np
+from Camera_Calibration import DEFAULT_PROFILE_PATH, update_calibration_profile
+from Session_Recorder import SessionReplay
+
+# 逐項搜尋的候選參數 (依序調整每一項，每一項保留通過門檻且最快的設定，再進行下一項)
+SEARCH_STAGES = [
+    # 自適應閾值的視窗大小: 每個視窗大小都是一次完整的閾值化與輪廓搜尋 (預設 3~40 間隔2 共19次)
+    ("adaptive_threshold", [
+        {"adaptiveThreshWinSizeMin": 3, "adaptiveThreshWinSizeMax": 23, "adaptiveThreshWinSizeStep": 10},
+        {"adaptiveThreshWinSizeMin": 5, "adaptiveThreshWinSizeMax": 25, "adaptiveThreshWinSizeStep": 10},
+        {"adaptiveThreshWinSizeMin": 7, "adaptiveThreshWinSizeMax": 37, "adaptiveThreshWinSizeStep": 15},
+        {"adaptiveThreshWinSizeMin": 5, "adaptiveThreshWinSizeMax": 15, "adaptiveThreshWinSizeStep": 10},
+        {"adaptiveThreshWinSizeMin": 13, "adaptiveThreshWinSizeMax": 23, "adaptiveThreshWinSizeStep": 10},
+        {"adaptiveThreshWinSizeMin": 9, "adaptiveThreshWinSizeMax": 9, "adaptiveThreshWinSizeStep": 10},
+        {"adaptiveThreshWinSizeMin": 15, "adaptiveThreshWinSizeMax": 15, "adaptiveThreshWinSizeStep": 10},
+        {"adaptiveThreshWinSizeMin": 23, "adaptiveThreshWinSizeMax": 23, "adaptiveThreshWinSizeStep": 10},
+    ]),
+    # 最小 Marker 周長 (相對於影像最大邊長): 提早排除小輪廓
+    ("marker_perimeter", [{"minMarkerPerimeterRate": rate} for rate in (0.02, 0.05, 0.08, 0.12)]),
+    # ArUco3 檢測: 依最小 Marker 大小縮小影像後再搜尋輪廓
+    ("decimation", [{"useAruco3Detection": True, "minSideLengthCanonicalImg": 32,
+                     "minMarkerLengthRatioOriginalImg": ratio} for ratio in (0.02, 0.04, 0.08)]),
+    # 角點精細化 (由角點誤差門檻決定是否需要)
+    ("corner_refinement", [{"cornerRefinementMethod": method} for method in
+                           (cv2.aruco.CORNER_REFINE_NONE, cv2.aruco.CORNER_REFINE_SUBPIX,
+                            cv2.aruco.CORNER_REFINE_CONTOUR)]),
+]
+
+class DetectorTuner:
+    """
+    ArUco 檢測參數自動調整
+    以目前的檢測參數在錄製的水池影像上的結果為基準，逐項搜尋候選參數，
+    保留檢出率(與基準相同的 Marker)、誤檢率與角點誤差皆在容許範圍內且每幀檢測時間最短的設定
+    """
+
+    def __init__(self, tracker, frames, tolerance=0.02, max_corner_error=1.0, repeats=2, transforms=None):
+        """
+        tracker: ArUcoTracker (使用其 detect_markers，與追蹤時相同的原始影像+透視變換影像兩次檢測)
+        frames: 錄製的影像列表
+        transforms: 錄製時檢測每一幀所使用的透視變換矩陣列表 (SessionReplay.transform_matrix，可省略)
+        tolerance: 容許的檢出率下降與誤檢比例 (相對於基準檢測到的 Marker 數量)
+        max_corner_error: 容許的平均角點誤差 (像素，透視變換後的座標)
+        repeats: 每組參數的計時次數 (取最短時間，降低其他程式干擾)
+        """
+        self.tracker = tracker
+        self.pool_detector = tracker.pool_detector
+        self.frames = frames
+        self.transforms = self.prepare_transforms(transforms or [None] * len(frames))
+        self.tolerance = tolerance
+        self.max_corner_error = max_corner_error
+        self.repeats = repeats
+        self.reference = None  # 基準參數在每一幀的檢測結果 [{id: (4,2) 角點}, ...]
+        self.results = []      # 每組評估過的參數與結果
+
+    def prepare_transforms(self, transforms):
+        """
+        每一幀的 (透視變換矩陣, remap表)；同一個矩陣只計算一次 remap 表，
+        避免偏移校正前後的幀交替時在計時中重新計算
+        """
+        prepared = {}
+        result = []
+        for matrix in transforms:
+            if matrix is None:
+                result.append(None)
+                continue
+            if id(matrix) not in prepared:
+                rectify_maps = None
+                if self.pool_detector.camera_matrix is not None:
+                    rectify_maps = self.pool_detector.compute_rectify_maps(matrix, self.pool_detector.get_output_size())
+                prepared[id(matrix)] = (matrix, rectify_maps)
+            result.append(prepared[id(matrix)])
+        return result
+
+    def detect_all(self, parameters):
+        """以指定參數檢測所有幀，回傳 (每幀平均檢測時間, 每幀的檢測結果)"""
+        self.pool_detector.set_detector_parameters(parameters)
+        self.tracker.detection_scale = 1.0
+        best_time = None
+        detections = None
+        for _ in range(self.repeats):
+            detections = []
+            start_time = time.perf_counter()
+            for frame, transform in zip(self.frames, self.transforms):
+                if transform is not None and transform[0] is not self.pool_detector.transform_matrix:
+                    self.pool_detector.set_transform_matrix(*transform)
+                _, corners, ids_list = self.tracker.detect_markers(frame)
+                detections.append({int(marker_id[0]): np.asarray(corner, dtype=np.float32).reshape(4, 2)
+                                   for marker_id, corner in zip(ids_list, corners)})
+            elapsed = (time.perf_counter() - start_time) / len(self.frames)
+            best_time = elapsed if best_time is None else min(best_time, elapsed)
+        return best_time, detections
+
+    def score(self, detections):
+        """與基準結果比較，回傳 (檢出率, 誤檢比例, 平均角點誤差)"""
+        expected = sum(len(reference) for reference in self.reference)
+        matched = 0
+        extra = 0
+        errors = []
+        for reference, detected in zip(self.reference, detections):
+            for marker_id, corners in detected.items():
+                if marker_id in reference:
+                    matched += 1
+                    errors.append(np.linalg.norm(corners - reference[marker_id], axis=1).mean())
+                else:
+                    extra += 1
+        recall = matched / expected if expected else 1.0
+        extra_rate = extra / expected if expected else float(extra)
+        return recall, extra_rate, float(np.mean(errors)) if errors else 0.0
+
+    def evaluate(self, name, parameters):
+        """評估一組參數，回傳結果 dict"""
+        detect_time, detections = self.detect_all(parameters)
+        if self.reference is None:
+            self.reference = detections  # 第一組(基準)參數的結果作為比較基準
+        recall, extra_rate, corner_error = self.score(detections)
+        result = {
+            "name": name,
+            "parameters": dict(parameters),
+            "time": detect_time,
+            "recall": recall,
+            "extra_rate": extra_rate,
+            "corner_error": corner_error,
+            "passed": (recall >= 1.0 - self.tolerance and extra_rate <= self.tolerance
+                       and corner_error <= self.max_corner_error),
+        }
+        self.results.append(result)
+        print(f"[檢測參數調整] {name:<40} {detect_time * 1000:8.2f} ms/幀  檢出率 {recall:6.1%}  "
+              f"誤檢 {extra_rate:5.1%}  角點誤差 {corner_error:5.2f} px  {'通過' if result['passed'] else '未通過'}")
+        return result
+
+    def tune(self):
+        """
+        執行搜尋並套用最佳參數
+        回傳: (基準結果, 最佳結果)
+        """
+        baseline_parameters = self.pool_detector.get_detector_parameters()
+        self.reference = None
+        baseline = self.evaluate("baseline", baseline_parameters)
+        if not any(self.reference):
+            print("[檢測參數調整] 基準參數未檢測到任何 Marker，無法調整")
+            self.pool_detector.set_detector_parameters(baseline_parameters)
+            return None, None
+
+        best = baseline
+        for stage, options in SEARCH_STAGES:
+            for option in options:
+                label = f"{stage}: " + ", ".join(f"{key}={value}" for key, value in option.items()
+                                                 if key != "minSideLengthCanonicalImg")
+                result = self.evaluate(label, dict(best["parameters"], **option))
+                if result["passed"] and result["time"] < best["time"]:
+                    best = result
+
+        self.pool_detector.set_detector_parameters(best["parameters"])
+        print(f"[檢測參數調整] 每幀檢測時間 {baseline['time'] * 1000:.2f} ms -> {best['time'] * 1000:.2f} ms "
+              f"({baseline['time'] / max(best['time'], 1e-9):.2f}x)，檢出率 {best['recall']:.1%}")
+        return baseline, best
+
+def load_frames(replay, max_frames):
+    """
+    從錄製的工作階段平均取樣最多 max_frames 幀
+    回傳: (影像列表, 錄製時檢測每一幀所使用的透視變換矩陣列表)
+    """
+    step = max(1, replay.frame_count() // max_frames)
+    frames = []
+    transforms = []
+    index = 0
+    while len(frames) < max_frames:
+        ret, frame = replay.read()
+        if not ret:
+            break
+        if index % step == 0:
+            frames.append(frame)
+            transforms.append(replay.last_transform_matrix)
+        index += 1
+    return frames, transforms
+
+def main():
+    """ArUco 檢測參數自動調整 (命令列工具)"""
+    parser = argparse.ArgumentParser(description="在錄製的水池影像上調整 ArUco 檢測參數，並寫入校準設定檔")
+    parser.add_argument("session_dir", help="工作階段資料夾 (Session_Recorder.py 錄製)")
+    parser.add_argument("--frames", type=int, default=60, help="使用的幀數 (從整段影像平均取樣)")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="容許的檢出率下降與誤檢比例")
+    parser.add_argument("--max-corner-error", type=float, default=1.0, help="容許的平均角點誤差 (像素)")
+    parser.add_argument("--repeats", type=int, default=2, help="每組參數的計時次數")
+    parser.add_argument("--output", default=DEFAULT_PROFILE_PATH, help="寫入的校準設定檔")
+    parser.add_argument("--dry-run", action="store_true", help="只顯示結果，不寫入設定檔")
+    args = parser.parse_args()
+
+    from ArUco_to_FlowMap import ArUcoTracker
+
+    replay = SessionReplay(args.session_dir)
+    with contextlib.redirect_stdout(io.StringIO()):  # 忽略建立過程的輸出
+        tracker = ArUcoTracker(replay.create_pool_detector())
+    frames, transforms = load_frames(replay, args.frames)
+    replay.release()
+    if not frames:
+        print("[檢測參數調整] 無法讀取工作階段的影像")
+        return
+    print(f"[檢測參數調整] 使用 {len(frames)} 幀，影像大小 {frames[0].shape[1]}x{frames[0].shape[0]}")
+
+    tuner = DetectorTuner(tracker, frames, args.tolerance, args.max_corner_error, args.repeats, transforms)
+    baseline, best = tuner.tune()
+    if best is None or args.dry_run:
+        return
+    update_calibration_profile(args.output, {
+        "detector_parameters": tracker.pool_detector.get_detector_parameters(),
+        "detector_tuning": {
+            "session": args.session_dir,
+            "frames": len(frames),
+            "baseline_ms": baseline["time"] * 1000,
+            "tuned_ms": best["time"] * 1000,
+            "recall": best["recall"],
+            "extra_rate": best["extra_rate"],
+            "corner_error": best["corner_error"],
+        },
+    })
+
+if __name__ == "__main__":
+    main()
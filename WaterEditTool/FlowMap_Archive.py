@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import time
+import cv2
+import numpy as np
+
+# 索引記錄 (每個環狀緩衝區位置一筆，frame 為 -1 表示尚未寫入)
+INDEX_DTYPE = np.dtype([
+    ("frame", "<i8"),      # FlowMap 幀號 (FlowMapGenerator.current_frame)
+    ("timestamp", "<f8"),  # 寫入時間 (time.time)
+])
+
+def archive_paths(path):
+    """封存檔案路徑 (FlowMap 資料、索引、狀態)"""
+    return path + "_frames.npy", path + "_index.npy", path + ".json"
+
+class FlowMapArchiveWriter:
+    """
+    FlowMap 歷史封存 (寫入端)
+    將累積 FlowMap 依序寫入預先配置的 np.memmap 環狀檔案(可每隔數幀、縮小解析度後寫入)，
+    並記錄幀號與時間的索引；資料由作業系統的分頁快取管理，不額外佔用行程記憶體
+    """
+
+    def __init__(self, path, capacity, frame_shape, decimate=1, scale=1.0, flush_interval=300):
+        """
+        path: 封存檔案路徑(不含副檔名)
+        capacity: 環狀緩衝區可保存的 FlowMap 數量
+        frame_shape: FlowMap 畫布大小 (高, 寬)
+        decimate: 每隔幾幀寫入一次
+        scale: 寫入時的縮放比例
+        flush_interval: 每寫入多少筆更新一次狀態檔
+        """
+        height, width = frame_shape[:2]
+        self.frame_size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        self.path = path
+        self.capacity = capacity
+        self.decimate = decimate
+        self.scale = scale
+        self.flush_interval = flush_interval
+        self.count = 0  # 累計寫入的數量
+
+        frames_path, index_path, _ = archive_paths(path)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.frames = np.lib.format.open_memmap(
+            frames_path, mode="w+", dtype=np.uint8, shape=(capacity, self.frame_size[1], self.frame_size[0], 3))
+        self.index = np.lib.format.open_memmap(index_path, mode="w+", dtype=INDEX_DTYPE, shape=(capacity,))
+        self.index["frame"] = -1
+        self.write_state()
+        print(f"[FlowMap封存] {frames_path} ({capacity} 筆，{self.frame_size[0]}x{self.frame_size[1]}，每 {decimate} 幀)")
+
+    def write_state(self):
+        """寫入狀態檔 (封存設定與累計寫入數量)"""
+        state = {
+            "capacity": self.capacity,
+            "frame_size": list(self.frame_size),
+            "decimate": self.decimate,
+            "scale": self.scale,
+            "count": self.count,
+            "updated": time.time(),
+        }
+        with open(archive_paths(self.path)[2], "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+
+    def append(self, frame_number, flowmap, timestamp=None):
+        """寫入一幀 FlowMap (依 decimate 略過的幀不寫入)，回傳是否寫入"""
+        if frame_number % self.decimate:
+            return False
+
+        slot = self.count % self.capacity
+        target = self.frames[slot]
+        if flowmap.shape[1::-1] == self.frame_size:
+            np.copyto(target, flowmap)
+        else:
+            # 直接縮放寫入記憶體映射的位置，不建立暫存影像
+            cv2.resize(flowmap, self.frame_size, dst=target, interpolation=cv2.INTER_AREA)
+
+        # 先寫入資料再更新索引，讀取端只會看到已寫入完成的 FlowMap
+        self.index[slot] = (frame_number, timestamp if timestamp is not None else time.time())
+        self.count += 1
+        if self.count % self.flush_interval == 0:
+            self.write_state()
+        return True
+
+    def close(self):
+        """將資料寫回磁碟並更新狀態檔"""
+        self.frames.flush()
+        self.index.flush()
+        self.write_state()
+
+class FlowMapArchiveReader:
+    """
+    FlowMap 歷史封存 (讀取端)
+    以唯讀 np.memmap 開啟封存檔案，依幀號或時間範圍取得 FlowMap；
+    回傳的陣列直接引用記憶體映射的資料，不複製(可在寫入端仍在執行時讀取)
+    """
+
+    def __init__(self, path):
+        frames_path, index_path, state_path = archive_paths(path)
+        with open(state_path, "r", encoding="utf-8") as f:
+            self.state = json.load(f)
+        self.frames = np.load(frames_path, mmap_mode="r")
+        self.index = np.load(index_path, mmap_mode="r")
+        self.order = None  # 依幀號排序的環狀緩衝區位置
+        self.frame_numbers = None
+        self.refresh()
+
+    def refresh(self):
+        """重新讀取索引 (寫入端仍在寫入時，取得最新的FlowMap範圍)"""
+        frame_numbers = np.array(self.index["frame"])
+        valid = np.flatnonzero(frame_numbers >= 0)
+        self.order = valid[np.argsort(frame_numbers[valid], kind="stable")]
+        self.frame_numbers = frame_numbers[self.order]
+
+    def __len__(self):
+        return len(self.order)
+
+    def frame_range(self):
+        """目前保存的幀號範圍 (最舊, 最新)，沒有資料時回傳 None"""
+        if len(self.order) == 0:
+            return None
+        return int(self.frame_numbers[0]), int(self.frame_numbers[-1])
+
+    def get_frame(self, frame_number):
+        """取得不超過 frame_number 的最新一幀 FlowMap (回傳 幀號, FlowMap)，沒有資料時回傳 None"""
+        position = np.searchsorted(self.frame_numbers, frame_number, side="right") - 1
+        if position < 0:
+            return None
+        slot = self.order[position]
+        return int(self.frame_numbers[position]), self.frames[slot]
+
+    def slice_positions(self, start, stop):
+        """
+        將排序後的位置範圍 [start, stop) 轉換為記憶體映射資料的切片
+        環狀緩衝區中連續的範圍最多分為兩段 (寫入位置繞回開頭時)
+        """
+        if stop <= start:
+            return []
+        slots = self.order[start:stop]
+        if slots[-1] - slots[0] == len(slots) - 1:
+            return [slice(int(slots[0]), int(slots[-1]) + 1)]
+        wrap = int(np.flatnonzero(np.diff(slots) != 1)[0]) + 1
+        return [slice(int(slots[0]), int(slots[wrap - 1]) + 1), slice(int(slots[wrap]), int(slots[-1]) + 1)]
+
+    def read_range(self, start_frame, end_frame):
+        """
+        取得幀號介於 [start_frame, end_frame) 的 FlowMap
+        回傳: [(FlowMap 陣列, 索引記錄), ...]，每段皆為記憶體映射資料的視圖(不複製)，依幀號排序
+        """
+        start = np.searchsorted(self.frame_numbers, start_frame, side="left")
+        stop = np.searchsorted(self.frame_numbers, end_frame, side="left")
+        return [(self.frames[part], self.index[part]) for part in self.slice_positions(start, stop)]
+
+    def read_time_range(self, start_time, end_time):
+        """取得寫入時間介於 [start_time, end_time) 的 FlowMap (格式與 read_range 相同)"""
+        timestamps = np.array(self.index["timestamp"])[self.order]
+        start = np.searchsorted(timestamps, start_time, side="left")
+        stop = np.searchsorted(timestamps, end_time, side="left")
+        return [(self.frames[part], self.index[part]) for part in self.slice_positions(start, stop)]
+
+def main():
+    """查看或匯出 FlowMap 封存 (命令列工具)"""
+    parser = argparse.ArgumentParser(description="FlowMap 歷史封存工具")
+    parser.add_argument("path", help="封存檔案路徑 (不含副檔名)")
+    parser.add_argument("--export", default=None, help="將指定範圍的 FlowMap 匯出為圖片的資料夾")
+    parser.add_argument("--start", type=int, default=0, help="起始幀號")
+    parser.add_argument("--end", type=int, default=None, help="結束幀號 (不含)")
+    args = parser.parse_args()
+
+    reader = FlowMapArchiveReader(args.path)
+    frame_range = reader.frame_range()
+    print(f"封存設定: {reader.state}")
+    print(f"保存 {len(reader)} 筆 FlowMap，幀號範圍: {frame_range}")
+
+    if args.export and frame_range is not None:
+        os.makedirs(args.export, exist_ok=True)
+        end_frame = args.end if args.end is not None else frame_range[1] + 1
+        exported = 0
+        for frames, index in reader.read_range(args.start, end_frame):
+            for flowmap, record in zip(frames, index):
+                cv2.imwrite(os.path.join(args.export, f"{int(record['frame']):06d}.png"), flowmap)
+                exported += 1
+        print(f"已匯出 {exported} 張 FlowMap: {args.export}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import contextlib
+import io
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from Session_Recorder import SessionReplay
+
+# 可調整的 FlowMap 參數 (參數名稱 -> 輸出資料夾名稱中使用的縮寫)
+SWEEP_PARAMETERS = {
+    "decay_factor": "decay",
+    "brush_radius": "brush",
+    "sample_frames": "sf",
+}
+
+def create_tracker(session_dir, params):
+    """依工作階段的校準資訊建立追蹤器，並套用 FlowMap 參數"""
+    from ArUco_to_FlowMap import ArUcoTracker
+
+    replay = SessionReplay(session_dir, load_video=False)
+    with contextlib.redirect_stdout(io.StringIO()):  # 忽略建立過程的輸出
+        tracker = ArUcoTracker(replay.create_pool_detector())
+        if replay.water_jet_vectors:
+            tracker.update_water_jet_vectors(replay.water_jet_vectors)
+
+    flow_map_generator = tracker.flow_map_generator
+    for name, value in params.items():
+        setattr(flow_map_generator, name, value)
+        if name == "brush_radius":
+            flow_map_generator.base_brush_radius = value  # 保持品質調整時的縮放基準一致
+    return replay, tracker
+
+def job_label(params):
+    """依參數產生輸出名稱，例如 decay0.95_brush20_sf30"""
+    if not params:
+        return "default"
+    return "_".join(f"{SWEEP_PARAMETERS.get(name, name)}{value}" for name, value in params.items())
+
+def render_job(job):
+    """
+    [工作程序] 將錄製的檢測結果直接送入卡爾曼濾波與 FlowMapGenerator (略過擷取與檢測)，
+    輸出 start ~ end 幀的累積 FlowMap
+
+    job (dict):
+    session_dir: 工作階段資料夾
+    params: FlowMap 參數
+    start / end: 輸出的幀範圍
+    warmup: 分段處理時，在 start 之前先處理的幀數(使卡爾曼濾波與 FlowMap 累積達到穩定狀態)
+    every: 每隔幾幀輸出一次
+    output: ("images", 資料夾) 或 ("memmap", .npy 檔案路徑, 輸出索引偏移)
+    """
+    cv2.setNumThreads(1)  # 每個工作程序只使用一個核心，避免多個程序之間互相搶占
+    replay, tracker = create_tracker(job["session_dir"], job["params"])
+    frames = replay.frames
+    flow_map_generator = tracker.flow_map_generator
+
+    output_kind = job["output"][0]
+    stack = None
+    if output_kind == "memmap":
+        stack = np.load(job["output"][1], mmap_mode="r+")
+    else:
+        os.makedirs(job["output"][1], exist_ok=True)
+
+    start, end, every = job["start"], job["end"], job["every"]
+    first = max(0, start - job["warmup"])
+    rendered = 0
+
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for index in range(first, end):
+            # 套用錄製時的透視變換 (追蹤途中的校正)，使水池遮罩與座標換算與錄製時相同
+            transform_matrix = replay.transform_matrix(index)
+            if transform_matrix is not None and transform_matrix is not tracker.pool_detector.transform_matrix:
+                tracker.pool_detector.set_transform_matrix(transform_matrix)
+            corners, ids_list = replay.detections(index)
+            tracker.track_markers(None, corners, ids_list, float(frames[index]["capture_time"]))
+
+            if index < start or (index - start) % every:
+                continue
+            if stack is not None:
+                stack[job["output"][2] + (index - start) // every] = flow_map_generator.accumulated_flowmap
+            else:
+                cv2.imwrite(os.path.join(job["output"][1], f"{index:06d}.png"), flow_map_generator.accumulated_flowmap)
+            rendered += 1
+    elapsed = time.perf_counter() - start_time
+
+    if stack is not None:
+        stack.flush()
+    return {
+        "label": job_label(job["params"]),
+        "start": start,
+        "end": end,
+        "processed": end - first,
+        "rendered": rendered,
+        "elapsed": elapsed,
+    }
+
+def canvas_shape(session_dir):
+    """取得工作階段的 FlowMap 畫布大小 (高, 寬, 3)"""
+    _, tracker = create_tracker(session_dir, {})
+    return tracker.flow_map_generator.accumulated_flowmap.shape
+
+def build_jobs(session_dir, param_sets, output_dir, output_format="images", segments=1, warmup=120, every=1,
+               start=0, end=None):
+    """
+    建立批次工作
+    每組參數切分為 segments 段，各段在各自的程序中處理(分段處理時每段前方額外處理 warmup 幀)；
+    memmap 格式時，每組參數預先建立一個 (幀數, 高, 寬, 3) 的 .npy 記憶體映射檔，各段寫入自己的範圍
+    """
+    frame_count = SessionReplay(session_dir, load_video=False).frame_count()
+    end = frame_count if end is None else min(end, frame_count)
+    shape = canvas_shape(session_dir) if output_format == "memmap" else None
+
+    # 以輸出間隔對齊的分段邊界
+    outputs = len(range(start, end, every))
+    bounds = [start + (outputs * i // segments) * every for i in range(segments)] + [end]
+
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = []
+    for params in param_sets:
+        label = job_label(params)
+        if output_format == "memmap":
+            path = os.path.join(output_dir, f"{label}.npy")
+            np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(outputs,) + tuple(shape)).flush()
+        for segment_start, segment_end in zip(bounds[:-1], bounds[1:]):
+            if segment_end <= segment_start:
+                continue
+            if output_format == "memmap":
+                output = ("memmap", path, (segment_start - start) // every)
+            else:
+                output = ("images", os.path.join(output_dir, label))
+            jobs.append({
+                "session_dir": session_dir,
+                "params": params,
+                "start": segment_start,
+                "end": segment_end,
+                "warmup": warmup if segment_start > 0 else 0,
+                "every": every,
+                "output": output,
+            })
+    return jobs
+
+def run_batch(jobs, workers=None):
+    """以程序池執行所有工作，並回報每個核心的處理速度"""
+    workers = workers or os.cpu_count()
+    print(f"[批次算圖] {len(jobs)} 個工作，{workers} 個程序")
+
+    start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(render_job, jobs))
+    wall_time = time.perf_counter() - start_time
+
+    for result in results:
+        print(f"  {result['label']:<30} 幀 {result['start']:>6}~{result['end']:<6} "
+              f"輸出 {result['rendered']:>5} 幀，{result['processed'] / max(result['elapsed'], 1e-9):7.1f} FPS")
+
+    processed = sum(result["processed"] for result in results)
+    rendered = sum(result["rendered"] for result in results)
+    busy_time = sum(result["elapsed"] for result in results)
+    print(f"[批次算圖] 共處理 {processed} 幀 (輸出 {rendered} 幀)，耗時 {wall_time:.2f} 秒")
+    print(f"[批次算圖] 總速度 {processed / max(wall_time, 1e-9):.1f} FPS，"
+          f"每核心 {processed / max(busy_time, 1e-9):.1f} FPS")
+    return results
+
+def parse_values(text, cast):
+    """解析以逗號分隔的參數值列表"""
+    return [cast(value) for value in text.split(",")] if text else []
+
+def main():
+    """離線 FlowMap 批次算圖 (命令列工具)"""
+    parser = argparse.ArgumentParser(description="從錄製的工作階段離線重新產生 FlowMap 序列")
+    parser.add_argument("session_dir", help="工作階段資料夾 (Session_Recorder.py 錄製)")
+    parser.add_argument("--output", default="flowmap_batch", help="輸出資料夾")
+    parser.add_argument("--format", choices=["images", "memmap"], default="images",
+                        help="輸出格式: 圖片序列或 .npy 記憶體映射陣列")
+    parser.add_argument("--decay", default="", help="decay_factor 值，以逗號分隔，例如 0.9,0.95")
+    parser.add_argument("--brush", default="", help="brush_radius 值，以逗號分隔")
+    parser.add_argument("--sample-frames", default="", help="sample_frames 值，以逗號分隔")
+    parser.add_argument("--segments", type=int, default=1, help="每組參數切分的時間段數")
+    parser.add_argument("--warmup", type=int, default=120, help="分段處理時每段前方額外處理的幀數")
+    parser.add_argument("--every", type=int, default=1, help="每隔幾幀輸出一次")
+    parser.add_argument("--start", type=int, default=0, help="起始幀")
+    parser.add_argument("--end", type=int, default=None, help="結束幀")
+    parser.add_argument("--workers", type=int, default=None, help="程序數量 (預設為CPU核心數)")
+    args = parser.parse_args()
+
+    sweep = {
+        "decay_factor": parse_values(args.decay, float),
+        "brush_radius": parse_values(args.brush, int),
+        "sample_frames": parse_values(args.sample_frames, int),
+    }
+    sweep = {name: values for name, values in sweep.items() if values}
+    param_sets = [dict(zip(sweep, combination)) for combination in itertools.product(*sweep.values())]
+
+    jobs = build_jobs(args.session_dir, param_sets, args.output, args.format, args.segments,
+                      args.warmup, args.every, args.start, args.end)
+    run_batch(jobs, args.workers)
+
+if __name__ == "__main__":
+    main()
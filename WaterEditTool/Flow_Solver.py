@@ -0,0 +1,173 @@
+import cv2
+import numpy as np
+from scipy import fft
+
+def splat(grid, x, y, values):
+    """
+    以雙線性權重將點資料累加到網格上 (向量化處理)
+    grid: (H, W, C) 網格
+    x / y: (N,) 網格座標 (格子中心為整數座標)
+    values: (N, C) 每個點的數值
+    """
+    height, width = grid.shape[:2]
+    x = np.clip(x, 0, width - 1.001)
+    y = np.clip(y, 0, height - 1.001)
+    x0 = x.astype(np.int32)
+    y0 = y.astype(np.int32)
+    fx = (x - x0)[:, None]
+    fy = (y - y0)[:, None]
+    np.add.at(grid, (y0, x0), values * (1 - fx) * (1 - fy))
+    np.add.at(grid, (y0, x0 + 1), values * fx * (1 - fy))
+    np.add.at(grid, (y0 + 1, x0), values * (1 - fx) * fy)
+    np.add.at(grid, (y0 + 1, x0 + 1), values * fx * fy)
+
+class FlowSolver:
+    """
+    網格流體模擬 (FlowMapGenerator 的 physics 模式)
+    在覆蓋水池的粗網格上保存二維速度場，每幀依序:
+    1. 將 Marker 速度(使附近的水流趨近 Marker 速度)與射水動量作為外力加入
+    2. 半拉格朗日平流 (以 cv2.remap 向後追蹤，向量化處理整個網格)
+    3. 阻尼 (模擬摩擦與黏滯造成的能量損失)
+    4. 壓力投影 (以 DCT 求解 Neumann 邊界的 Poisson 方程式，使速度場無散度)
+    速度的單位與 Marker 速度相同(世界座標/秒)，可直接以 FlowMap 的顏色編碼輸出
+    """
+
+    def __init__(self, grid_width=128, grid_height=128, world_radius=2.5, dt=1 / 30.0, damping=0.98,
+                 marker_radius=0.08, marker_coupling=0.5, jet_radius=0.04, jet_acceleration=3.0, mask=None):
+        """
+        grid_width / grid_height: 網格大小
+        world_radius: 歸一化座標 1 對應的世界距離 (與 PoolDetector.world_radius 相同)
+        dt: 每一步的時間 (秒)
+        damping: 每一步的速度保留比例
+        marker_radius: Marker 影響範圍 (高斯標準差，歸一化座標，水池寬度為2)
+        marker_coupling: 每一步將 Marker 位置的水流速度拉向 Marker 速度的比例
+        jet_radius: 射水寬度 (高斯標準差，歸一化座標)
+        jet_acceleration: 射水起點的加速度 (世界座標/秒²，沿射水方向遞減至 10%)
+        mask: 水池範圍遮罩 (任意大小，非0為水池內)，None 表示整個網格
+        """
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.dt = dt
+        self.damping = damping
+        self.marker_coupling = marker_coupling
+        self.jet_acceleration = jet_acceleration
+
+        # 每個格子的世界大小 (歸一化座標 -1~1 對應整個網格)
+        self.cell_x = 2 * world_radius / grid_width
+        self.cell_y = 2 * world_radius / grid_height
+        self.marker_sigma = max(0.5, marker_radius / 2 * grid_width)
+        self.jet_sigma = max(0.5, jet_radius / 2 * grid_width)
+
+        self.velocity = np.zeros((grid_height, grid_width, 2), dtype=np.float32)
+        grid_x, grid_y = np.meshgrid(np.arange(grid_width, dtype=np.float32), np.arange(grid_height, dtype=np.float32))
+        self.grid_x = grid_x
+        self.grid_y = grid_y
+
+        # Neumann 邊界 (DCT-II) 下拉普拉斯運算子的特徵值
+        # (與散度、梯度使用的中央差分一致，投影後內部的散度為0)
+        eigen_x = -(np.sin(np.pi * np.arange(grid_width) / grid_width) / self.cell_x) ** 2
+        eigen_y = -(np.sin(np.pi * np.arange(grid_height) / grid_height) / self.cell_y) ** 2
+        self.laplacian_eigen = eigen_y[:, None] + eigen_x[None, :]
+        self.laplacian_eigen[0, 0] = 1.0  # 常數項(壓力的平均值)不影響速度
+
+        self.mask = None
+        self.set_mask(mask)
+
+    def set_mask(self, mask):
+        """設定水池範圍遮罩 (縮放到網格大小)，水池外的速度固定為0"""
+        if mask is None:
+            self.mask = None
+            return
+        mask = cv2.resize((np.asarray(mask) > 0).astype(np.float32), (self.grid_width, self.grid_height),
+                          interpolation=cv2.INTER_AREA)
+        self.mask = mask[:, :, None]
+        self.velocity *= self.mask
+
+    def reset(self):
+        self.velocity[:] = 0
+
+    def to_grid(self, positions):
+        """歸一化座標 (-1~1) 轉換為網格座標"""
+        positions = np.asarray(positions, dtype=np.float32).reshape(-1, 2)
+        return ((positions[:, 0] + 1) / 2 * self.grid_width - 0.5,
+                (positions[:, 1] + 1) / 2 * self.grid_height - 0.5)
+
+    def apply_marker_forces(self, positions, velocities):
+        """使 Marker 附近的水流速度趨近 Marker 的速度 (影響程度隨距離以高斯函數遞減)"""
+        velocities = np.asarray(velocities, dtype=np.float32).reshape(-1, 2)
+        if len(velocities) == 0:
+            return
+        # 累加權重與加權速度後一起模糊 (3通道只需一次 GaussianBlur)
+        samples = np.zeros((self.grid_height, self.grid_width, 3), dtype=np.float32)
+        x, y = self.to_grid(positions)
+        splat(samples, x, y, np.column_stack([np.ones(len(velocities), dtype=np.float32), velocities]))
+        samples = cv2.GaussianBlur(samples, (0, 0), self.marker_sigma)
+
+        weight = samples[:, :, :1]
+        target = samples[:, :, 1:] / np.maximum(weight, 1e-6)
+        # 單一 Marker 中心的權重為 1
+        blend = np.minimum(weight * (2 * np.pi * self.marker_sigma ** 2) * self.marker_coupling, 1.0)
+        self.velocity += blend * (target - self.velocity)
+
+    def apply_jet_forces(self, jets):
+        """
+        加入射水的動量 (沿射水方向，強度隨距離遞減)
+        jets: [(起點x, 起點y, 方向x, 方向y), ...]，起點為歸一化座標，長度與 WaterJet 的繪製範圍相同
+        """
+        if not jets:
+            return
+        xs, ys, forces = [], [], []
+        for start_x, start_y, dir_x, dir_y in jets:
+            gx, gy = self.to_grid([start_x, start_y])
+            # 射水終點 (繪製長度為畫布的 0.4 倍，即歸一化座標 0.8)
+            length = np.hypot(dir_x * 0.4 * self.grid_width, dir_y * 0.4 * self.grid_height)
+            t = np.linspace(0.0, 1.0, max(2, int(length) + 1), dtype=np.float32)  # 取樣間隔約1格
+            xs.append(gx + dir_x * 0.4 * self.grid_width * t)
+            ys.append(gy + dir_y * 0.4 * self.grid_height * t)
+            strength = self.jet_acceleration * (1.0 - 0.9 * t)
+            forces.append(np.column_stack([strength * dir_x, strength * dir_y]))
+
+        force = np.zeros_like(self.velocity)
+        splat(force, np.concatenate(xs), np.concatenate(ys), np.concatenate(forces).astype(np.float32))
+        # 使射水中心線上的加速度等於 jet_acceleration
+        force = cv2.GaussianBlur(force, (0, 0), self.jet_sigma) * (self.jet_sigma * np.sqrt(2 * np.pi))
+        self.velocity += self.dt * force
+
+    def advect(self):
+        """半拉格朗日平流: 每個格子沿速度向後追蹤，取樣前一步的速度場"""
+        map_x = self.grid_x - self.velocity[:, :, 0] * (self.dt / self.cell_x)
+        map_y = self.grid_y - self.velocity[:, :, 1] * (self.dt / self.cell_y)
+        self.velocity = cv2.remap(self.velocity, map_x, map_y, cv2.INTER_LINEAR,
+                                  borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+    def project(self):
+        """壓力投影: 求解 ∇²p = ∇·u 並扣除壓力梯度，使速度場無散度"""
+        u = self.velocity[:, :, 0]
+        v = self.velocity[:, :, 1]
+        divergence = np.gradient(u, self.cell_x, axis=1) + np.gradient(v, self.cell_y, axis=0)
+        pressure_hat = fft.dctn(divergence, type=2, norm="ortho") / self.laplacian_eigen
+        pressure_hat[0, 0] = 0.0
+        pressure = fft.idctn(pressure_hat, type=2, norm="ortho")
+        u -= np.gradient(pressure, self.cell_x, axis=1).astype(np.float32)
+        v -= np.gradient(pressure, self.cell_y, axis=0).astype(np.float32)
+
+    def divergence(self):
+        """目前速度場的散度 (用於檢查投影結果)"""
+        return (np.gradient(self.velocity[:, :, 0], self.cell_x, axis=1) +
+                np.gradient(self.velocity[:, :, 1], self.cell_y, axis=0))
+
+    def step(self, positions=(), velocities=(), jets=()):
+        """
+        前進一步模擬
+        positions / velocities: 本幀 Marker 的歸一化位置與速度
+        jets: 射水 [(起點x, 起點y, 方向x, 方向y), ...]
+        回傳: (grid_height, grid_width, 2) 速度場
+        """
+        self.apply_marker_forces(positions, velocities)
+        self.apply_jet_forces(jets)
+        self.advect()
+        self.velocity *= self.damping
+        self.project()
+        if self.mask is not None:
+            self.velocity *= self.mask
+        return self.velocity
@@ -0,0 +1,78 @@
+import time
+
+class FramePacer:
+    """
+    以截止時間(deadline)控制幀率的排程器
+    使用 time.perf_counter 計算每一幀的截止時間，只休眠剩餘的時間；
+    處理已落後時不休眠，並記錄超時(overrun)資訊
+    """
+
+    def __init__(self, target_fps=30.0, report_interval=300):
+        """
+        初始化幀率排程器
+
+        參數:
+        target_fps: 目標幀率 (None 或 0 表示不限制，盡可能快速處理)
+        report_interval: 每隔多少幀回報一次超時統計
+        """
+        self.target_fps = target_fps
+        self.frame_interval = 1.0 / target_fps if target_fps else 0.0
+        self.report_interval = report_interval
+        self.next_deadline = None    # 下一幀的截止時間 (perf_counter)
+
+        # 超時統計
+        self.frame_count = 0         # 已排程的幀數
+        self.overrun_count = 0       # 超過截止時間的總幀數
+        self.last_overrun = 0.0      # 最近一次超時的時間長度 (秒)
+        self.window_overruns = 0     # 本次回報區間內的超時幀數
+        self.window_max_overrun = 0.0  # 本次回報區間內的最大超時時間 (秒)
+
+    def reset(self):
+        """重置截止時間 (例如暫停後重新開始)"""
+        self.next_deadline = None
+
+    def wait(self):
+        """
+        等待至下一幀的截止時間
+        已落後時不休眠，記錄超時並以當前時間重新對齊截止時間(避免連續補幀)
+
+        回傳: 本幀開始的時間 (perf_counter)
+        """
+        now = time.perf_counter()
+        self.frame_count += 1
+
+        if not self.frame_interval:
+            return now
+
+        if self.next_deadline is None:
+            # 第一幀: 直接開始
+            self.next_deadline = now + self.frame_interval
+        else:
+            remaining = self.next_deadline - now
+            if remaining > 0:
+                time.sleep(remaining)
+                now = time.perf_counter()
+                self.next_deadline += self.frame_interval
+            else:
+                # 已超過截止時間，不休眠
+                self.record_overrun(-remaining)
+                self.next_deadline = now + self.frame_interval
+
+        if self.report_interval and self.frame_count % self.report_interval == 0:
+            self.report()
+        return now
+
+    def record_overrun(self, overrun):
+        """記錄一次超時"""
+        self.overrun_count += 1
+        self.last_overrun = overrun
+        self.window_overruns += 1
+        self.window_max_overrun = max(self.window_max_overrun, overrun)
+
+    def report(self):
+        """回報本次區間內的超時統計，並重置區間統計"""
+        if self.window_overruns:
+            print(f"[幀率排程] 最近 {self.report_interval} 幀中有 {self.window_overruns} 幀超過截止時間 "
+                  f"(目標 {self.target_fps:.0f} FPS，最大超時 {self.window_max_overrun * 1000:.1f} ms)")
+        self.window_overruns = 0
+        self.window_max_overrun = 0.0
@@ -0,0 +1,404 @@
+import queue
+import threading
+from collections import deque
+import time
+import traceback
+import cv2
+import numpy as np
+from Camera_Capture import WarpedColorFrame
+from Frame_Pacer import FramePacer
+from Performance_Metrics import metrics
+
+# 影像來源結束時，沿管線傳遞的結束標記
+END_OF_STREAM = object()
+
+def encode_flowmap(flowmap):
+    """將FlowMap編碼為jpg格式的bytes"""
+    _, img_encoded = cv2.imencode('.jpg', flowmap)
+    return img_encoded.tobytes()
+
+class FramePacket:
+    """在管線各階段之間傳遞的幀資料(附帶幀序號)"""
+
+    def __init__(self, seq, frame, capture_time, origin_ns=None, source_time=None, color_frame=None,
+                 source_transform=None):
+        self.seq = seq                    # 幀序號 (由擷取階段遞增產生)
+        self.frame = frame                # 相機原始影像 (以亮度檢測時為灰階影像)
+        self.color_frame = color_frame    # 以亮度檢測時的彩色影像 (ColorFrame，需要時才轉換為 BGR)
+        # 影像來源指定的透視變換矩陣 (重播錄製的工作階段時為錄製時使用的矩陣，檢測前套用)
+        self.source_transform = source_transform
+        self.capture_time = capture_time  # 擷取時間 (time.perf_counter)
+        # 影像來源的時間戳記 (重播錄製的工作階段時為錄製時的擷取時間)，用於計算卡爾曼濾波的時間步長
+        self.source_time = source_time if source_time is not None else capture_time
+        # 擷取時間 (time.monotonic_ns，系統共用的單調時鐘，可放入傳送給Client的標頭)
+        self.origin_ns = origin_ns if origin_ns is not None else time.monotonic_ns()
+        self.hop_times = {"capture": capture_time}  # 各處理節點完成的時間 (time.perf_counter)
+        self.last_hop_time = capture_time
+        # [檢測階段] 輸出
+        self.warped_frame = None
+        self.warped_color = None          # 以亮度檢測時透視變換後的彩色影像 (WarpedColorFrame，需要時才計算)
+        self.transform_matrix = None      # 檢測此幀時使用的透視變換矩陣 (錄製時記錄透視變換校正)
+        self.corners = None
+        self.ids_list = None
+        # [追蹤階段] 輸出
+        self.output_frame = None
+        self.flow_map = None
+        self.flowmap_to_send = None       # 需要傳送給Client的FlowMap (None 表示此幀不需傳送)
+
+    def mark_hop(self, name, registry=None):
+        """
+        記錄幀資料通過處理節點的時間
+        latency.hop.<name>: 與上一個節點之間的延遲
+        latency.age.<name>: 自擷取以來經過的時間
+        """
+        now = time.perf_counter()
+        self.hop_times[name] = now
+        if registry is not None:
+            registry.record(f"latency.hop.{name}", now - self.last_hop_time)
+            registry.record(f"latency.age.{name}", now - self.capture_time)
+        self.last_hop_time = now
+        return now
+
+class FramePipeline:
+    """
+    多執行緒分段處理管線
+    擷取(capture) -> 檢測(detect) -> 追蹤/FlowMap更新(track) -> 顯示/編碼/傳送(output)
+    各階段在各自的執行緒中執行，階段之間以有界佇列連接，使各階段能重疊執行，
+    整體吞吐量趨近於最慢的單一階段
+    """
+
+    def __init__(self, cap, tracker, ui=None, image_server=None, queue_size=2, save_interval=30, target_fps=30.0,
+                 governor=None, drop_frames=None, recorder=None, detector=None, encoder=None, snapshots=None):
+        """
+        初始化處理管線
+
+        參數:
+        cap: 影像來源 (cv2.VideoCapture 或具有相同 read() 介面的物件)；
+             CameraCapture 啟用 luma 時以 read_luma() 讀取，直接以亮度檢測，彩色影像只在顯示、快照與錄影需要時轉換；
+             有限的影像來源(SessionReplay、SyntheticPoolCapture)在沒有更多幀時將 finished 屬性設為 True，
+             read() 失敗且 finished 為 True 時管線處理完剩餘的幀後結束；沒有 finished 屬性(相機)時視為暫時讀取失敗並重試
+        tracker: ArUcoTracker
+        ui: FlowMapUI (可為 None)
+        image_server: FlowMapServer (可為 None)
+        queue_size: 階段之間佇列的最大長度
+        save_interval: 每隔多少幀檢查一次是否需要傳送FlowMap
+        target_fps: 擷取階段的目標幀率 (None 表示不限制)
+        governor: QualityGovernor (可為 None)，依各階段處理時間自動調整品質
+        drop_frames: 檢測階段來不及處理時是否丟棄舊幀 (None 表示有目標幀率時丟棄；
+                     不限制幀率的離線處理則等待，確保每一幀都被處理)
+        recorder: SessionRecorder (可為 None)，錄製原始影像與檢測結果
+        detector: ParallelDetector (可為 None)，以多個工作程序同時檢測多幀；None 表示在檢測執行緒中直接檢測
+        encoder: 編碼FlowMap的共用執行緒池 (concurrent.futures.Executor，可為 None)；
+                 多水池服務中各管線共用，限制同時編碼的數量；None 表示在輸出執行緒中直接編碼
+        snapshots: SnapshotService (可為 None)，記錄最新的原始/透視變換後影像，Client 請求時才編碼
+        """
+        self.cap = cap
+        self.tracker = tracker
+        self.ui = ui
+        self.image_server = image_server
+        self.save_interval = save_interval
+        self.pacer = FramePacer(target_fps)  # 擷取階段的幀率排程器
+        self.governor = governor
+        self.drop_frames = drop_frames if drop_frames is not None else bool(target_fps)
+        self.recorder = recorder
+        self.detector = detector
+        self.encoder = encoder
+        self.snapshots = snapshots
+        self.luma = bool(getattr(cap, "luma", False)) and hasattr(cap, "read_luma")
+        self.applied_transform = None  # 最近套用的影像來源透視變換矩陣
+        self.in_flight = deque()       # 已送出給工作程序、尚未取回結果的幀 [(packet, handle, 送出時間), ...]
+        self.last_detect_time = 0.0    # 上一幀取回檢測結果的時間
+        self.stage_times = {}  # 各階段最近一幀的處理時間 (秒)
+        self.metrics = metrics # 效能指標紀錄
+
+        # 階段之間的有界佇列
+        self.detect_queue = queue.Queue(maxsize=queue_size)
+        self.track_queue = queue.Queue(maxsize=queue_size)
+        self.output_queue = queue.Queue(maxsize=queue_size)
+
+        # 顯示用的 FlowMap 環狀緩衝區 (FlowMapGenerator 的工作緩衝區在下一幀直接覆寫，不可交給輸出執行緒)
+        # 數量涵蓋輸出佇列中的幀、輸出階段正在顯示的幀與追蹤階段正在寫入的幀
+        self.display_buffers = [None] * (queue_size + 2)
+        self.display_index = 0
+
+        self.next_seq = 0              # 下一個擷取幀的序號
+        self.last_tracked_seq = -1     # 追蹤階段最後處理的幀序號
+        self.last_saved_frame = 0      # 上次傳送FlowMap的幀數
+        self.dropped_frames = 0        # 因檢測階段來不及處理而丟棄的幀數
+        self.capture_finished = False  # 影像來源是否已結束 (例如重播至結尾)
+        self.threads = []
+
+    def start(self):
+        """啟動所有階段的執行緒"""
+        stages = [
+            ("capture", self.capture_loop),
+            ("detect", self.detect_loop),
+            ("track", self.track_loop),
+            ("output", self.output_loop),
+        ]
+        for name, target in stages:
+            thread = threading.Thread(target=self.run_stage, args=(name, target), name=f"pipeline-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def join(self):
+        """等待所有階段的執行緒結束"""
+        for thread in self.threads:
+            thread.join()
+
+    def is_running(self):
+        return self.tracker.running
+
+    def run_stage(self, name, target):
+        """執行單一階段的迴圈，並處理執行過程中的錯誤"""
+        while self.is_running():
+            try:
+                target()
+            except Exception as e:
+                print(f"管線階段[{name}]發生錯誤: {e}")
+                traceback.print_exc()
+                time.sleep(1)  # 錯誤後暫停一下再繼續
+
+    def get_packet(self, stage_queue, timeout=0.1):
+        """從佇列取出幀資料(逾時回傳 None，以便檢查管線是否仍在運行)"""
+        try:
+            return stage_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def put_packet(self, stage_queue, packet):
+        """將幀資料放入下一階段的佇列(佇列已滿時等待，直到管線停止)"""
+        while self.is_running():
+            try:
+                stage_queue.put(packet, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def capture_loop(self):
+        """[擷取階段] 依目標幀率從相機讀取影像，並給予幀序號與擷取時間"""
+        if self.capture_finished:
+            time.sleep(0.1)  # 影像來源已結束，等待後續階段處理完剩餘的幀
+            return
+
+        # 等待至下一幀的截止時間(已落後時不休眠)
+        self.pacer.wait()
+
+        start_time = time.perf_counter()
+        if self.luma:
+            ret, frame, color_frame = self.cap.read_luma()
+        else:
+            ret, frame = self.cap.read()
+            color_frame = None
+        self.record_stage("capture", start_time)
+        if not ret:
+            # 影像來源已結束(例如重播至結尾)時，通知後續階段處理完剩餘的幀後結束管線
+            if getattr(self.cap, "finished", False):
+                self.capture_finished = True
+                self.put_packet(self.detect_queue, END_OF_STREAM)
+                return
+            print("無法讀取影像，嘗試重新獲取...")
+            time.sleep(0.1)  # 短暫暫停後重試
+            self.pacer.reset()
+            return
+
+        packet = FramePacket(self.next_seq, frame, time.perf_counter(),
+                             source_time=getattr(self.cap, "last_capture_time", None), color_frame=color_frame,
+                             source_transform=getattr(self.cap, "last_transform_matrix", None))
+        self.next_seq += 1
+        if self.snapshots is not None:
+            self.snapshots.publish("raw", color_frame if color_frame is not None else frame)
+
+        if not self.drop_frames:
+            self.put_packet(self.detect_queue, packet)
+            return
+
+        # 檢測階段來不及處理時，丟棄最舊的幀，確保處理的是最新畫面
+        try:
+            self.detect_queue.put_nowait(packet)
+        except queue.Full:
+            try:
+                self.detect_queue.get_nowait()
+                self.dropped_frames += 1
+                self.metrics.increment("dropped_frames")
+            except queue.Empty:
+                pass
+            self.put_packet(self.detect_queue, packet)
+
+    def detect_loop(self):
+        """[檢測階段] 透視變換與 ArUco Marker 檢測"""
+        if self.detector is not None:
+            self.detect_loop_parallel()
+            return
+        packet = self.get_packet(self.detect_queue)
+        if packet is None:
+            return
+        if packet is END_OF_STREAM:
+            self.put_packet(self.track_queue, packet)
+            return
+        start_time = time.perf_counter()
+        self.apply_source_transform(packet)
+        packet.warped_frame, packet.corners, packet.ids_list = self.tracker.detect_markers(packet.frame)
+        packet.transform_matrix = self.tracker.pool_detector.transform_matrix
+        self.record_stage("detect", start_time)
+        self.publish_warped(packet)
+        packet.mark_hop("detect", self.metrics)
+        self.put_packet(self.track_queue, packet)
+
+    def detect_loop_parallel(self):
+        """
+        [檢測階段] 以工作程序並行檢測 (ParallelDetector)
+        同時送出多幀給工作程序，並依送出順序取回結果，使追蹤階段仍按幀序號處理
+        """
+        if len(self.in_flight) < self.detector.max_in_flight:
+            # 有處理中的幀時縮短等待時間，以便及時取回已完成的結果
+            packet = self.get_packet(self.detect_queue, timeout=0.002 if self.in_flight else 0.1)
+            if packet is END_OF_STREAM:
+                while self.in_flight:
+                    self.finish_detection(*self.in_flight.popleft())
+                self.put_packet(self.track_queue, packet)
+                return
+            if packet is not None:
+                self.apply_source_transform(packet)
+                self.in_flight.append((packet, self.detector.submit(packet.frame), time.perf_counter()))
+
+        # 依送出順序轉交已完成的幀 (同時處理的幀數已達上限時等待最舊的一幀)
+        while self.in_flight and (self.in_flight[0][1].done() or len(self.in_flight) >= self.detector.max_in_flight):
+            self.finish_detection(*self.in_flight.popleft())
+
+    def finish_detection(self, packet, handle, submit_time):
+        """取回工作程序的檢測結果並轉交追蹤階段"""
+        packet.warped_frame, packet.corners, packet.ids_list = handle.result()
+        packet.transform_matrix = handle.transform_matrix
+        self.publish_warped(packet)
+        # 多幀同時處理時，單幀的處理時間(延遲)大於檢測階段實際佔用的時間，
+        # 以距離上一幀完成的時間作為檢測階段的處理時間 (供品質調整器判斷吞吐量)
+        self.record_stage("detect", max(submit_time, self.last_detect_time))
+        self.last_detect_time = time.perf_counter()
+        packet.mark_hop("detect", self.metrics)
+        self.put_packet(self.track_queue, packet)
+
+    def apply_source_transform(self, packet):
+        """[檢測階段] 套用影像來源指定的透視變換矩陣 (重播時重現錄製途中的透視變換校正)"""
+        if packet.source_transform is None or packet.source_transform is self.applied_transform:
+            return
+        self.applied_transform = packet.source_transform
+        self.tracker.pool_detector.set_transform_matrix(packet.source_transform)
+
+    def publish_warped(self, packet):
+        """
+        [檢測階段] 記錄透視變換後的影像供快照使用
+        以亮度檢測時，透視變換後的影像為灰階，彩色影像延遲到顯示或快照需要時才轉換並透視變換
+        """
+        if packet.color_frame is not None:
+            packet.warped_color = WarpedColorFrame(packet.color_frame, self.tracker.pool_detector)
+        if self.snapshots is not None:
+            self.snapshots.publish("warped", packet.warped_color if packet.warped_color is not None else packet.warped_frame)
+
+    def track_loop(self):
+        """[追蹤階段] 卡爾曼濾波、射水效果與 FlowMap 更新"""
+        packet = self.get_packet(self.track_queue)
+        if packet is None:
+            return
+        if packet is END_OF_STREAM:
+            self.put_packet(self.output_queue, packet)
+            return
+        # 依幀序號處理，忽略順序錯亂的舊幀(卡爾曼濾波需要按時間順序更新)
+        if packet.seq <= self.last_tracked_seq:
+            return
+        self.last_tracked_seq = packet.seq
+
+        # 在幀與幀之間依各階段處理時間調整品質等級
+        if self.governor is not None:
+            self.governor.observe(self.stage_times)
+
+        start_time = time.perf_counter()
+        display_frame = packet.warped_frame
+        if packet.warped_color is not None:
+            # 以亮度檢測時，只有需要顯示追蹤畫面才計算彩色的透視變換影像 (無 UI 時不繪製追蹤畫面)
+            display_frame = packet.warped_color.bgr() if self.ui is not None else None
+        packet.output_frame, packet.flow_map = self.tracker.track_markers(
+            display_frame, packet.corners, packet.ids_list, packet.source_time)
+        packet.mark_hop("track", self.metrics)
+        # 複製一份 FlowMap 給輸出階段顯示 (無 UI 時不需要)
+        packet.flow_map = self.copy_for_display(packet.flow_map) if self.ui is not None else None
+
+        # 記錄 FlowMap 目前累積到的幀(來源幀序號與擷取時間)
+        flow_map_generator = self.tracker.flow_map_generator
+        flow_map_generator.last_frame_seq = packet.seq
+        flow_map_generator.last_capture_time = packet.capture_time
+
+        # 檢查是否需要傳送FlowMap給Client
+        current_frame = flow_map_generator.current_frame
+        if self.image_server and current_frame - self.last_saved_frame >= self.save_interval:
+            # 檢查Client是否請求傳送FlowMap
+            if self.image_server.should_stream_flowmap():
+                # 複製當前累積的FlowMap，避免編碼時被下一幀的更新修改
+                packet.flowmap_to_send = flow_map_generator.accumulated_flowmap.copy()
+                self.last_saved_frame = current_frame
+        self.record_stage("track", start_time)
+
+        self.put_packet(self.output_queue, packet)
+
+    def copy_for_display(self, flow_map):
+        """[追蹤階段] 將 FlowMap 複製到下一個顯示用緩衝區 (畫布大小改變時重新配置)"""
+        if flow_map is None:
+            return None
+        index = self.display_index
+        self.display_index = (index + 1) % len(self.display_buffers)
+        buffer = self.display_buffers[index]
+        if buffer is None or buffer.shape != flow_map.shape:
+            buffer = self.display_buffers[index] = np.empty_like(flow_map)
+        np.copyto(buffer, flow_map)
+        return buffer
+
+    def output_loop(self):
+        """[輸出階段] 更新UI顯示、編碼並傳送FlowMap"""
+        packet = self.get_packet(self.output_queue)
+        if packet is None:
+            return
+        if packet is END_OF_STREAM:
+            # 所有的幀皆已處理完畢，結束管線
+            self.tracker.running = False
+            return
+
+        # 在輸出佇列中等待的時間
+        start_time = packet.mark_hop("output_queue", self.metrics)
+        if self.ui is not None:
+            # 更新UI中的透視變換後幀
+            self.ui.update_transformed_frame(packet.output_frame)
+
+            # 更新UI中的追蹤畫面和FlowMap
+            self.ui.update_tracking_display(packet.output_frame)
+            self.ui.update_flowmap_display(packet.flow_map)
+
+        if packet.flowmap_to_send is not None:
+            # 將FlowMap轉換為jpg格式的bytes
+            with self.metrics.timer("encode"):
+                if self.encoder is not None:
+                    img_bytes = self.encoder.submit(encode_flowmap, packet.flowmap_to_send).result()
+                else:
+                    img_bytes = encode_flowmap(packet.flowmap_to_send)
+            packet.mark_hop("encode", self.metrics)
+
+            # 透過Server傳送FlowMap給Client(附帶幀序號與擷取時間，供Client計算端對端延遲)
+            with self.metrics.timer("send"):
+                sent = self.image_server.send_flowmap(img_bytes, frame_seq=packet.seq, origin_ns=packet.origin_ns)
+            if sent:
+                packet.mark_hop("send", self.metrics)
+                self.metrics.increment("flowmaps_sent")
+
+        if self.recorder is not None:
+            # 錄製原始影像與檢測結果 (以亮度檢測時錄製彩色影像，重播時與原本的相機影像相同)
+            frame = packet.color_frame.bgr() if packet.color_frame is not None else packet.frame
+            with self.metrics.timer("record"):
+                self.recorder.write_frame(packet.seq, packet.source_time, frame, packet.corners, packet.ids_list,
+                                          transform_matrix=packet.transform_matrix)
+        self.record_stage("output", start_time)
+
+    def record_stage(self, name, start_time):
+        """記錄階段處理時間 (供品質調整器與效能指標使用)"""
+        elapsed = time.perf_counter() - start_time
+        self.stage_times[name] = elapsed
+        self.metrics.record(f"stage.{name}", elapsed)
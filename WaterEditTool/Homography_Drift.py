@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+from Performance_Metrics import metrics
+
+class HomographyDriftCorrector:
+    """
+    以固定 Marker 持續校正透視變換 (相機被碰撞或腳架偏移時)
+    追蹤開始時記錄固定 Marker 角點在透視變換後畫面的位置作為基準；之後在檢測階段收集固定 Marker 的角點
+    (無畸變影像座標)，背景執行緒以低頻率取滑動視窗的中位數，量測以目前透視變換矩陣投影後與基準的偏移，
+    相機靜止且偏移超過門檻時以 RANSAC 重新估計影像 -> 基準位置的透視變換，並預先計算 remap 表；
+    新的矩陣與 remap 表由檢測執行緒在幀與幀之間一次替換 (apply_pending)，追蹤不需中斷。
+    透視變換後的座標系統維持不變，水池參數、遮罩與射水向量皆不需重新校準
+    """
+
+    def __init__(self, pool_detector, window_frames=60, interval=1.0, min_markers=3, drift_threshold=2.0,
+                 ransac_threshold=3.0, stability_threshold=1.0):
+        """
+        pool_detector: PoolDetector
+        window_frames: 滑動視窗的幀數
+        interval: 背景重新估計的間隔 (秒)
+        min_markers: 重新估計所需的最少固定 Marker 數量
+        drift_threshold: 視為偏移的基準位置誤差中位數 (像素，透視變換後的座標)
+        ransac_threshold: RANSAC 的內點門檻 (像素)
+        stability_threshold: 視窗內角點位置的標準差中位數超過此值時視為相機仍在移動，暫不校正 (像素)
+        """
+        self.pool_detector = pool_detector
+        self.fixed_marker_ids = set(int(marker_id) for marker_id in pool_detector.fixed_marker_ids)
+        self.window_frames = window_frames
+        self.interval = interval
+        self.min_markers = min_markers
+        self.drift_threshold = drift_threshold
+        self.ransac_threshold = ransac_threshold
+        self.stability_threshold = stability_threshold
+        self.metrics = metrics
+
+        self.observations = deque(maxlen=window_frames)  # 每幀的固定 Marker 角點 {id: (4,2) 無畸變影像座標}
+        self.reference = None  # 基準: {id: (4,2) 透視變換後的座標}
+        self.pending = None    # 已完成估計、等待檢測執行緒替換的 (矩陣, remap表)
+        self.last_drift = 0.0  # 最近一次量測的偏移 (像素)
+        self.corrections = 0   # 已套用的校正次數
+        self.running = False
+        self.thread = None
+
+    # ===== 檢測執行緒 (熱路徑，只做少量運算) =====
+
+    def observe_image(self, corners, ids):
+        """
+        記錄原始影像中檢測到的固定 Marker 角點 (detectMarkers 的輸出格式，原始影像座標)
+        """
+        if ids is None:
+            return
+        indices = [i for i, marker_id in enumerate(ids.ravel()) if int(marker_id) in self.fixed_marker_ids]
+        if not indices:
+            return
+        points = self.pool_detector.undistort_points(np.concatenate([corners[i].reshape(4, 2) for i in indices]))
+        self.observations.append({int(ids.ravel()[i]): points[4 * j:4 * j + 4] for j, i in enumerate(indices)})
+
+    def observe_warped(self, corners, ids_list, transform_matrix):
+        """
+        記錄透視變換後座標的固定 Marker 角點 (ArUcoTracker.detect_markers 的輸出格式)
+        transform_matrix: 產生這些角點時使用的透視變換矩陣 (以其反矩陣換算回無畸變影像座標)
+        """
+        indices = [i for i, marker_id in enumerate(ids_list) if int(marker_id[0]) in self.fixed_marker_ids]
+        if not indices or transform_matrix is None:
+            return
+        warped = np.concatenate([np.asarray(corners[i], dtype=np.float32).reshape(4, 2) for i in indices])
+        points = cv2.perspectiveTransform(warped.reshape(-1, 1, 2), np.linalg.inv(transform_matrix)).reshape(-1, 2)
+        self.observations.append({int(ids_list[i][0]): points[4 * j:4 * j + 4] for j, i in enumerate(indices)})
+
+    def apply_pending(self):
+        """[檢測執行緒，幀與幀之間] 替換為背景估計完成的透視變換矩陣與 remap 表"""
+        pending = self.pending
+        if pending is None:
+            return False
+        self.pending = None
+        transform_matrix, rectify_maps = pending
+        self.pool_detector.set_transform_matrix(transform_matrix, rectify_maps)
+        self.corrections += 1
+        self.metrics.increment("homography_corrections")
+        return True
+
+    # ===== 背景執行緒 =====
+
+    def start(self):
+        """啟動背景重新估計執行緒"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="homography-drift", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=self.interval + 1.0)
+            self.thread = None
+
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            try:
+                with self.metrics.timer("homography.estimate"):
+                    self.update()
+            except Exception as e:
+                print(f"[水池校正] 重新估計透視變換時發生錯誤: {e}")
+
+    def window_points(self):
+        """
+        取得滑動視窗中每個固定 Marker 角點的中位數與標準差 (只包含出現在至少一半幀數中的 Marker)
+        回傳: {id: (4,2) 中位數}, 標準差的中位數 (像素)
+        """
+        observations = list(self.observations)
+        if len(observations) < self.window_frames // 2:
+            return {}, 0.0
+        samples = {}
+        for observation in observations:
+            for marker_id, points in observation.items():
+                samples.setdefault(marker_id, []).append(points)
+        medians = {}
+        spreads = []
+        for marker_id, points in samples.items():
+            if len(points) < len(observations) // 2:
+                continue
+            points = np.stack(points)
+            medians[marker_id] = np.median(points, axis=0)
+            spreads.append(points.std(axis=0).max())
+        return medians, float(np.median(spreads)) if spreads else 0.0
+
+    def update(self):
+        """量測偏移，必要時重新估計透視變換 (背景執行緒)"""
+        medians, spread = self.window_points()
+        if len(medians) < self.min_markers:
+            return
+        # 以等待替換的矩陣為準 (尚未替換時避免重複估計)
+        transform_matrix = self.pending[0] if self.pending is not None else self.pool_detector.transform_matrix
+        if transform_matrix is None:
+            return
+
+        if self.reference is None:
+            # 追蹤開始時的固定 Marker 位置作為基準 (校準後的透視變換視為正確)
+            self.reference = {marker_id: cv2.perspectiveTransform(points.reshape(-1, 1, 2), transform_matrix).reshape(4, 2)
+                              for marker_id, points in medians.items()}
+            print(f"[水池校正] 已記錄 {len(self.reference)} 個固定 Marker 的基準位置")
+            return
+
+        marker_ids = [marker_id for marker_id in medians if marker_id in self.reference]
+        if len(marker_ids) < self.min_markers:
+            return
+        source = np.concatenate([medians[marker_id] for marker_id in marker_ids]).astype(np.float32)
+        target = np.concatenate([self.reference[marker_id] for marker_id in marker_ids]).astype(np.float32)
+
+        projected = cv2.perspectiveTransform(source.reshape(-1, 1, 2), transform_matrix).reshape(-1, 2)
+        self.last_drift = float(np.median(np.linalg.norm(projected - target, axis=1)))
+        if self.last_drift < self.drift_threshold:
+            return
+        if spread > self.stability_threshold:
+            return  # 相機仍在移動，等待穩定後再校正
+
+        new_matrix, inliers = cv2.findHomography(source, target, cv2.RANSAC, self.ransac_threshold)
+        if new_matrix is None or inliers is None:
+            return
+        inliers = inliers.ravel().astype(bool)
+        if inliers.sum() < max(8, len(source) // 2):
+            print(f"[水池校正] 偏移 {self.last_drift:.1f} px，但固定 Marker 的內點不足 ({inliers.sum()}/{len(source)})，暫不校正")
+            return
+        corrected = cv2.perspectiveTransform(source.reshape(-1, 1, 2), new_matrix).reshape(-1, 2)
+        residual = float(np.median(np.linalg.norm(corrected - target, axis=1)[inliers]))
+        if residual > self.drift_threshold:
+            print(f"[水池校正] 重新估計的殘差過大 ({residual:.2f} px)，暫不校正")
+            return
+
+        # 在背景執行緒預先計算 remap 表，避免替換後的第一幀在熱路徑上計算
+        rectify_maps = None
+        if self.pool_detector.camera_matrix is not None:
+            rectify_maps = self.pool_detector.compute_rectify_maps(new_matrix, self.pool_detector.get_output_size())
+        self.pending = (new_matrix, rectify_maps)
+        print(f"[水池校正] 偵測到相機偏移 {self.last_drift:.1f} px，已重新估計透視變換 "
+              f"(內點 {inliers.sum()}/{len(source)}，殘差 {residual:.2f} px)")
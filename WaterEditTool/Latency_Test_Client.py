@@ -0,0 +1,78 @@
+import argparse
+import socket
+import struct
+import time
+import cv2
+import numpy as np
+
+def receive_exact(sock, size):
+    """接收指定長度的資料"""
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(min(65536, size - len(data)))
+        if not chunk:
+            raise ConnectionError("Server已斷開連線")
+        data += chunk
+    return data
+
+def print_latency_summary(latencies_ms):
+    """輸出延遲分佈統計"""
+    if not latencies_ms:
+        print("尚未收到任何附帶時間標頭的FlowMap")
+        return
+    values = np.array(latencies_ms)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    print(f"[延遲統計] 樣本數: {len(values)}，平均: {values.mean():.1f} ms，"
+          f"p50: {p50:.1f} ms，p95: {p95:.1f} ms，p99: {p99:.1f} ms，最大: {values.max():.1f} ms")
+
+def main():
+    """
+    本機延遲量測Client
+    連線至FlowMapServer，要求附帶時間標頭(命令8)並開始串流FlowMap(命令3)，
+    以擷取時間(time.monotonic_ns，需與Server位於同一台電腦)計算
+    從相機擷取到Client完成接收與解碼的端對端延遲分佈
+    """
+    parser = argparse.ArgumentParser(description="FlowMap 端對端延遲量測Client")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--count", type=int, default=100, help="量測的FlowMap數量")
+    parser.add_argument("--report-interval", type=int, default=10, help="每隔多少筆輸出一次統計")
+    args = parser.parse_args()
+
+    sock = socket.create_connection((args.host, args.port))
+    latencies_ms = []
+    try:
+        sock.sendall(bytes([8]))  # 請求附帶時間標頭
+        sock.sendall(bytes([3]))  # 請求開始傳遞FlowMap
+        print(f"已連線至 {args.host}:{args.port}，開始量測延遲...")
+
+        while len(latencies_ms) < args.count:
+            message_type = receive_exact(sock, 1)[0]
+            frame_seq, origin_ns = None, None
+            if message_type == 4:
+                frame_seq, origin_ns = struct.unpack('!IQ', receive_exact(sock, 12))
+            size = struct.unpack('!I', receive_exact(sock, 4))[0]
+            img_bytes = receive_exact(sock, size)
+            if origin_ns is None:
+                continue
+
+            # 解碼圖片(模擬Client端顯示前的處理)
+            cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+            latency_ms = (time.monotonic_ns() - origin_ns) / 1e6
+            latencies_ms.append(latency_ms)
+
+            if len(latencies_ms) % args.report_interval == 0:
+                print(f"Frame {frame_seq}: {latency_ms:.1f} ms ({size} bytes)")
+                print_latency_summary(latencies_ms)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        try:
+            sock.sendall(bytes([4]))  # 請求停止傳遞FlowMap
+        except OSError:
+            pass
+        sock.close()
+        print_latency_summary(latencies_ms)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+import contextlib
+import io
+import threading
+import time
+import cv2
+import numpy as np
+from Performance_Metrics import metrics
+
+class CameraUnit:
+    """
+    多相機模式中的單一相機
+    擷取執行緒持續讀取最新影像(來不及檢測的舊影像直接覆蓋)，檢測執行緒以自己的 ArUcoTracker 檢測，
+    每台相機的 PoolDetector 各自有透視變換矩陣(與鏡頭畸變參數)，皆轉換到主相機的透視變換後座標系統
+    """
+
+    def __init__(self, name, cap, tracker, condition, owns_capture=True):
+        """
+        name: 相機名稱 (用於效能指標與統計)
+        cap: cv2.VideoCapture
+        tracker: 此相機使用的 ArUcoTracker (主相機使用追蹤用的 ArUcoTracker)
+        condition: MultiCameraRig 共用的 threading.Condition (檢測完成時通知)
+        owns_capture: 結束時是否釋放 cap (主相機的 cap 由主程式管理)
+        """
+        self.name = name
+        self.cap = cap
+        self.tracker = tracker
+        self.pool_detector = tracker.pool_detector
+        self.condition = condition
+        self.owns_capture = owns_capture
+        self.metrics = metrics
+        self.running = False
+        self.threads = []
+
+        # 擷取執行緒 -> 檢測執行緒 (只保留最新的一幀)
+        self.frame_lock = threading.Condition()
+        self.frame = None
+        self.frame_seq = 0
+        self.frame_time = 0.0
+        self.frame_shape = None
+
+        # 檢測執行緒 -> MultiCameraRig
+        self.result = None      # (capture_time, warped_frame, corners, ids_list)
+        self.result_seq = 0
+        self.consumed_seq = 0   # MultiCameraRig 已取用的檢測結果序號
+        self.last_warped = None # 最近一次的透視變換影像 (相機未趕上時仍用於組合顯示畫面)
+
+        # 統計 (指數移動平均)
+        self.stats = {"frames": 0, "detected": 0, "missed": 0, "markers": 0.0,
+                      "capture_time": 0.0, "detect_time": 0.0, "fps": 0.0}
+        self.last_result_time = None
+        self.coverage_mask = None
+        self.coverage_key = None
+
+    @property
+    def calibrated(self):
+        return self.pool_detector.transform_matrix is not None
+
+    def start(self, main_tracker):
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self.capture_loop, name=f"camera-{self.name}-capture", daemon=True),
+            threading.Thread(target=self.detect_loop, args=(main_tracker,), name=f"camera-{self.name}-detect", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+        self.threads = []
+        if self.owns_capture:
+            self.cap.release()
+
+    def update_stat(self, name, value, alpha=0.1):
+        self.stats[name] = value if self.stats[name] == 0.0 else self.stats[name] * (1 - alpha) + value * alpha
+
+    def capture_loop(self):
+        """[擷取執行緒] 持續讀取最新影像"""
+        while self.running:
+            start_time = time.perf_counter()
+            ret, frame = self.cap.read()
+            if not ret:
+                time.sleep(0.1)
+                continue
+            capture_time = time.perf_counter()
+            self.update_stat("capture_time", capture_time - start_time)
+            self.metrics.record(f"camera.{self.name}.capture", capture_time - start_time)
+            with self.frame_lock:
+                self.frame = frame
+                self.frame_seq += 1
+                self.frame_time = capture_time
+                self.frame_shape = frame.shape
+                self.frame_lock.notify()
+            self.stats["frames"] += 1
+
+    def detect_loop(self, main_tracker):
+        """[檢測執行緒] 檢測最新影像，結果轉換到共用的水池座標後通知 MultiCameraRig"""
+        detected_seq = 0
+        while self.running:
+            with self.frame_lock:
+                if self.frame_seq == detected_seq:
+                    self.frame_lock.wait(timeout=0.1)
+                    continue
+                frame, detected_seq, capture_time = self.frame, self.frame_seq, self.frame_time
+
+            # 品質調整器只調整主相機的追蹤器，其他相機使用相同的檢測設定
+            self.tracker.detection_scale = main_tracker.detection_scale
+            self.tracker.detection_mode = main_tracker.detection_mode
+            start_time = time.perf_counter()
+            warped_frame, corners, ids_list = self.tracker.detect_markers(frame)
+            now = time.perf_counter()
+
+            self.update_stat("detect_time", now - start_time)
+            self.update_stat("markers", float(len(ids_list)))
+            if self.last_result_time is not None:
+                self.update_stat("fps", 1.0 / max(now - self.last_result_time, 1e-6))
+            self.last_result_time = now
+            self.stats["detected"] += 1
+            self.metrics.record(f"camera.{self.name}.detect", now - start_time)
+            self.metrics.increment(f"camera.{self.name}.detections", len(ids_list))
+
+            with self.condition:
+                self.result = (capture_time, warped_frame, corners, ids_list)
+                self.result_seq += 1
+                self.last_warped = warped_frame
+                self.condition.notify_all()
+
+    def confidence(self, corners):
+        """
+        計算 Marker 檢測結果的可信度 (共用座標的角點 (N,4,2) -> (N,))
+        以 Marker 在此相機無畸變影像中的邊長(解析度)為權重，靠近影像邊緣(可能被截斷)的 Marker 降低權重
+        """
+        image_points = cv2.perspectiveTransform(corners.reshape(-1, 1, 2).astype(np.float64),
+                                                np.linalg.inv(self.pool_detector.transform_matrix)).reshape(-1, 4, 2)
+        side = np.linalg.norm(image_points - np.roll(image_points, 1, axis=1), axis=2).mean(axis=1)
+        center = image_points.mean(axis=1)
+        height, width = self.frame_shape[:2]
+        edge_distance = np.minimum(np.minimum(center[:, 0], width - 1 - center[:, 0]),
+                                   np.minimum(center[:, 1], height - 1 - center[:, 1]))
+        # 中心距離邊緣 0.5 個邊長時 Marker 已碰到邊緣，1.5 個邊長以上視為完整
+        border = np.clip(edge_distance / np.maximum(side, 1e-6) - 0.5, 0.0, 1.0)
+        return side * (border + 1e-3)
+
+    def get_coverage_mask(self):
+        """取得(必要時重新計算)此相機在共用座標中涵蓋的範圍 (bool)"""
+        key = (self.pool_detector.transform_matrix.tobytes(), self.frame_shape[:2])
+        if self.coverage_mask is None or self.coverage_key != key:
+            ones = np.full(self.frame_shape[:2], 255, dtype=np.uint8)
+            self.coverage_mask = self.pool_detector.warp_frame(ones) > 0
+            self.coverage_key = key
+        return self.coverage_mask
+
+class FusedDetection:
+    """已完成的融合檢測結果 (與 ParallelDetector 的 DetectionHandle 相同的介面)"""
+
+    def __init__(self, result):
+        self.value = result
+
+    def done(self):
+        return True
+
+    def result(self):
+        return self.value
+
+class MultiCameraRig:
+    """
+    多相機擷取與檢測融合 (大型水池)
+    每台相機有自己的擷取/檢測執行緒與透視變換矩陣，全部轉換到主相機的透視變換後座標系統；
+    FramePipeline 以此物件同時作為影像來源(read: 收集各相機最新的檢測結果)與檢測後端
+    (submit: 依 Marker ID 以可信度加權合併重複的檢測，並組合顯示畫面)，
+    融合後的結果送入單一的卡爾曼濾波追蹤與 FlowMapGenerator
+    """
+
+    def __init__(self, tracker, primary_cap, sources, sync_timeout=0.02, min_markers=2, agreement=0.25,
+                 report_interval=10.0):
+        """
+        tracker: 主相機(追蹤用)的 ArUcoTracker
+        primary_cap: 主相機的 cv2.VideoCapture (已完成透視變換校準)
+        sources: 其他相機的影像來源列表，每一項為 VideoCapture 的來源，
+                 或 {"source": 來源, "profile": 此相機的校準設定檔(鏡頭畸變參數，可省略)}
+        sync_timeout: 第一台相機完成後等待其他相機的最長時間 (秒)，逾時的相機不加入這一幀
+        min_markers: 以固定 Marker 校準其他相機時所需的最少共同 Marker 數量
+        agreement: 不同相機檢測到同一 Marker 時，角點平均距離小於此比例(相對於邊長)才加權平均，否則採用可信度最高的一筆
+        report_interval: 輸出各相機統計的間隔 (秒，None 表示不輸出)
+        """
+        self.tracker = tracker
+        self.sync_timeout = sync_timeout
+        self.min_markers = min_markers
+        self.agreement = agreement
+        self.report_interval = report_interval
+        self.metrics = metrics
+        self.condition = threading.Condition()
+        self.max_in_flight = 1   # FramePipeline 檢測階段的介面 (融合在 submit 內同步完成)
+        self.finished = False    # FramePipeline 影像來源的介面 (相機不會結束)
+        self.last_capture_time = None
+        self.frames_read = 0     # 已組合的幀數
+        self.running = False
+        self.last_report_time = None
+        self.display_masks = None
+        self.display_masks_key = None
+
+        self.units = [CameraUnit("0", primary_cap, tracker, self.condition, owns_capture=False)]
+        for index, source in enumerate(sources, start=1):
+            self.units.append(self.create_unit(str(index), source))
+
+    def create_unit(self, name, source):
+        """建立其他相機: 與主相機相同的水池參數與檢測參數，透視變換矩陣待校準"""
+        from ArUco_to_FlowMap import PoolDetector, ArUcoTracker
+        from Camera_Calibration import load_calibration_profile
+
+        profile_path = None
+        if isinstance(source, dict):
+            source, profile_path = source["source"], source.get("profile")
+        cap = cv2.VideoCapture(source)
+        primary = self.tracker.pool_detector
+        profile = dict(primary.to_profile(), transform_matrix=None, camera_matrix=None, dist_coeffs=None)
+        with contextlib.redirect_stdout(io.StringIO()):  # 忽略建立過程的輸出
+            pool_detector = PoolDetector(profile["fixed_marker_ids"], world_radius=profile["world_radius"],
+                                         pool_shape=profile["pool_shape"])
+            pool_detector.load_profile(profile)
+            tracker = ArUcoTracker(pool_detector)
+        if profile_path is not None:
+            pool_detector.load_camera_calibration(load_calibration_profile(profile_path))
+        return CameraUnit(name, cap, tracker, self.condition)
+
+    # ===== 校準 =====
+
+    def calibrate(self, attempts=30):
+        """
+        以固定 Marker 校準其他相機的透視變換矩陣
+        已校準相機檢測到的固定 Marker 在共用座標中的位置作為目標，與未校準相機影像中的位置求透視變換 (RANSAC)；
+        新校準的相機在下一輪也提供固定 Marker 的位置，因此不需每台相機都與主相機有重疊
+        回傳: 是否所有相機皆已校準
+        """
+        fixed_marker_ids = set(int(marker_id) for marker_id in self.tracker.pool_detector.fixed_marker_ids)
+        for _ in range(attempts):
+            pending = [unit for unit in self.units if not unit.calibrated]
+            if not pending:
+                return True
+            frames = {}
+            for unit in self.units:
+                ret, frame = unit.cap.read()
+                if ret:
+                    frames[unit.name] = frame
+                    unit.frame_shape = frame.shape
+
+            # 已校準相機的固定 Marker 位置 (共用座標)
+            known = {}
+            for unit in self.units:
+                if unit.calibrated and unit.name in frames:
+                    _, corners, ids_list = unit.tracker.detect_markers(frames[unit.name])
+                    for corner, marker_id in zip(corners, ids_list):
+                        if int(marker_id[0]) in fixed_marker_ids:
+                            known.setdefault(int(marker_id[0]), np.asarray(corner, dtype=np.float32).reshape(4, 2))
+
+            for unit in pending:
+                if unit.name in frames:
+                    self.calibrate_unit(unit, frames[unit.name], known)
+
+        for unit in self.units:
+            if not unit.calibrated:
+                print(f"[多相機] 相機 {unit.name} 無法以固定 Marker 完成校準 (需要至少 {self.min_markers} 個與已校準相機共同的固定 Marker)")
+        return all(unit.calibrated for unit in self.units)
+
+    def calibrate_unit(self, unit, frame, known):
+        """以影像中與 known 共同的固定 Marker 求此相機的透視變換矩陣"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        corners, ids = unit.tracker.detect_aruco(gray)
+        if ids is None:
+            return False
+        matches = [(corner, int(marker_id)) for corner, marker_id in zip(corners, ids.ravel()) if int(marker_id) in known]
+        if len(matches) < self.min_markers:
+            return False
+        source = unit.pool_detector.undistort_points(np.concatenate([corner.reshape(4, 2) for corner, _ in matches]))
+        target = np.concatenate([known[marker_id] for _, marker_id in matches])
+        transform_matrix, inliers = cv2.findHomography(source, target, cv2.RANSAC, 3.0)
+        if transform_matrix is None or inliers.sum() < 4 * self.min_markers:
+            return False
+        unit.pool_detector.set_transform_matrix(transform_matrix)
+        print(f"[多相機] 相機 {unit.name} 已校準 ({len(matches)} 個共同的固定 Marker，內點 {int(inliers.sum())}/{len(source)})")
+        return True
+
+    # ===== 影像來源 (FramePipeline 擷取階段) =====
+
+    def start(self):
+        """校準其他相機並啟動各相機的擷取與檢測執行緒，回傳是否成功"""
+        if not self.calibrate():
+            for unit in self.units:
+                if unit.owns_capture:
+                    unit.cap.release()
+            return False
+        self.running = True
+        for unit in self.units:
+            unit.start(self.tracker)
+        self.last_report_time = time.perf_counter()
+        print(f"[多相機] {len(self.units)} 台相機已啟動")
+        return True
+
+    def read(self):
+        """
+        收集各相機最新的檢測結果
+        等待所有相機完成新的一幀，第一台相機完成後最多等待 sync_timeout；未趕上的相機不加入這一幀
+        回傳: (是否成功, [(CameraUnit, (capture_time, warped_frame, corners, ids_list)), ...])
+        """
+        deadline = None
+        with self.condition:
+            while self.running and self.tracker.running:
+                fresh = [unit for unit in self.units if unit.result_seq > unit.consumed_seq]
+                if len(fresh) == len(self.units):
+                    break
+                now = time.perf_counter()
+                if fresh and deadline is None:
+                    deadline = now + self.sync_timeout
+                if deadline is not None and now >= deadline:
+                    break
+                self.condition.wait(timeout=0.1 if deadline is None else deadline - now)
+            if not (self.running and self.tracker.running):
+                return False, None
+            results = []
+            for unit in fresh:
+                results.append((unit, unit.result))
+                unit.consumed_seq = unit.result_seq
+
+        self.frames_read += 1
+        for unit in self.units:
+            if unit not in fresh:
+                unit.stats["missed"] += 1
+                self.metrics.increment(f"camera.{unit.name}.missed")
+        self.last_capture_time = max(result[0] for _, result in results)
+
+        if self.report_interval is not None and time.perf_counter() - self.last_report_time >= self.report_interval:
+            self.report()
+            self.last_report_time = time.perf_counter()
+        return True, results
+
+    # ===== 檢測後端 (FramePipeline 檢測階段) =====
+
+    def submit(self, results):
+        """融合各相機的檢測結果，回傳 FusedDetection (warped_frame, corners, ids_list)"""
+        with self.metrics.timer("detect.fuse"):
+            corners, ids_list = self.fuse(results)
+        with self.metrics.timer("detect.compose"):
+            warped_frame = self.compose()
+        return FusedDetection((warped_frame, corners, ids_list))
+
+    def detect_markers(self, results):
+        return self.submit(results).result()
+
+    def fuse(self, results):
+        """
+        依 Marker ID 合併各相機的檢測結果
+        可信度最高的一筆為基準，其他相機與其一致(角點平均距離 < agreement * 邊長)的結果以可信度加權平均
+        回傳: (corners, ids_list)，與 ArUcoTracker.detect_markers 相同的格式
+        """
+        candidates = {}  # id -> [(可信度, (4,2) 角點), ...]
+        for unit, (_, _, corners, ids_list) in results:
+            if len(ids_list) == 0:
+                continue
+            unit_corners = np.concatenate([np.asarray(c, dtype=np.float32).reshape(1, 4, 2) for c in corners])
+            for marker_id, corner, weight in zip(ids_list, unit_corners, unit.confidence(unit_corners)):
+                candidates.setdefault(int(marker_id[0]), []).append((weight, corner))
+
+        fused_corners = []
+        fused_ids = []
+        for marker_id, entries in candidates.items():
+            best_weight, best = max(entries, key=lambda entry: entry[0])
+            if len(entries) > 1:
+                side = np.linalg.norm(best - np.roll(best, 1, axis=0), axis=1).mean()
+                agreeing = [(weight, corner) for weight, corner in entries
+                            if np.linalg.norm(corner - best, axis=1).mean() < self.agreement * side]
+                weights = np.array([weight for weight, _ in agreeing])
+                best = np.tensordot(weights / weights.sum(), np.stack([corner for _, corner in agreeing]), axes=1)
+            fused_corners.append(best.reshape(1, 4, 2).astype(np.float32))
+            fused_ids.append([marker_id])
+        return fused_corners, fused_ids
+
+    def compose(self):
+        """
+        組合各相機最近的透視變換影像 (顯示用)
+        主相機優先，其他相機只填入前面相機未涵蓋的範圍
+        """
+        units = [unit for unit in self.units if unit.last_warped is not None]
+        masks = [unit.get_coverage_mask() for unit in units]
+        key = tuple((unit.name, unit.coverage_key) for unit in units)
+        if self.display_masks is None or self.display_masks_key != key:
+            covered = None
+            self.display_masks = []
+            for mask in masks:
+                self.display_masks.append(mask.copy() if covered is None else mask & ~covered)
+                covered = mask.copy() if covered is None else covered | mask
+            self.display_masks_key = key
+
+        output = units[0].last_warped.copy()
+        for unit, mask in zip(units[1:], self.display_masks[1:]):
+            np.copyto(output, unit.last_warped, where=mask[..., None])
+        return output
+
+    # ===== 統計 =====
+
+    def get_stats(self):
+        """各相機的統計資料 {名稱: {...}}，可找出限制整體幀率的相機"""
+        return {unit.name: dict(unit.stats) for unit in self.units}
+
+    def report(self):
+        stats = self.get_stats()
+        slowest = min(stats, key=lambda name: stats[name]["fps"])
+        for name, values in stats.items():
+            print(f"[多相機] 相機 {name}: {values['fps']:5.1f} fps  擷取 {values['capture_time'] * 1000:6.2f} ms  "
+                  f"檢測 {values['detect_time'] * 1000:6.2f} ms  Marker {values['markers']:4.1f}/幀  "
+                  f"未趕上 {values['missed'] / max(self.frames_read, 1):5.1%}" + ("  <- 限制幀率" if name == slowest else ""))
+
+    def close(self):
+        """停止所有相機的執行緒並釋放其他相機"""
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        for unit in self.units:
+            unit.stop()
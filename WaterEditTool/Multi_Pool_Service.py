@@ -0,0 +1,294 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from Camera_Calibration import load_calibration_profile
+from Camera_Capture import CameraCapture
+from Frame_Pipeline import FramePipeline
+from Performance_Metrics import metrics
+from Quality_Governor import QualityGovernor
+from Session_Recorder import SESSION_FILE
+from Snapshot_Service import SnapshotService
+from TCP_Server import FlowMapServer, POOL_HANDSHAKE_COMMAND, receive_pool_id, send_pool_reply
+
+class PoolRouter:
+    """
+    多水池服務共用的監聽Socket
+    Client 連線後以命令10傳送水池 ID，依此轉交給該水池的 FlowMapServer；
+    未在 handshake_timeout 內交握(或第一個命令不是交握)的舊版 Client 轉交給預設水池
+    """
+
+    def __init__(self, host='0.0.0.0', port=8888, handshake_timeout=2.0):
+        self.host = host
+        self.port = port
+        self.handshake_timeout = handshake_timeout
+        self.servers = {}          # 水池 ID -> FlowMapServer
+        self.default_pool = None   # 第一個註冊的水池 (舊版 Client 轉交的水池)
+        self.server_socket = None
+        self.running = False
+        self.metrics = metrics
+
+    def register(self, pool_id, server):
+        self.servers[pool_id] = server
+        if self.default_pool is None:
+            self.default_pool = pool_id
+
+    def start(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.listen(5)
+        self.running = True
+        print(f"[多水池服務] 監聽 {self.host}:{self.port}，水池: {', '.join(self.servers)}")
+        threading.Thread(target=self.accept_clients, daemon=True).start()
+
+    def accept_clients(self):
+        while self.running:
+            try:
+                client_socket, addr = self.server_socket.accept()
+            except OSError as e:
+                if not self.running:
+                    break
+                print(f"[多水池服務] 接受連線時發生錯誤: {e}")
+                continue
+            # 交握在各自的執行緒中等待，避免緩慢的 Client 阻塞其他連線
+            threading.Thread(target=self.route_client, args=(client_socket, addr), daemon=True).start()
+
+    def route_client(self, client_socket, addr):
+        """讀取水池 ID 交握並轉交給對應的 FlowMapServer"""
+        pool_id = self.default_pool
+        try:
+            client_socket.settimeout(self.handshake_timeout)
+            try:
+                # 只預覽第一個位元組: 不是交握命令時留給 FlowMapServer 處理
+                first = client_socket.recv(1, socket.MSG_PEEK)
+            except socket.timeout:
+                first = None
+            if first == bytes([POOL_HANDSHAKE_COMMAND]):
+                client_socket.recv(1)
+                pool_id = receive_pool_id(client_socket)
+                accepted = pool_id in self.servers
+                send_pool_reply(client_socket, accepted)
+                if not accepted:
+                    print(f"[多水池服務] Client {addr} 要求未知的水池 ID: {pool_id}")
+                    self.metrics.increment("router.rejected")
+                    client_socket.close()
+                    return
+            elif first == b'':
+                client_socket.close()  # 交握前已斷線
+                return
+            client_socket.settimeout(None)
+        except OSError as e:
+            print(f"[多水池服務] Client {addr} 交握失敗: {e}")
+            client_socket.close()
+            return
+
+        print(f"[多水池服務] Client {addr} -> 水池 {pool_id}")
+        self.metrics.increment(f"pool.{pool_id}.connections")
+        self.servers[pool_id].attach_client(client_socket, addr)
+
+    def stop(self):
+        self.running = False
+        if self.server_socket is not None:
+            self.server_socket.close()
+            self.server_socket = None
+
+class PoolHost:
+    """
+    多水池服務中的單一水池
+    自己的相機、PoolDetector / ArUcoTracker / FlowMapGenerator 與無 UI 的 FramePipeline；
+    FlowMapServer 不監聽(由 PoolRouter 轉交連線)，FlowMap 編碼使用服務共用的執行緒池，
+    效能指標以 "pool.<水池 ID>." 為前綴寫入共用的指標紀錄
+    """
+
+    def __init__(self, pool_id, source, session, encoder, camera_calibration=None, target_fps=30.0,
+                 detection_mode="full", flow_mode="brush", camera_format=None):
+        """
+        pool_id: 水池 ID (Client 交握時使用)
+        source: 相機的 VideoCapture 來源
+        session: 水池校準資訊 (Session_Recorder 的 session.json 格式，使用 "pool" 與 "water_jet_vectors")
+        encoder: 共用的編碼執行緒池
+        camera_calibration: 相機校準設定檔路徑 (鏡頭畸變參數與調整後的檢測參數，可省略)
+        flow_mode: FlowMap 生成模式 ("brush"、"interpolate" 或 "physics")
+        camera_format: 相機影像格式 {"fourcc", "width", "height", "fps", "luma"} (CameraCapture 的參數，可省略)
+        """
+        from ArUco_to_FlowMap import PoolDetector, ArUcoTracker
+
+        self.pool_id = pool_id
+        self.source = source
+        self.camera_format = camera_format or {}
+        self.encoder = encoder
+        self.target_fps = target_fps
+        self.metrics = metrics.scoped(f"pool.{pool_id}")
+
+        profile = session["pool"]
+        with contextlib.redirect_stdout(io.StringIO()):  # 忽略建立過程的輸出
+            pool_detector = PoolDetector(profile["fixed_marker_ids"], world_radius=profile["world_radius"],
+                                         pool_shape=profile["pool_shape"])
+            pool_detector.load_profile(profile)
+            if camera_calibration is not None:
+                calibration_profile = load_calibration_profile(camera_calibration)
+                pool_detector.load_camera_calibration(calibration_profile)
+                pool_detector.load_detector_parameters(calibration_profile)
+            self.tracker = ArUcoTracker(pool_detector, flow_mode=flow_mode)
+        self.tracker.detection_mode = detection_mode
+        if session.get("water_jet_vectors"):
+            self.tracker.update_water_jet_vectors([tuple(vector) for vector in session["water_jet_vectors"]])
+        self.tracker.metrics = self.metrics
+        self.tracker.flow_map_generator.metrics = self.metrics
+
+        self.server = FlowMapServer(port=None, pool_id=pool_id)
+        self.server.pool_shape = pool_detector.pool_shape
+        self.server.metrics = self.metrics
+        self.snapshots = SnapshotService(self.server)
+        self.snapshots.metrics = self.metrics
+        self.cap = None
+        self.pipeline = None
+        self.thread = None
+
+    def start(self):
+        self.cap = CameraCapture(self.source, **self.camera_format)
+        if not self.cap.isOpened():
+            print(f"[多水池服務] 水池 {self.pool_id}: 無法開啟相機 {self.source}")
+            return False
+        self.server.start()
+        self.snapshots.start()
+        self.tracker.running = True
+        governor = QualityGovernor(self.tracker, target_fps=self.target_fps) if self.target_fps else None
+        self.pipeline = FramePipeline(self.cap, self.tracker, None, self.server, save_interval=30,
+                                      target_fps=self.target_fps, governor=governor, encoder=self.encoder,
+                                      snapshots=self.snapshots)
+        self.pipeline.metrics = self.metrics
+        self.thread = threading.Thread(target=self.run, name=f"pool-{self.pool_id}", daemon=True)
+        self.thread.start()
+        print(f"[多水池服務] 水池 {self.pool_id} 已啟動 (相機 {self.source})")
+        return True
+
+    def run(self):
+        self.pipeline.start()
+        self.pipeline.join()
+
+    def status(self):
+        """水池狀態 (追蹤幀數、丟棄幀數、Client 連線)"""
+        pipeline = self.pipeline
+        return {
+            "running": self.tracker.running,
+            "frames": self.tracker.flow_map_generator.current_frame,
+            "dropped_frames": pipeline.dropped_frames if pipeline is not None else 0,
+            "client_connected": self.server.client_connected,
+            "streaming": self.server.flowmap_streaming,
+        }
+
+    def stop(self):
+        self.tracker.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+            self.thread = None
+        self.snapshots.stop()
+        self.server.stop()
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+def load_session(path):
+    """讀取水池校準資訊 (工作階段資料夾或 session.json 格式的檔案)"""
+    if os.path.isdir(path):
+        path = os.path.join(path, SESSION_FILE)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+class MultiPoolService:
+    """
+    在同一個程序中執行多個獨立的水池追蹤管線
+    共用: 監聽Socket(PoolRouter)、FlowMap 編碼執行緒池與效能指標服務；
+    每個水池: 相機、PoolDetector / ArUcoTracker / FlowMapGenerator、FramePipeline 與 FlowMapServer
+    """
+
+    def __init__(self, config):
+        """config: 服務設定 (dict，格式見 main)"""
+        self.config = config
+        self.encoder = ThreadPoolExecutor(max_workers=config.get("encoder_workers", 2), thread_name_prefix="encoder")
+        self.router = PoolRouter(config.get("host", "0.0.0.0"), config.get("port", 8888))
+        self.pools = {}
+        for pool in config["pools"]:
+            host = PoolHost(
+                pool["id"], pool["source"], load_session(pool["session"]), self.encoder,
+                camera_calibration=pool.get("camera_calibration"),
+                target_fps=pool.get("target_fps", 30.0),
+                detection_mode=pool.get("detection_mode", "full"),
+                flow_mode=pool.get("flow_mode", "brush"),
+                camera_format=pool.get("camera_format"),
+            )
+            self.pools[host.pool_id] = host
+
+    def start(self):
+        metrics.enable()
+        if self.config.get("metrics_port") is not None:
+            metrics.start_http_server(host="127.0.0.1", port=self.config["metrics_port"])
+        # 只轉交連線給成功啟動的水池(預設水池為第一個成功啟動的水池)
+        started = []
+        for pool_id, host in self.pools.items():
+            if host.start():
+                self.router.register(pool_id, host.server)
+                started.append(pool_id)
+        if started:
+            self.router.start()
+        return started
+
+    def report(self):
+        for pool_id, host in self.pools.items():
+            status = host.status()
+            print(f"[多水池服務] 水池 {pool_id}: {status['frames']} 幀  丟棄 {status['dropped_frames']}  "
+                  f"Client {'已連線' if status['client_connected'] else '未連線'}"
+                  f"{'  (傳送FlowMap中)' if status['streaming'] else ''}")
+
+    def stop(self):
+        self.router.stop()
+        for host in self.pools.values():
+            host.stop()
+        self.encoder.shutdown(wait=True)
+        metrics.stop_http_server()
+
+def main():
+    """
+    多水池服務 (命令列工具，無 UI)
+    設定檔格式:
+    {
+        "host": "0.0.0.0", "port": 8888, "metrics_port": 9100, "encoder_workers": 2,
+        "pools": [
+            {"id": "north", "source": 0, "session": "sessions/north", "camera_calibration": "north_camera.json",
+             "target_fps": 30, "detection_mode": "full", "flow_mode": "brush",
+             "camera_format": {"fourcc": "YUYV", "width": 1280, "height": 720, "fps": 30, "luma": true}},
+            ...
+        ]
+    }
+    session 為該水池錄製的工作階段資料夾(或 session.json)，提供透視變換、水池參數與射水向量
+    """
+    parser = argparse.ArgumentParser(description="在同一個程序中執行多個水池的追蹤與 FlowMap 服務")
+    parser.add_argument("config", help="服務設定檔 (JSON)")
+    parser.add_argument("--report-interval", type=float, default=30.0, help="輸出各水池狀態的間隔 (秒)")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    service = MultiPoolService(config)
+    if not service.start():
+        print("[多水池服務] 沒有可執行的水池")
+        service.stop()
+        return
+    try:
+        while True:
+            time.sleep(args.report_interval)
+            service.report()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import pickle
+import queue
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+from Performance_Metrics import metrics
+
+def pack_detections(corners, ids_list):
+    """
+    將檢測結果轉換為緊湊陣列 (工作程序回傳結果時使用，避免 pickle 大量小陣列)
+    回傳: ids (N,) int32, corners (N, 4, 2) float32
+    """
+    if len(ids_list) == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros((0, 4, 2), dtype=np.float32)
+    ids = np.array([marker_id[0] for marker_id in ids_list], dtype=np.int32)
+    corners = np.concatenate([np.asarray(c, dtype=np.float32).reshape(1, 4, 2) for c in corners])
+    return ids, corners
+
+def unpack_detections(ids, corners):
+    """將緊湊陣列還原為 ArUcoTracker.detect_markers 的輸出格式 (corners, ids_list)"""
+    return [corner.reshape(1, 4, 2) for corner in corners], [[marker_id] for marker_id in ids]
+
+class SharedFramePool:
+    """
+    共享記憶體影像池
+    slots 個相同大小的影像槽位配置在同一塊 multiprocessing.shared_memory 上，
+    主程序將影像寫入槽位後只需把槽位編號傳給工作程序，不需 pickle 複製整張影像
+    """
+
+    def __init__(self, slots, shape, dtype=np.uint8, name=None):
+        """
+        slots: 槽位數量
+        shape: 單張影像的形狀
+        name: 共享記憶體名稱 (None 表示建立新的共享記憶體，否則連接到既有的共享記憶體)
+        """
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+        if self.owner:
+            size = slots * int(np.prod(self.shape)) * self.dtype.itemsize
+            self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray((slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+        # 可使用的槽位 (只有建立者管理)
+        self.free_slots = queue.Queue()
+        if self.owner:
+            for slot in range(slots):
+                self.free_slots.put(slot)
+
+    def spec(self):
+        """連接此影像池所需的資訊 (傳給工作程序)"""
+        return self.shm.name, self.slots, self.shape, self.dtype.str
+
+    @classmethod
+    def attach(cls, spec):
+        name, slots, shape, dtype = spec
+        return cls(slots, shape, dtype, name=name)
+
+    def acquire(self):
+        """取得一個空的槽位 (全部使用中時等待)"""
+        return self.free_slots.get()
+
+    def release(self, slot):
+        self.free_slots.put(slot)
+
+    def close(self):
+        """釋放共享記憶體 (建立者同時刪除共享記憶體)"""
+        if self.array is None:
+            return
+        self.array = None  # 先釋放 numpy 對共享記憶體的參照，否則無法關閉
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+def profile_path(profile_dir, profile_version):
+    """校準結果檔案的路徑 (每個版本一個檔案)"""
+    return os.path.join(profile_dir, f"profile-{profile_version}.pkl")
+
+# ===== 工作程序 =====
+
+_worker = {}  # 工作程序內的追蹤器與影像池
+
+def init_worker(profile_dir, profile_version, pool_specs):
+    """[工作程序] 依主程序的校準結果(含檢測參數)建立自己的 PoolDetector / ArUcoTracker，並連接共享影像池"""
+    from ArUco_to_FlowMap import PoolDetector, ArUcoTracker
+
+    cv2.setNumThreads(1)  # 每個工作程序只使用一個核心，由程序數量決定並行程度
+    with open(profile_path(profile_dir, profile_version), "rb") as f:
+        profile = pickle.load(f)
+    with contextlib.redirect_stdout(io.StringIO()):  # 忽略建立過程的輸出
+        pool_detector = PoolDetector(profile["fixed_marker_ids"], world_radius=profile["world_radius"],
+                                     pool_shape=profile["pool_shape"])
+        pool_detector.load_profile(profile)
+        tracker = ArUcoTracker(pool_detector)
+    _worker["tracker"] = tracker
+    _worker["profile_dir"] = profile_dir
+    _worker["profile_version"] = profile_version
+    _worker["pools"] = {kind: SharedFramePool.attach(spec) for kind, spec in pool_specs.items()}
+
+def update_worker_profile(profile_version):
+    """
+    [工作程序] 主程序的校準結果或檢測參數改變時(例如透視變換偏移校正)重新載入，不需重新啟動工作程序
+    工作只帶有版本編號，校準結果由主程序發布的檔案讀取 (每個版本只讀取一次)
+    """
+    if _worker["profile_version"] == profile_version:
+        return
+    with open(profile_path(_worker["profile_dir"], profile_version), "rb") as f:
+        profile = pickle.load(f)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _worker["tracker"].pool_detector.load_profile(profile)
+    _worker["profile_version"] = profile_version
+
+def detect_frame_job(frame, detection_scale, detection_mode, profile_version):
+    """
+    [工作程序] 整幀檢測 (frame 模式)
+    frame: 影像池的槽位編號 (或影像大小與影像池不同時直接傳入的影像)
+    透視變換後的影像寫回 warped 影像池的相同槽位；大小不同時隨結果回傳
+    """
+    update_worker_profile(profile_version)
+    tracker = _worker["tracker"]
+    pools = _worker["pools"]
+    tracker.detection_scale = detection_scale
+    tracker.detection_mode = detection_mode
+    image = pools["frame"].array[frame] if isinstance(frame, int) else frame
+    warped_frame, corners, ids_list = tracker.detect_markers(image)
+
+    warped_pool = pools["warped"]
+    if isinstance(frame, int) and warped_frame.shape == warped_pool.shape:
+        warped_pool.array[frame] = warped_frame
+        warped_frame = None
+    return pack_detections(corners, ids_list), warped_frame
+
+def detect_strip_job(kind, slot, y0, y1, detection_scale, detection_mode, profile_version):
+    """[工作程序] 檢測灰階影像中 y0~y1 列的區段 (strip 模式)，角點座標換算回整張影像"""
+    update_worker_profile(profile_version)
+    tracker = _worker["tracker"]
+    tracker.detection_scale = detection_scale
+    tracker.detection_mode = detection_mode
+    # pyramid 模式依區段分別記錄 Marker 大小
+    corners, ids = tracker.detect_aruco(_worker["pools"][kind].array[slot, y0:y1], f"{kind}:{y0}")
+    if ids is None or len(ids) == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros((0, 4, 2), dtype=np.float32)
+    corners = np.concatenate([np.asarray(c, dtype=np.float32).reshape(1, 4, 2) for c in corners])
+    corners[:, :, 1] += y0
+    return ids.ravel().astype(np.int32), corners
+
+def merge_strips(results, height):
+    """
+    合併重疊區段的檢測結果，同一 ID 只保留離區段切割邊緣最遠的一筆
+    (位於重疊範圍的 Marker 會在相鄰兩個區段中被檢測到，越靠近切割邊緣越可能被截斷或受閾值視窗影響)
+    results: [(y0, y1, ids, corners), ...]
+    回傳: OpenCV detectMarkers 的格式 (corners, ids)
+    """
+    best = {}
+    for y0, y1, ids, corners in results:
+        center_y = corners[:, :, 1].mean(axis=1)
+        top = center_y - y0 if y0 > 0 else np.inf
+        bottom = y1 - center_y if y1 < height else np.inf
+        margins = np.minimum(top, bottom)
+        for marker_id, corner, margin in zip(ids, corners, margins):
+            if marker_id not in best or margin > best[marker_id][0]:
+                best[marker_id] = (margin, corner)
+    if not best:
+        return (), None
+    ids = np.array(list(best.keys()), dtype=np.int32).reshape(-1, 1)
+    return tuple(corner.reshape(1, 4, 2) for _, corner in best.values()), ids
+
+# ===== 主程序 =====
+
+class DetectionHandle:
+    """一幀的非同步檢測結果 (ParallelDetector.submit 回傳)"""
+
+    def __init__(self, detector, slot, futures, warped_frame=None, strips=None, transform_matrix=None):
+        self.detector = detector
+        self.slot = slot
+        self.futures = futures
+        self.warped_frame = warped_frame  # strip 模式在主程序完成的透視變換影像
+        self.strips = strips              # strip 模式每個工作對應的 (影像種類, y0, y1)
+        self.transform_matrix = transform_matrix  # 送出時的透視變換矩陣 (換算固定 Marker 的影像座標)
+
+    def done(self):
+        return all(future.done() for future in self.futures)
+
+    def result(self):
+        """等待檢測完成，回傳 (warped_frame, corners, ids_list)，與 ArUcoTracker.detect_markers 相同"""
+        return self.detector.collect(self)
+
+class ParallelDetector:
+    """
+    多程序 ArUco Marker 檢測 (FramePipeline 檢測階段的後端)
+    擷取的影像寫入共享記憶體影像池，檢測分配給工作程序執行：
+    frame: 每個工作程序處理一整幀(與 ArUcoTracker.detect_markers 相同的流程)，多幀同時處理，
+           提高吞吐量，單幀延遲不變
+    strip: 主程序完成灰階轉換與透視變換，將兩張灰階影像切分為互相重疊的水平區段同時檢測，
+           再依 ID 去除重複，縮短單幀延遲
+    工作程序以緊湊陣列 (ids (N,), corners (N,4,2)) 回傳結果；
+    校準結果或檢測參數改變時(PoolDetector.profile_version 遞增)，新的設定寫入以版本為名的檔案發布一次，
+    工作只帶有版本編號，工作程序在處理前讀取並重新載入
+    """
+
+    def __init__(self, tracker, workers=None, mode="frame", strip_overlap=160, max_in_flight=None):
+        """
+        tracker: 主程序的 ArUcoTracker (提供校準結果、檢測參數、detection_scale 與 detection_mode)
+        workers: 工作程序數量 (None 表示 CPU 核心數)
+        mode: "frame" 或 "strip"
+        strip_overlap: 區段之間重疊的列數 (需大於畫面中最大 Marker 的邊長)
+        max_in_flight: 同時處理的幀數 (None 表示 frame 模式為程序數的2倍，strip 模式為2)
+        """
+        if mode not in ("frame", "strip"):
+            raise ValueError(f"不支援的檢測模式: {mode}")
+        self.tracker = tracker
+        self.pool_detector = tracker.pool_detector
+        self.workers = workers or os.cpu_count()
+        self.mode = mode
+        self.strip_overlap = strip_overlap
+        if max_in_flight is None:
+            max_in_flight = 2 * self.workers if mode == "frame" else 2
+        self.max_in_flight = max_in_flight
+        self.metrics = metrics
+
+        self.executor = None
+        self.pools = {}
+        self.slot_pool = None
+        self.profile_dir = None        # 發布校準結果檔案的暫存資料夾
+        self.profile_version = None    # 最近發布的校準結果版本 (PoolDetector.profile_version)
+
+    def start(self, frame_shape):
+        """依影像大小建立共享影像池與工作程序 (第一幀送出時呼叫)"""
+        output_width, output_height = self.pool_detector.get_output_size()
+        if self.mode == "frame":
+            shapes = {"frame": frame_shape, "warped": (output_height, output_width) + tuple(frame_shape[2:])}
+        else:
+            shapes = {"original": tuple(frame_shape[:2]), "warped": (output_height, output_width)}
+        self.pools = {kind: SharedFramePool(self.max_in_flight, shape) for kind, shape in shapes.items()}
+        # 各影像池使用相同的槽位編號，由第一個影像池管理可用槽位
+        self.slot_pool = self.pools["frame" if self.mode == "frame" else "original"]
+        self.start_workers()
+        print(f"[並行檢測] {self.workers} 個工作程序，模式: {self.mode}，同時處理 {self.max_in_flight} 幀")
+
+    def start_workers(self):
+        """以目前的校準結果與檢測參數啟動工作程序"""
+        self.profile_dir = tempfile.mkdtemp(prefix="parallel_detector_")
+        self.publish_profile()
+        pool_specs = {kind: pool.spec() for kind, pool in self.pools.items()}
+        # 使用 spawn 建立工作程序 (主程序有多個執行緒與 Qt，fork 可能複製到被鎖住的狀態)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=init_worker,
+                                            initargs=(self.profile_dir, self.profile_version, pool_specs))
+
+    def publish_profile(self):
+        """將目前的校準結果與檢測參數寫入以版本為名的檔案 (寫入完成後才改名，工作程序不會讀到寫到一半的檔案)"""
+        profile_version = self.pool_detector.profile_version
+        path = profile_path(self.profile_dir, profile_version)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(self.pool_detector.to_profile(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+        self.profile_version = profile_version
+
+    def check_profile(self):
+        """校準結果或檢測參數改變時(版本遞增)發布新的設定，之後的工作帶有新的版本編號，工作程序據此重新載入"""
+        if self.pool_detector.profile_version != self.profile_version:
+            self.publish_profile()
+            print(f"[並行檢測] 校準結果或檢測參數已改變，工作程序將重新載入 (版本 {self.profile_version})")
+
+    def submit(self, frame):
+        """送出一幀進行檢測，回傳 DetectionHandle (同時處理的幀數達上限時等待槽位)"""
+        drift_corrector = self.tracker.drift_corrector
+        if drift_corrector is not None:
+            drift_corrector.apply_pending()  # 在幀與幀之間替換偏移校正後的透視變換
+        if self.executor is None:
+            self.start(frame.shape)
+        else:
+            self.check_profile()
+        detection_settings = (self.tracker.detection_scale, self.tracker.detection_mode, self.profile_version)
+        if self.mode == "frame":
+            return self.submit_frame(frame, detection_settings)
+        return self.submit_strips(frame, detection_settings)
+
+    def submit_frame(self, frame, detection_settings):
+        frame_pool = self.pools["frame"]
+        if frame.shape != frame_pool.shape:
+            # 影像大小與影像池不同(例如相機解析度改變)，直接傳送影像
+            return DetectionHandle(self, None, [self.executor.submit(detect_frame_job, frame, *detection_settings)],
+                                   transform_matrix=self.pool_detector.transform_matrix)
+        slot = self.slot_pool.acquire()
+        with self.metrics.timer("detect.shared_copy"):
+            np.copyto(frame_pool.array[slot], frame)
+        return DetectionHandle(self, slot, [self.executor.submit(detect_frame_job, slot, *detection_settings)],
+                               transform_matrix=self.pool_detector.transform_matrix)
+
+    def submit_strips(self, frame, detection_settings):
+        # 灰階轉換與透視變換在主程序完成 (透視變換後的影像同時用於追蹤畫面)
+        with self.metrics.timer("detect.warp"):
+            warped_frame = self.pool_detector.warp_frame(frame)
+        slot = self.slot_pool.acquire()
+        with self.metrics.timer("detect.shared_copy"):
+            if frame.ndim == 2:
+                # 相機直接提供的灰階(亮度)影像，不需灰階轉換
+                np.copyto(self.pools["original"].array[slot], frame)
+                np.copyto(self.pools["warped"].array[slot], warped_frame)
+            else:
+                cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.pools["original"].array[slot])
+                cv2.cvtColor(warped_frame, cv2.COLOR_BGR2GRAY, dst=self.pools["warped"].array[slot])
+
+        strips = [(kind, y0, y1) for kind in ("original", "warped")
+                  for y0, y1 in self.strip_bounds(self.pools[kind].shape[0])]
+        futures = [self.executor.submit(detect_strip_job, kind, slot, y0, y1, *detection_settings)
+                   for kind, y0, y1 in strips]
+        return DetectionHandle(self, slot, futures, warped_frame, strips,
+                               transform_matrix=self.pool_detector.transform_matrix)
+
+    def strip_bounds(self, height):
+        """將影像高度切分為與工作程序數量相同的區段，每個區段向上下延伸 strip_overlap/2 列"""
+        strips = max(1, min(self.workers, height // max(self.strip_overlap, 1)))
+        cuts = [height * i // strips for i in range(strips + 1)]
+        half = self.strip_overlap // 2
+        return [(max(0, y0 - half), min(height, y1 + half)) for y0, y1 in zip(cuts[:-1], cuts[1:])]
+
+    def collect(self, handle):
+        """等待檢測完成並取回結果，釋放使用的槽位"""
+        try:
+            if self.mode == "frame":
+                (ids, corners), warped_frame = handle.futures[0].result()
+                if warped_frame is None:
+                    warped_frame = self.pools["warped"].array[handle.slot].copy()
+                corners, ids_list = unpack_detections(ids, corners)
+                if self.tracker.drift_corrector is not None:
+                    self.tracker.drift_corrector.observe_warped(corners, ids_list, handle.transform_matrix)
+                return warped_frame, corners, ids_list
+
+            results = {"original": [], "warped": []}
+            for (kind, y0, y1), future in zip(handle.strips, handle.futures):
+                results[kind].append((y0, y1) + future.result())
+            corners_original, ids_original = merge_strips(results["original"], self.pools["original"].shape[0])
+            corners_warped, ids_warped = merge_strips(results["warped"], self.pools["warped"].shape[0])
+            if self.tracker.drift_corrector is not None:
+                self.tracker.drift_corrector.observe_image(corners_original, ids_original)
+            corners, ids_list = self.tracker.merge_detections(corners_warped, ids_warped, corners_original, ids_original)
+            return handle.warped_frame, corners, ids_list
+        finally:
+            if handle.slot is not None:
+                self.slot_pool.release(handle.slot)
+                handle.slot = None
+
+    def detect_markers(self, frame):
+        """同步檢測一幀 (與 ArUcoTracker.detect_markers 相同的介面)"""
+        return self.submit(frame).result()
+
+    def close(self):
+        """結束工作程序並釋放共享記憶體"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        for pool in self.pools.values():
+            pool.close()
+        self.pools = {}
+        if self.profile_dir is not None:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
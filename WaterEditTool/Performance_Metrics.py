@@ -0,0 +1,222 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+class RollingHistogram:
+    """
+    滾動式統計
+    以固定長度的環狀緩衝區保留最近 window 筆樣本(紀錄時為 O(1))，查詢時才計算百分位數
+    同一個指標可能由多個執行緒紀錄(例如編碼執行緒池)，寫入與讀取樣本時持有鎖
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.samples = [0.0] * window  # 環狀緩衝區
+        self.index = 0                 # 下一筆樣本的寫入位置
+        self.total_count = 0           # 累計樣本數
+        self.total_sum = 0.0           # 累計樣本總和
+        self.lock = threading.Lock()
+
+    def record(self, value):
+        """記錄一筆樣本"""
+        with self.lock:
+            self.samples[self.index] = value
+            self.index = (self.index + 1) % self.window
+            self.total_count += 1
+            self.total_sum += value
+
+    def snapshot(self):
+        """計算最近樣本的統計值 (p50 / p95 / p99 / 平均 / 最大值)"""
+        with self.lock:
+            total_count, total_sum = self.total_count, self.total_sum
+            count = min(total_count, self.window)
+            recent = np.array(self.samples[:count] if count < self.window else self.samples)
+        if count == 0:
+            return {"count": total_count, "sum": total_sum}
+        p50, p95, p99 = np.percentile(recent, [50, 95, 99])
+        return {
+            "count": total_count,
+            "sum": total_sum,
+            "mean": float(recent.mean()),
+            "max": float(recent.max()),
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+        }
+
+class NullTimer:
+    """未啟用指標時使用的空計時器"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+class Timer:
+    """計時器 (with 區塊結束時記錄經過時間)"""
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+        self.start_time = 0.0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.record(self.name, time.perf_counter() - self.start_time)
+        return False
+
+class MetricsRegistry:
+    """
+    輕量化效能指標紀錄
+    計時(滾動式百分位數)與計數器；管線各階段、編碼執行緒池與多個水池可能同時紀錄，
+    計數器的累加與計時樣本的寫入皆持有鎖(只鎖住一次累加，熱路徑的額外負擔很小)
+    """
+
+    NULL_TIMER = NullTimer()
+
+    def __init__(self, enabled=False, window=1024, prefix="waterflow"):
+        self.enabled = enabled
+        self.window = window
+        self.prefix = prefix
+        self.timings = {}   # 名稱 -> RollingHistogram (秒)
+        self.counters = {}  # 名稱 -> 累計數值
+        self.start_time = time.time()
+        self.http_server = None
+        self.lock = threading.Lock()  # 保護計數器的累加與新計時的建立
+
+    def enable(self, enabled=True):
+        """啟用/停用指標紀錄"""
+        self.enabled = enabled
+
+    def timer(self, name):
+        """
+        計時區塊
+        用法: with metrics.timer("flowmap.blur"): ...
+        """
+        if not self.enabled:
+            return self.NULL_TIMER
+        return Timer(self, name)
+
+    def record(self, name, seconds):
+        """記錄一筆處理時間 (秒)"""
+        if not self.enabled:
+            return
+        histogram = self.timings.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.timings.setdefault(name, RollingHistogram(self.window))
+        histogram.record(seconds)
+
+    def increment(self, name, value=1):
+        """累加計數器"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def scoped(self, scope):
+        """取得以 "<scope>." 為名稱前綴的指標紀錄 (多水池服務中每個水池共用同一個指標服務)"""
+        return ScopedMetrics(self, scope)
+
+    def snapshot(self):
+        """取得所有指標的統計資料 (dict)"""
+        with self.lock:
+            timings = list(self.timings.items())
+            counters = dict(self.counters)
+        return {
+            "uptime_seconds": time.time() - self.start_time,
+            "timings": {name: histogram.snapshot() for name, histogram in timings},
+            "counters": counters,
+        }
+
+    def to_prometheus(self):
+        """將指標轉換為 Prometheus 文字格式"""
+        snapshot = self.snapshot()
+        lines = [
+            f"# TYPE {self.prefix}_timing_seconds summary",
+        ]
+        for name, stats in sorted(snapshot["timings"].items()):
+            label = f'name="{name}"'
+            for quantile in ("p50", "p95", "p99"):
+                if quantile in stats:
+                    lines.append(f'{self.prefix}_timing_seconds{{{label},quantile="0.{quantile[1:]}"}} {stats[quantile]:.9f}')
+            lines.append(f"{self.prefix}_timing_seconds_count{{{label}}} {stats['count']}")
+            lines.append(f"{self.prefix}_timing_seconds_sum{{{label}}} {stats['sum']:.9f}")
+
+        for name, value in sorted(snapshot["counters"].items()):
+            metric_name = f"{self.prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}_total"
+            lines.append(f"# TYPE {metric_name} counter")
+            lines.append(f"{metric_name} {value}")
+
+        lines.append(f"# TYPE {self.prefix}_uptime_seconds gauge")
+        lines.append(f"{self.prefix}_uptime_seconds {snapshot['uptime_seconds']:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def start_http_server(self, host="127.0.0.1", port=9100):
+        """
+        啟動本機 HTTP 指標服務 (背景執行緒)
+        /metrics      -> Prometheus 文字格式
+        /metrics.json -> JSON 格式
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body = json.dumps(registry.snapshot(), indent=2).encode("utf-8")
+                    content_type = "application/json"
+                elif self.path.startswith("/metrics"):
+                    body = registry.to_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # 不輸出每次請求的記錄
+
+        self.http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        print(f"[效能指標服務已啟動: http://{host}:{port}/metrics]")
+
+    def stop_http_server(self):
+        """關閉 HTTP 指標服務"""
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+
+class ScopedMetrics:
+    """名稱加上前綴後寫入共用 MetricsRegistry 的指標紀錄 (與 MetricsRegistry 相同的紀錄介面)"""
+
+    def __init__(self, registry, scope):
+        self.registry = registry
+        self.scope = scope
+
+    @property
+    def enabled(self):
+        return self.registry.enabled
+
+    def timer(self, name):
+        return self.registry.timer(f"{self.scope}.{name}")
+
+    def record(self, name, seconds):
+        self.registry.record(f"{self.scope}.{name}", seconds)
+
+    def increment(self, name, value=1):
+        self.registry.increment(f"{self.scope}.{name}", value)
+
+# 預設的共用指標紀錄 (啟用後才會記錄)
+metrics = MetricsRegistry()
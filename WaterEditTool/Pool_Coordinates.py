@@ -0,0 +1,94 @@
+import cv2
+import numpy as np
+
+class PoolCoordinates:
+    """
+    水池座標系統 (批次轉換)
+    原始影像 -> 透視變換後畫面(warped) -> 歸一化座標(-1~1) -> 世界座標(公尺) / FlowMap 畫布座標，以及各自的反向轉換
+    圓形水池的極座標轉換(sqrt/arctan2/cos/sin)等同於以圓心為原點、半徑為單位的縮放與平移，
+    矩形/多邊形水池為以 pool_rect 為範圍的縮放與平移(並限制在矩形內)；
+    轉換參數在校準完成時計算一次，一幀內所有 Marker 與射水的座標以一次陣列運算轉換
+    """
+
+    def __init__(self, pool_detector):
+        """依 PoolDetector 的校準結果計算轉換參數"""
+        self.pool_shape = pool_detector.pool_shape
+        self.world_radius = float(pool_detector.world_radius)
+        self.transform_matrix = pool_detector.transform_matrix
+        self.camera_matrix = pool_detector.camera_matrix
+        self.dist_coeffs = pool_detector.dist_coeffs
+
+        # 歸一化座標 = (warped - offset) / half_size
+        self.offset = None
+        self.half_size = None
+        self.clip = False  # 矩形/多邊形水池的座標限制在矩形範圍內
+        if self.pool_shape == "circle" and pool_detector.pool_center is not None and pool_detector.pool_radius is not None:
+            self.offset = np.array(pool_detector.pool_center, dtype=np.float64)
+            self.half_size = np.array([pool_detector.pool_radius, pool_detector.pool_radius], dtype=np.float64)
+        elif self.pool_shape in ("rectangle", "polygon") and pool_detector.pool_rect is not None:
+            rect_x, rect_y, rect_w, rect_h = pool_detector.pool_rect
+            self.half_size = np.array([rect_w, rect_h], dtype=np.float64) / 2
+            self.offset = np.array([rect_x, rect_y], dtype=np.float64) + self.half_size
+            self.clip = True
+
+    @property
+    def valid(self):
+        """水池參數是否已完成校準"""
+        return self.offset is not None
+
+    # ===== 原始影像 <-> 透視變換後畫面 =====
+
+    def image_to_warped(self, points):
+        """原始影像座標 -> 透視變換後畫面座標 (含畸變校正)"""
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+        if len(points) == 0:
+            return points.reshape(-1, 2)
+        if self.camera_matrix is not None:
+            points = cv2.undistortPoints(points, self.camera_matrix, self.dist_coeffs, P=self.camera_matrix)
+        return cv2.perspectiveTransform(points, self.transform_matrix).reshape(-1, 2)
+
+    # ===== 透視變換後畫面 <-> 歸一化座標 =====
+
+    def warped_to_normalized(self, points):
+        normalized = (np.asarray(points, dtype=np.float64).reshape(-1, 2) - self.offset) / self.half_size
+        if self.clip:
+            np.clip(normalized, -1.0, 1.0, out=normalized)
+        return normalized
+
+    def normalized_to_warped(self, points):
+        return np.asarray(points, dtype=np.float64).reshape(-1, 2) * self.half_size + self.offset
+
+    # ===== 歸一化座標 <-> 世界座標 =====
+
+    def normalized_to_world(self, points):
+        return np.asarray(points, dtype=np.float64).reshape(-1, 2) * self.world_radius
+
+    def world_to_normalized(self, points):
+        return np.asarray(points, dtype=np.float64).reshape(-1, 2) / self.world_radius
+
+    # ===== 歸一化座標 <-> FlowMap 畫布座標 =====
+
+    def normalized_to_canvas(self, points, canvas_width, canvas_height):
+        """歸一化座標 -> 畫布像素座標 (整數，與 FlowMap 的映射相同)"""
+        normalized = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        return ((normalized + 1) / 2 * (canvas_width, canvas_height)).astype(np.int32)
+
+    def canvas_to_normalized(self, points, canvas_width, canvas_height):
+        return np.asarray(points, dtype=np.float64).reshape(-1, 2) / (canvas_width, canvas_height) * 2 - 1
+
+    # ===== 組合轉換 =====
+
+    def warped_to_world(self, points):
+        return self.normalized_to_world(self.warped_to_normalized(points))
+
+    def world_to_warped(self, points):
+        return self.normalized_to_warped(self.world_to_normalized(points))
+
+    def warped_to_canvas(self, points, canvas_width, canvas_height):
+        return self.normalized_to_canvas(self.warped_to_normalized(points), canvas_width, canvas_height)
+
+    def world_to_canvas(self, points, canvas_width, canvas_height):
+        return self.normalized_to_canvas(self.world_to_normalized(points), canvas_width, canvas_height)
+
+    def image_to_world(self, points):
+        return self.warped_to_world(self.image_to_warped(points))
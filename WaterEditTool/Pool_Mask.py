@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+
+class PoolMask:
+    """
+    FlowMap 畫布上的水池範圍遮罩
+    將畫布切分為 tile_size 大小的區塊，預先計算與水池重疊的區塊範圍：
+    逐像素運算(衰減、累積)只處理每一列區塊中與水池重疊的範圍，
+    鄰域運算(模糊)只處理水池的外接區塊範圍，水池外的像素固定為背景色
+    """
+
+    def __init__(self, mask, tile_size=64):
+        """
+        mask: (H, W) 畫布大小的遮罩，非0為水池內
+        tile_size: 區塊大小 (像素)
+        """
+        self.mask = np.where(np.asarray(mask) > 0, 255, 0).astype(np.uint8)
+        self.outside = cv2.bitwise_not(self.mask)
+        self.tile_size = tile_size
+        height, width = self.mask.shape
+
+        # 每一列區塊中與水池重疊的範圍 [(列切片, 行切片), ...]
+        self.tiles = []
+        for y0 in range(0, height, tile_size):
+            y1 = min(y0 + tile_size, height)
+            columns = np.flatnonzero(self.mask[y0:y1].any(axis=0))
+            if len(columns) == 0:
+                continue
+            x0 = columns[0] // tile_size * tile_size
+            x1 = min(width, -(-(columns[-1] + 1) // tile_size) * tile_size)
+            self.tiles.append((slice(y0, y1), slice(x0, x1)))
+
+        # 水池的外接區塊範圍
+        if self.tiles:
+            self.roi = (slice(self.tiles[0][0].start, self.tiles[-1][0].stop),
+                        slice(min(tile[1].start for tile in self.tiles), max(tile[1].stop for tile in self.tiles)))
+        else:
+            self.roi = (slice(0, 0), slice(0, 0))
+
+        # 需要處理的像素比例 (逐像素運算)
+        self.coverage = sum((tile[0].stop - tile[0].start) * (tile[1].stop - tile[1].start)
+                            for tile in self.tiles) / float(height * width)
+
+    def add_weighted(self, src1, alpha, src2, beta, dst):
+        """只在水池區塊範圍內計算 dst = src1 * alpha + src2 * beta (直接寫入 dst)"""
+        for tile in self.tiles:
+            cv2.addWeighted(src1[tile], alpha, src2[tile], beta, 0, dst=dst[tile])
+        return dst
+
+    def pin_outside(self, image, background):
+        """將水池外的像素設為背景 (background 為與 image 相同大小的背景影像，直接寫入 image)"""
+        cv2.copyTo(background, self.outside, image)
+        return image
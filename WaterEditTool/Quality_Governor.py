@@ -0,0 +1,115 @@
+class QualityGovernor:
+    """
+    自適應品質調整器
+    監看處理管線各階段的處理時間，當最慢的階段超出目標幀率的時間預算時，
+    在設定的範圍內逐級降低品質(畫布大小、模糊次數、取樣幀數、檢測解析度、射水筆刷密度)；
+    有足夠餘裕時再逐級恢復。每次調整皆會輸出記錄
+    """
+
+    # 品質等級設定(等級0為最高品質，與原始設定相同)
+    DEFAULT_LEVELS = [
+        {"canvas_scale": 1.0,  "blur_passes": 3, "sample_frames": 30, "detection_scale": 1.0,  "jet_brush_count": 100},
+        {"canvas_scale": 1.0,  "blur_passes": 2, "sample_frames": 24, "detection_scale": 1.0,  "jet_brush_count": 60},
+        {"canvas_scale": 0.75, "blur_passes": 2, "sample_frames": 20, "detection_scale": 0.75, "jet_brush_count": 50},
+        {"canvas_scale": 0.5,  "blur_passes": 1, "sample_frames": 15, "detection_scale": 0.5,  "jet_brush_count": 30},
+    ]
+
+    # 依處理時間調整品質的階段(品質設定能影響的運算階段)
+    # 擷取階段的時間主要是等待相機的下一幀(I/O)，降低品質無法縮短，不列入判斷
+    GOVERNED_STAGES = ("detect", "track", "output")
+
+    def __init__(self, tracker, target_fps=30.0, levels=None, min_level=0, max_level=None,
+                 degrade_frames=15, restore_frames=90, headroom=0.7, smoothing=0.1):
+        """
+        初始化品質調整器
+
+        參數:
+        tracker: ArUcoTracker (調整其 FlowMapGenerator、WaterJet 與檢測解析度)
+        target_fps: 目標幀率
+        levels: 品質等級設定列表 (None 使用 DEFAULT_LEVELS)
+        min_level / max_level: 允許調整的品質等級範圍
+        degrade_frames: 連續超出預算多少幀後降低品質
+        restore_frames: 連續低於 headroom * 預算多少幀後恢復品質
+        headroom: 恢復品質所需的時間餘裕比例
+        smoothing: 階段處理時間的指數移動平均係數
+        """
+        self.tracker = tracker
+        self.frame_budget = 1.0 / target_fps
+        self.levels = levels if levels is not None else self.DEFAULT_LEVELS
+        self.min_level = min_level
+        self.max_level = max_level if max_level is not None else len(self.levels) - 1
+        self.degrade_frames = degrade_frames
+        self.restore_frames = restore_frames
+        self.headroom = headroom
+        self.smoothing = smoothing
+
+        self.level = self.min_level
+        self.stage_averages = {}   # 各階段處理時間的移動平均 (秒)
+        self.over_budget_count = 0  # 連續超出預算的幀數
+        self.under_budget_count = 0  # 連續有餘裕的幀數
+
+        self.apply_level(self.level)
+
+    def observe(self, stage_times):
+        """
+        輸入最新一幀各階段的處理時間 (dict: 階段名稱 -> 秒)，必要時調整品質等級
+        只有 GOVERNED_STAGES 中的階段列入判斷；應在追蹤階段的幀與幀之間呼叫，避免在處理途中修改參數
+        """
+        for name, elapsed in stage_times.items():
+            if name not in self.GOVERNED_STAGES:
+                continue
+            previous = self.stage_averages.get(name, elapsed)
+            self.stage_averages[name] = previous + self.smoothing * (elapsed - previous)
+        if not self.stage_averages:
+            return
+
+        # 管線吞吐量受限於最慢的階段
+        slowest_stage = max(self.stage_averages, key=self.stage_averages.get)
+        slowest_time = self.stage_averages[slowest_stage]
+
+        if slowest_time > self.frame_budget:
+            self.over_budget_count += 1
+            self.under_budget_count = 0
+        elif slowest_time < self.frame_budget * self.headroom:
+            self.under_budget_count += 1
+            self.over_budget_count = 0
+        else:
+            self.over_budget_count = 0
+            self.under_budget_count = 0
+
+        if self.over_budget_count >= self.degrade_frames and self.level < self.max_level:
+            self.change_level(self.level + 1, "降低", slowest_stage, slowest_time)
+        elif self.under_budget_count >= self.restore_frames and self.level > self.min_level:
+            self.change_level(self.level - 1, "恢復", slowest_stage, slowest_time)
+
+    def change_level(self, level, action, slowest_stage, slowest_time):
+        """切換品質等級並輸出記錄"""
+        previous = self.levels[self.level]
+        self.level = level
+        self.apply_level(level)
+        self.over_budget_count = 0
+        self.under_budget_count = 0
+        self.stage_averages = {}  # 重新量測調整後的處理時間
+
+        changes = ", ".join(
+            f"{key}: {previous[key]} -> {value}"
+            for key, value in self.levels[level].items() if previous.get(key) != value
+        )
+        print(f"[品質調整] {action}品質至等級 {level} ({changes})，"
+              f"最慢階段 {slowest_stage}: {slowest_time * 1000:.1f} ms / 預算 {self.frame_budget * 1000:.1f} ms")
+
+    def apply_level(self, level):
+        """將品質等級設定套用到追蹤器"""
+        settings = self.levels[level]
+        flow_map_generator = self.tracker.flow_map_generator
+
+        if "canvas_scale" in settings:
+            flow_map_generator.set_canvas_scale(settings["canvas_scale"])
+        if "blur_passes" in settings:
+            flow_map_generator.blur_passes = settings["blur_passes"]
+        if "sample_frames" in settings:
+            flow_map_generator.sample_frames = settings["sample_frames"]
+        if "detection_scale" in settings:
+            self.tracker.detection_scale = settings["detection_scale"]
+        if "jet_brush_count" in settings:
+            self.tracker.water_jet.jet_length_pixels = settings["jet_brush_count"]
@@ -0,0 +1,276 @@
+import argparse
+import json
+import os
+import time
+import cv2
+import numpy as np
+
+# 每幀一筆的幀記錄 (第 i 筆對應影片的第 i 幀)
+FRAME_DTYPE = np.dtype([
+    ("seq", "<u4"),                # 管線中的幀序號
+    ("capture_time", "<f8"),       # 擷取時間 (time.perf_counter，只用於計算幀之間的時間差)
+    ("first_detection", "<u4"),    # 此幀第一筆檢測記錄的索引
+    ("detection_count", "<u2"),    # 此幀的檢測記錄數量
+])
+
+# 每個檢測到的 Marker 一筆的檢測記錄 (角點位於透視變換後的座標系統，與 ArUcoTracker.detect_markers 相同)
+DETECTION_DTYPE = np.dtype([
+    ("seq", "<u4"),
+    ("marker_id", "<i2"),
+    ("corners", "<f4", (4, 2)),
+])
+
+SESSION_FILE = "session.json"
+FRAMES_FILE = "frames.bin"
+DETECTIONS_FILE = "detections.bin"
+
+def open_record_file(path, dtype):
+    """以唯讀 np.memmap 開啟記錄檔 (空檔案回傳長度為0的陣列)"""
+    if not os.path.exists(path) or os.path.getsize(path) < dtype.itemsize:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(os.path.getsize(path) // dtype.itemsize,))
+
+class SessionRecorder:
+    """
+    追蹤工作階段錄製
+    將原始相機影像寫入影片檔，校準資訊與射水向量寫入 session.json，
+    每幀的檢測結果以固定長度的二進位記錄附加寫入(可直接以 np.memmap 讀取)，
+    追蹤途中的透視變換校正(HomographyDriftCorrector)以生效的幀索引與矩陣寫入 session.json 的 transform_updates，
+    供事後離線重播、除錯與重新調整參數
+    """
+
+    def __init__(self, session_dir, fps=30.0, fourcc="MJPG", video_name="video.avi"):
+        """
+        session_dir: 工作階段資料夾
+        fps: 影片幀率
+        fourcc: 影片編碼 (MJPG 編碼快速且畫質損失小，適合在追蹤途中即時錄製)
+        """
+        self.session_dir = session_dir
+        self.fps = fps
+        self.fourcc = fourcc
+        self.video_name = video_name
+        self.video_writer = None   # 收到第一幀時依影像大小建立
+        self.frames_file = None
+        self.detections_file = None
+        self.session = None
+        self.frame_count = 0
+        self.detection_count = 0
+        self.transform_matrix = None  # 最近寫入的幀檢測時使用的透視變換矩陣
+
+    def start(self, pool_detector, water_jet_vectors):
+        """建立工作階段資料夾並寫入校準資訊"""
+        os.makedirs(self.session_dir, exist_ok=True)
+        self.session = {
+            "version": 1,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "fps": self.fps,
+            "frame_size": None,
+            "frame_count": 0,
+            "video": self.video_name,
+            "frames": FRAMES_FILE,
+            "detections": DETECTIONS_FILE,
+            "pool": pool_detector.to_profile(),
+            "water_jet_vectors": [[int(v) for v in vector] for vector in water_jet_vectors],
+            "transform_updates": [],  # [{"frame": 生效的幀索引, "transform_matrix": 3x3}, ...]
+        }
+        self.transform_matrix = pool_detector.transform_matrix
+        self.write_session()
+        self.frames_file = open(os.path.join(self.session_dir, FRAMES_FILE), "wb")
+        self.detections_file = open(os.path.join(self.session_dir, DETECTIONS_FILE), "wb")
+        print(f"[工作階段錄製] 開始錄製: {self.session_dir}")
+
+    def write_session(self):
+        with open(os.path.join(self.session_dir, SESSION_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.session, f, indent=2)
+
+    def write_frame(self, seq, capture_time, frame, corners, ids_list, transform_matrix=None):
+        """
+        寫入一幀原始影像與其檢測結果
+        corners / ids_list: ArUcoTracker.detect_markers 的輸出
+        transform_matrix: 檢測此幀時使用的透視變換矩陣 (與前一幀不同時記錄為透視變換校正)
+        """
+        if transform_matrix is not None and not np.array_equal(transform_matrix, self.transform_matrix):
+            self.transform_matrix = transform_matrix
+            self.session["transform_updates"].append({
+                "frame": self.frame_count,
+                "transform_matrix": np.asarray(transform_matrix).tolist(),
+            })
+            self.write_session()
+            print(f"[工作階段錄製] 第 {self.frame_count} 幀起使用校正後的透視變換")
+        if self.video_writer is None:
+            height, width = frame.shape[:2]
+            self.video_writer = cv2.VideoWriter(
+                os.path.join(self.session_dir, self.video_name),
+                cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height)
+            )
+            self.session["frame_size"] = [width, height]
+        self.video_writer.write(frame)
+
+        count = len(ids_list) if ids_list else 0
+        if count:
+            detections = np.zeros(count, dtype=DETECTION_DTYPE)
+            detections["seq"] = seq
+            detections["marker_id"] = [int(np.ravel(marker_id)[0]) for marker_id in ids_list]
+            detections["corners"] = np.asarray(corners, dtype=np.float32).reshape(count, 4, 2)
+            self.detections_file.write(detections.tobytes())
+
+        record = np.array([(seq, capture_time, self.detection_count, count)], dtype=FRAME_DTYPE)
+        self.frames_file.write(record.tobytes())
+        self.frame_count += 1
+        self.detection_count += count
+
+    def close(self):
+        """結束錄製 (寫入幀數並關閉所有檔案)"""
+        if self.session is None:
+            return
+        if self.video_writer is not None:
+            self.video_writer.release()
+            self.video_writer = None
+        for record_file in (self.frames_file, self.detections_file):
+            if record_file is not None:
+                record_file.close()
+        self.session["frame_count"] = self.frame_count
+        self.write_session()
+        print(f"[工作階段錄製] 結束錄製: {self.frame_count} 幀，{self.detection_count} 筆檢測記錄")
+        self.session = None
+
+class SessionReplay:
+    """
+    工作階段重播
+    具有與 cv2.VideoCapture 相同的 read() 介面，可取代相機傳入 run_tracking / FramePipeline；
+    last_capture_time 為錄製時的擷取時間(管線以此計算卡爾曼濾波的時間步長，
+    因此不論重播速度多快，追蹤結果皆與即時處理時相同)；
+    last_transform_matrix 為錄製時檢測該幀使用的透視變換矩陣(管線在檢測前套用，重現追蹤途中的透視變換校正)
+    """
+
+    def __init__(self, session_dir, load_video=True):
+        """
+        session_dir: 工作階段資料夾
+        load_video: 是否開啟影片 (只使用檢測記錄的離線處理可設為 False)
+        """
+        self.session_dir = session_dir
+        with open(os.path.join(session_dir, SESSION_FILE), "r", encoding="utf-8") as f:
+            self.session = json.load(f)
+
+        self.frames = open_record_file(os.path.join(session_dir, self.session["frames"]), FRAME_DTYPE)
+        self.detection_records = open_record_file(os.path.join(session_dir, self.session["detections"]), DETECTION_DTYPE)
+        self.video = cv2.VideoCapture(os.path.join(session_dir, self.session["video"])) if load_video else None
+
+        # 錄製時的透視變換: 開始時的校準結果，以及追蹤途中的校正 [(生效的幀索引, 矩陣), ...]
+        initial_matrix = self.session["pool"]["transform_matrix"]
+        self.initial_transform = np.array(initial_matrix, dtype=np.float64) if initial_matrix is not None else None
+        self.transform_updates = [(int(update["frame"]), np.array(update["transform_matrix"], dtype=np.float64))
+                                  for update in self.session.get("transform_updates", [])]
+
+        self.index = 0                 # 下一幀的索引
+        self.last_capture_time = None  # 最近讀取幀的錄製擷取時間
+        self.last_transform_matrix = None  # 錄製時檢測最近讀取幀所使用的透視變換矩陣
+        self.finished = False          # 是否已重播至結尾
+
+    @property
+    def water_jet_vectors(self):
+        return [tuple(vector) for vector in self.session["water_jet_vectors"]]
+
+    def create_pool_detector(self):
+        """依錄製時的校準資訊建立 PoolDetector"""
+        from ArUco_to_FlowMap import PoolDetector
+        profile = self.session["pool"]
+        pool_detector = PoolDetector(profile["fixed_marker_ids"], world_radius=profile["world_radius"],
+                                     pool_shape=profile["pool_shape"])
+        pool_detector.load_profile(profile)
+        return pool_detector
+
+    def frame_count(self):
+        return len(self.frames)
+
+    def transform_matrix(self, index):
+        """錄製時檢測第 index 幀所使用的透視變換矩陣 (同一段期間回傳同一個陣列物件)"""
+        matrix = self.initial_transform
+        for frame, update in self.transform_updates:
+            if frame > index:
+                break
+            matrix = update
+        return matrix
+
+    def read(self):
+        if self.index >= len(self.frames):
+            self.finished = True
+            return False, None
+        ret, frame = self.video.read()
+        if not ret:
+            self.finished = True
+            return False, None
+        self.last_capture_time = float(self.frames[self.index]["capture_time"])
+        self.last_transform_matrix = self.transform_matrix(self.index)
+        self.index += 1
+        return True, frame
+
+    def detections(self, index):
+        """
+        取得第 index 幀錄製時的檢測結果 (格式與 ArUcoTracker.detect_markers 的 corners, ids_list 相同)
+        角點陣列直接引用記憶體映射的資料，不複製
+        """
+        record = self.frames[index]
+        start = int(record["first_detection"])
+        records = self.detection_records[start:start + int(record["detection_count"])]
+        corners = [records["corners"][i].reshape(1, 4, 2) for i in range(len(records))]
+        ids_list = [[int(marker_id)] for marker_id in records["marker_id"]]
+        return corners, ids_list
+
+    def isOpened(self):
+        return self.video is not None and self.video.isOpened()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH and self.session["frame_size"]:
+            return float(self.session["frame_size"][0])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT and self.session["frame_size"]:
+            return float(self.session["frame_size"][1])
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.session["fps"])
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(len(self.frames))
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.index)
+        return 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        if self.video is not None:
+            self.video.release()
+
+def replay_session(session_dir, realtime=False):
+    """以無UI的處理管線重播工作階段 (realtime 為 False 時盡可能快速處理)，回傳追蹤器"""
+    from ArUco_to_FlowMap import ArUcoTracker, run_tracking
+
+    replay = SessionReplay(session_dir)
+    tracker = ArUcoTracker(replay.create_pool_detector())
+    if replay.water_jet_vectors:
+        tracker.update_water_jet_vectors(replay.water_jet_vectors)
+
+    start_time = time.perf_counter()
+    run_tracking(None, replay, tracker, target_fps=replay.session["fps"] if realtime else None)
+    elapsed = time.perf_counter() - start_time
+
+    processed = tracker.flow_map_generator.current_frame
+    print(f"[工作階段重播] 處理 {processed}/{replay.frame_count()} 幀，耗時 {elapsed:.2f} 秒 "
+          f"({processed / max(elapsed, 1e-9):.1f} FPS)")
+    replay.release()
+    return tracker
+
+def main():
+    """重播錄製的工作階段 (命令列工具)"""
+    parser = argparse.ArgumentParser(description="重播錄製的追蹤工作階段")
+    parser.add_argument("session_dir", help="工作階段資料夾")
+    parser.add_argument("--realtime", action="store_true", help="依錄製時的幀率重播 (預設盡可能快速處理)")
+    parser.add_argument("--output", default=None, help="將最終累積的 FlowMap 儲存為圖片")
+    args = parser.parse_args()
+
+    tracker = replay_session(args.session_dir, args.realtime)
+    if args.output:
+        cv2.imwrite(args.output, tracker.flow_map_generator.accumulated_flowmap)
+        print(f"已儲存 FlowMap: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import queue
+import threading
+import cv2
+import numpy as np
+from Performance_Metrics import metrics
+
+class SnapshotEntry:
+    """一次編碼的結果 (同一幀、同一設定的並行請求等待同一次編碼)"""
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.data = None
+
+class SnapshotService:
+    """
+    Client 請求的即時畫面快照 (命令1: 原始Frame，命令6: 透視變換後的Frame)
+    擷取/檢測階段只記錄最新影像的參考(不複製、不編碼)，收到請求時才依 Client 選擇的解析度與品質(命令9)編碼；
+    編碼結果依 (影像種類, 快照序號, 寬度, 品質) 快取，同一幀的並行請求只編碼一次，新的一幀發布時清除舊的快取
+    """
+
+    KINDS = ("raw", "warped")
+
+    def __init__(self, server=None, default_quality=90):
+        """
+        server: FlowMapServer (可為 None，只使用 get)；設定後由此服務回應命令1/6
+        default_quality: Client 未指定時的 JPEG 品質
+        """
+        self.server = server
+        self.default_quality = default_quality
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.latest = {}   # 影像種類 -> (快照序號, 影像)
+        self.versions = {kind: 0 for kind in self.KINDS}
+        self.cache = {}    # (影像種類, 快照序號, 寬度, 品質) -> SnapshotEntry
+        self.requests = queue.Queue()
+        self.thread = None
+        if server is not None:
+            server.snapshot_service = self
+
+    def start(self):
+        """啟動回應 Client 請求的執行緒"""
+        self.thread = threading.Thread(target=self.run, name="snapshot", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.requests.put(None)
+
+    def publish(self, kind, frame):
+        """
+        [擷取/檢測階段] 記錄最新的影像 (只保存參考，呼叫端之後不可修改此影像)
+        frame 也可為延遲轉換的彩色影像 (ColorFrame / WarpedColorFrame)，Client 請求時才轉換
+        """
+        if not isinstance(frame, np.ndarray) and not hasattr(frame, "bgr"):
+            return  # 例如多相機模式的擷取結果不是單一影像
+        with self.lock:
+            self.versions[kind] += 1
+            version = self.versions[kind]
+            self.latest[kind] = (version, frame)
+            if self.cache:
+                self.cache = {key: entry for key, entry in self.cache.items() if key[0] != kind or key[1] == version}
+
+    def get(self, kind, max_width=0, quality=0):
+        """
+        取得最新影像的 JPEG bytes (尚未有影像時回傳 None)
+        max_width: 最大寬度 (0 表示原始解析度)；quality: JPEG 品質 (0 表示預設)
+        """
+        quality = quality or self.default_quality
+        with self.lock:
+            latest = self.latest.get(kind)
+            if latest is None:
+                return None
+            version, frame = latest
+            key = (kind, version, max_width, quality)
+            entry = self.cache.get(key)
+            owner = entry is None
+            if owner:
+                entry = self.cache[key] = SnapshotEntry()
+
+        if not owner:
+            entry.ready.wait()
+            self.metrics.increment("snapshot.cache_hits")
+            return entry.data
+        try:
+            with self.metrics.timer(f"snapshot.encode.{kind}"):
+                if not isinstance(frame, np.ndarray):
+                    frame = frame.bgr()
+                entry.data = self.encode(frame, max_width, quality)
+        finally:
+            entry.ready.set()
+        return entry.data
+
+    def encode(self, frame, max_width, quality):
+        height, width = frame.shape[:2]
+        if max_width and width > max_width:
+            frame = cv2.resize(frame, (max_width, max(1, round(height * max_width / width))), interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+        return encoded.tobytes() if ok else None
+
+    def request(self, kind):
+        """[命令執行緒] Client 請求快照 (在服務執行緒中編碼與傳送)"""
+        self.requests.put(kind)
+
+    def run(self):
+        while True:
+            kind = self.requests.get()
+            if kind is None:
+                break
+            try:
+                max_width, quality = self.server.get_snapshot_settings()
+                data = self.get(kind, max_width, quality)
+                if data is None:
+                    print(f"[快照] 尚未有{'透視變換後的' if kind == 'warped' else '串流影片的'}Frame可傳送")
+                    continue
+                if kind == "raw":
+                    self.server.send_video_frame_to_client(data)
+                else:
+                    self.server.send_transformed_frame(data)
+            except Exception as e:
+                print(f"[快照] 傳送快照時發生錯誤: {e}")
@@ -0,0 +1,616 @@
+import argparse
+import json
+import os
+import cv2
+import cv2.aruco as aruco
+import numpy as np
+
+# ===== 流場 =====
+# 流場函式輸入水池歸一化座標 (x, y 介於 -1~1 的 numpy 陣列) 與時間 t (秒)，
+# 回傳歸一化速度 (vx, vy)，速度大小約為 1，實際速度由 SyntheticPoolScene.flow_speed 縮放
+
+def vortex_flow(x, y, t):
+    """繞水池中心旋轉的渦流(靠近池壁處減弱)"""
+    falloff = np.clip(1.2 - np.sqrt(x * x + y * y), 0.0, 1.0)
+    return -y * falloff * 1.5, x * falloff * 1.5
+
+def uniform_flow(x, y, t):
+    """固定方向的均勻流 (方向隨時間緩慢改變)"""
+    angle = 0.1 * t
+    return np.full_like(x, np.cos(angle)), np.full_like(y, np.sin(angle))
+
+def double_gyre_flow(x, y, t):
+    """左右兩個反向旋轉的環流 (週期性擺動的雙環流)"""
+    epsilon = 0.25 * np.sin(0.4 * t)
+    s = (x + 1.0) / 2.0  # 0~1
+    f = epsilon * s * s + (1.0 - 2.0 * epsilon) * s
+    df = 2.0 * epsilon * s + (1.0 - 2.0 * epsilon)
+    vx = -np.pi * np.sin(np.pi * f) * np.cos(np.pi * (y + 1.0) / 2.0)
+    vy = np.pi * np.cos(np.pi * f) * np.sin(np.pi * (y + 1.0) / 2.0) * df
+    return vx * 0.5, vy * 0.5
+
+def jets_flow(x, y, t, jet_count=6):
+    """沿池壁平均分布的射水口朝水池中心射水(與射水向量的配置相同)"""
+    vx = np.zeros_like(x)
+    vy = np.zeros_like(y)
+    for angle in np.linspace(0, 2 * np.pi, jet_count, endpoint=False):
+        start_x, start_y = np.cos(angle), np.sin(angle)
+        dir_x, dir_y = -start_x, -start_y
+        # 沿射水方向的距離與垂直距離
+        along = (x - start_x) * dir_x + (y - start_y) * dir_y
+        across = (x - start_x) * dir_y - (y - start_y) * dir_x
+        strength = np.exp(-(across / 0.25) ** 2) * np.clip(1.0 - along / 1.5, 0.0, 1.0) * (along > -0.1)
+        vx += dir_x * strength
+        vy += dir_y * strength
+    return vx, vy
+
+FLOW_FIELDS = {
+    "vortex": vortex_flow,
+    "uniform": uniform_flow,
+    "double_gyre": double_gyre_flow,
+    "jets": jets_flow,
+}
+
+def camera_homography(frame_size, extent, fill=0.85, tilt=0.1, rotation_deg=0.0, offset=(0, 0)):
+    """
+    建立模擬相機的單應性矩陣 (水池平面座標(公尺，原點為水池中心) -> 影像像素座標)
+
+    參數:
+    frame_size: 影像大小 (寬, 高)
+    extent: 需要完整入鏡的平面範圍 (半寬, 半高)，單位公尺
+    fill: 平面範圍佔影像的比例
+    tilt: 相機俯角造成的梯形程度 (遠端/上緣縮短的比例)
+    rotation_deg: 影像平面上的旋轉角度
+    offset: 影像平面上的平移 (像素)
+    """
+    frame_width, frame_height = frame_size
+    half_x, half_y = extent
+
+    # 依平面長寬比決定入鏡大小
+    height = fill * frame_height
+    width = height * half_x / half_y
+    if width > fill * frame_width:
+        width = fill * frame_width
+        height = width * half_y / half_x
+
+    top_inset = tilt * width / 2  # 上緣(遠端)縮短
+    target = np.array([
+        [-width / 2 + top_inset, -height / 2],
+        [width / 2 - top_inset, -height / 2],
+        [width / 2, height / 2],
+        [-width / 2, height / 2],
+    ], dtype=np.float64)
+
+    angle = np.radians(rotation_deg)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    target = target @ rotation.T + [frame_width / 2 + offset[0], frame_height / 2 + offset[1]]
+
+    source = np.array([[-half_x, -half_y], [half_x, -half_y], [half_x, half_y], [-half_x, half_y]], dtype=np.float32)
+    return cv2.getPerspectiveTransform(source, target.astype(np.float32))
+
+class SyntheticPoolScene:
+    """
+    合成水池場景產生器
+    在可設定的相機單應性下繪製圓形/矩形水池、池邊的固定 Marker 與隨流場移動的浮動 DICT_4X4_50 Marker，
+    並加入感測器雜訊、模糊與遮擋；每一幀同時輸出真實軌跡(ground truth)，
+    可在無相機的 Linux 主機上進行可重現的吞吐量與準確度測試
+    """
+
+    def __init__(self, frame_size=(1280, 720), pool_shape="circle", pool_aspect=1.6,
+                 fixed_marker_ids=(11, 12, 13, 14, 16, 17), num_markers=5, marker_ids=None,
+                 world_radius=2.5, marker_size=0.4, flow="vortex", flow_speed=0.15, fps=30.0,
+                 homography=None, tilt=0.1, rotation_deg=0.0, noise_sigma=3.0, blur_sigma=0.0,
+                 motion_blur=True, occlusion_rate=0.0, position_noise=0.0, seed=0):
+        """
+        初始化合成水池場景
+
+        參數:
+        frame_size: 輸出影像大小 (寬, 高)
+        pool_shape: 水池形狀 ("circle" 或 "rectangle")
+        pool_aspect: 矩形水池的寬高比
+        fixed_marker_ids: 池邊固定 Marker ID
+        num_markers: 浮動 Marker 數量 (marker_ids 未指定時使用)
+        marker_ids: 浮動 Marker ID 列表
+        world_radius: 世界水池半徑 (公尺，與 PoolDetector 相同)
+        marker_size: Marker 邊長 (公尺，不含白色邊框)
+        flow: 流場 (FLOW_FIELDS 中的名稱、函式 f(x, y, t) -> (vx, vy)，
+              或依時間切換的腳本 [(開始秒數, 流場), ...])
+        flow_speed: 流速 (每秒移動的歸一化距離)
+        fps: 幀率 (決定每幀的時間步長)
+        homography: 水池平面(公尺) -> 影像的單應性矩陣 (None 時依 tilt/rotation_deg 產生)
+        tilt / rotation_deg: 產生單應性矩陣時的相機俯角梯形程度與旋轉角度
+        noise_sigma: 感測器雜訊標準差 (灰階值)
+        blur_sigma: 全畫面高斯模糊 (失焦) 的標準差，0 表示不模糊
+        motion_blur: 是否依 Marker 移動速度加入動態模糊
+        occlusion_rate: 每個 Marker 每幀開始被遮擋的機率
+        position_noise: Marker 位置的隨機擾動 (每秒的歸一化距離標準差)
+        seed: 亂數種子 (相同設定與種子產生完全相同的影像)
+        """
+        self.frame_width, self.frame_height = frame_size
+        self.pool_shape = pool_shape
+        self.world_radius = world_radius
+        self.marker_size = marker_size
+        self.flow = flow
+        self.flow_speed = flow_speed
+        self.fps = fps
+        self.dt = 1.0 / fps
+        self.noise_sigma = noise_sigma
+        self.blur_sigma = blur_sigma
+        self.motion_blur = motion_blur
+        self.occlusion_rate = occlusion_rate
+        self.position_noise = position_noise
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+
+        # 歸一化座標 -> 水池平面座標(公尺)的縮放
+        if pool_shape == "rectangle":
+            self.pool_half_size = np.array([world_radius * pool_aspect, world_radius])
+        else:
+            self.pool_half_size = np.array([world_radius, world_radius])
+
+        if homography is None:
+            homography = camera_homography(frame_size, self.pool_half_size * 1.25, tilt=tilt, rotation_deg=rotation_deg)
+        self.homography = np.asarray(homography, dtype=np.float64)
+
+        self.aruco_dict = aruco.getPredefinedDictionary(aruco.DICT_4X4_50)
+        self.fixed_marker_ids = list(fixed_marker_ids)
+        if marker_ids is None:
+            marker_ids = [i for i in range(50) if i not in self.fixed_marker_ids][:num_markers]
+        self.marker_ids = list(marker_ids)
+        self.marker_images = {}  # Marker ID -> 含白色邊框的 Marker 影像
+
+        # 浮動 Marker 狀態 (歸一化座標)
+        count = len(self.marker_ids)
+        self.positions = self.initial_positions(count)
+        self.angles = self.rng.uniform(-np.pi, np.pi, count)
+        self.velocities = np.zeros((count, 2))
+        self.respawned = np.zeros(count, dtype=bool)
+        self.occlusion_frames = np.zeros(count, dtype=int)  # 剩餘的遮擋幀數
+        self.occlusion_offsets = np.zeros((count, 2))       # 遮擋物相對 Marker 中心的位置
+
+        self.frame_index = 0
+        self.time = 0.0
+
+        self.background = self.render_background()
+        self.noise_bank = self.create_noise_bank()
+
+    # ===== 座標轉換 =====
+
+    def norm_to_plane(self, points):
+        """歸一化座標 -> 水池平面座標 (公尺)"""
+        return np.asarray(points, dtype=np.float64).reshape(-1, 2) * self.pool_half_size
+
+    def plane_to_image(self, points):
+        """水池平面座標 (公尺) -> 影像像素座標 (批次轉換)"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        return cv2.perspectiveTransform(points, self.homography).reshape(-1, 2)
+
+    def norm_to_image(self, points):
+        """歸一化座標 -> 影像像素座標"""
+        return self.plane_to_image(self.norm_to_plane(points))
+
+    def inside_pool(self, points, margin=0.85):
+        """判斷歸一化座標是否位於水池內(保留 Marker 不碰到池壁的邊距)"""
+        points = np.asarray(points).reshape(-1, 2)
+        if self.pool_shape == "rectangle":
+            return np.all(np.abs(points) <= margin, axis=1)
+        return np.hypot(points[:, 0], points[:, 1]) <= margin
+
+    def rim_points(self, count):
+        """沿池壁平均取樣的歸一化座標"""
+        angles = np.linspace(0, 2 * np.pi, count, endpoint=False)
+        if self.pool_shape == "rectangle":
+            # 將單位圓上的點投影到正方形邊界
+            directions = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+            return directions / np.max(np.abs(directions), axis=1, keepdims=True)
+        return np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+    # ===== 校準資訊 =====
+
+    def client_points(self):
+        """
+        模擬Client標註的4個透視變換參考點 (影像像素座標)
+        圓形水池為池壁的上、右、下、左四點；矩形水池為四個角
+        """
+        if self.pool_shape == "rectangle":
+            corners = [(-1, -1), (1, -1), (1, 1), (-1, 1)]
+        else:
+            corners = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+        return [tuple(float(v) for v in point) for point in self.norm_to_image(corners)]
+
+    def water_jet_vectors(self, pool_detector=None, count=6):
+        """
+        沿池壁平均分布、指向水池中心的射水向量 [(start_x, start_y, end_x, end_y), ...]
+        指定 pool_detector 時回傳透視變換後畫面中的座標，否則為原始影像座標
+        """
+        starts = self.norm_to_image(self.rim_points(count))
+        center = self.norm_to_image([(0, 0)])
+        if pool_detector is not None:
+            starts = pool_detector.image_points_to_warped(starts)
+            center = pool_detector.image_points_to_warped(center)
+        end_x, end_y = center[0]
+        return [(int(x), int(y), int(end_x), int(end_y)) for x, y in starts]
+
+    def calibrate_pool_detector(self, pool_detector):
+        """
+        使用場景的參考點與射水向量完成 PoolDetector 的透視變換與水池參數校準
+        回傳: 射水向量列表 (可傳入 ArUcoTracker.update_water_jet_vectors)，失敗時回傳 None
+        """
+        frame = self.background
+        if not pool_detector.setup_perspective_transform_with_client_points(frame, self.client_points()):
+            return None
+        water_jet_vectors = self.water_jet_vectors(pool_detector)
+        pool_detector.calibrate_pool_with_water_jets(water_jet_vectors)
+        return water_jet_vectors
+
+    def describe(self):
+        """場景設定 (寫入 ground truth 檔案)"""
+        return {
+            "frame_size": [self.frame_width, self.frame_height],
+            "fps": self.fps,
+            "pool_shape": self.pool_shape,
+            "pool_half_size": self.pool_half_size.tolist(),
+            "world_radius": self.world_radius,
+            "marker_size": self.marker_size,
+            "fixed_marker_ids": self.fixed_marker_ids,
+            "marker_ids": self.marker_ids,
+            "flow": self.flow if isinstance(self.flow, str) else repr(self.flow),
+            "flow_speed": self.flow_speed,
+            "noise_sigma": self.noise_sigma,
+            "blur_sigma": self.blur_sigma,
+            "motion_blur": self.motion_blur,
+            "occlusion_rate": self.occlusion_rate,
+            "seed": self.seed,
+            "homography": self.homography.tolist(),
+            "client_points": [list(point) for point in self.client_points()],
+            "water_jet_vectors": self.water_jet_vectors(),
+        }
+
+    # ===== Marker 運動 =====
+
+    def initial_positions(self, count, min_distance=0.3):
+        """在水池內隨機放置 Marker (盡量保持間距)"""
+        positions = []
+        for _ in range(count):
+            for _ in range(100):
+                candidate = self.rng.uniform(-0.7, 0.7, 2)
+                if not self.inside_pool(candidate, 0.7)[0]:
+                    continue
+                if all(np.hypot(*(candidate - p)) >= min_distance for p in positions):
+                    break
+            positions.append(candidate)
+        return np.array(positions, dtype=np.float64).reshape(-1, 2)
+
+    def flow_function(self, t):
+        """取得時間 t 使用的流場函式"""
+        flow = self.flow
+        if isinstance(flow, (list, tuple)):
+            # 流場腳本: 使用最後一個開始時間 <= t 的流場
+            active = flow[0][1]
+            for start_time, segment_flow in flow:
+                if t >= start_time:
+                    active = segment_flow
+            flow = active
+        return FLOW_FIELDS[flow] if isinstance(flow, str) else flow
+
+    def flow_velocity(self, points, t):
+        """計算歸一化座標上的流速 (每秒的歸一化距離)"""
+        flow = self.flow_function(t)
+        vx, vy = flow(points[:, 0], points[:, 1], t)
+        return np.stack([vx, vy], axis=1) * self.flow_speed
+
+    def step(self):
+        """依流場推進一個時間步長 (二階 Runge-Kutta)"""
+        if len(self.marker_ids) == 0:
+            self.frame_index += 1
+            self.time += self.dt
+            return
+
+        dt, t = self.dt, self.time
+        k1 = self.flow_velocity(self.positions, t)
+        midpoint = self.positions + k1 * dt / 2
+        k2 = self.flow_velocity(midpoint, t + dt / 2)
+        new_positions = self.positions + k2 * dt
+        if self.position_noise:
+            new_positions += self.rng.normal(0.0, self.position_noise * np.sqrt(dt), new_positions.shape)
+
+        # 旋轉速度為流場渦度的一半 (以中央差分計算)
+        eps = 1e-3
+        dvy_dx = (self.flow_velocity(midpoint + [eps, 0], t)[:, 1] - self.flow_velocity(midpoint - [eps, 0], t)[:, 1]) / (2 * eps)
+        dvx_dy = (self.flow_velocity(midpoint + [0, eps], t)[:, 0] - self.flow_velocity(midpoint - [0, eps], t)[:, 0]) / (2 * eps)
+        self.angles = (self.angles + 0.5 * (dvy_dx - dvx_dy) * dt + np.pi) % (2 * np.pi) - np.pi
+
+        # 離開水池的 Marker 從水池另一側重新出現
+        outside = ~self.inside_pool(new_positions)
+        self.respawned = outside
+        if np.any(outside):
+            new_positions[outside] = -self.positions[outside] * 0.8
+
+        self.velocities = (new_positions - self.positions) / dt
+        self.velocities[outside] = k2[outside]
+        self.positions = new_positions
+
+        # 遮擋: 隨機開始一段持續數幀的遮擋
+        self.occlusion_frames = np.maximum(self.occlusion_frames - 1, 0)
+        if self.occlusion_rate:
+            starting = (self.occlusion_frames == 0) & (self.rng.random(len(self.marker_ids)) < self.occlusion_rate)
+            self.occlusion_frames[starting] = self.rng.integers(3, 16, int(np.sum(starting)))
+            self.occlusion_offsets[starting] = self.rng.uniform(-0.5, 0.5, (int(np.sum(starting)), 2))
+
+        self.frame_index += 1
+        self.time += dt
+
+    # ===== 繪製 =====
+
+    def get_marker_image(self, marker_id, pixels=64):
+        """產生含白色邊框(quiet zone)的 Marker 影像 (BGR)"""
+        if marker_id not in self.marker_images:
+            marker = aruco.generateImageMarker(self.aruco_dict, marker_id, pixels)
+            border = pixels // 4
+            marker = cv2.copyMakeBorder(marker, border, border, border, border, cv2.BORDER_CONSTANT, value=255)
+            self.marker_images[marker_id] = cv2.cvtColor(marker, cv2.COLOR_GRAY2BGR)
+        return self.marker_images[marker_id]
+
+    def marker_quad(self, position, angle):
+        """Marker(含白色邊框)四個角在影像中的座標 (左上、右上、右下、左下)"""
+        half = self.marker_size * 0.75  # 邊框寬度為 Marker 邊長的 1/4
+        local = np.array([[-half, -half], [half, -half], [half, half], [-half, half]])
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        plane_corners = local @ rotation.T + self.norm_to_plane(position)[0]
+        return self.plane_to_image(plane_corners)
+
+    def draw_marker(self, frame, marker_id, position, angle, motion=None):
+        """將 Marker 以透視變換貼到影像上 (只處理 Marker 所在的區域)"""
+        quad = self.marker_quad(position, angle)
+        x0, y0 = np.floor(quad.min(axis=0)).astype(int) - 2
+        x1, y1 = np.ceil(quad.max(axis=0)).astype(int) + 2
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.frame_width), min(y1, self.frame_height)
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        marker_image = self.get_marker_image(marker_id)
+        size = marker_image.shape[0]
+        source = np.array([[0, 0], [size, 0], [size, size], [0, size]], dtype=np.float32)
+        matrix = cv2.getPerspectiveTransform(source, (quad - [x0, y0]).astype(np.float32))
+        roi_size = (x1 - x0, y1 - y0)
+        patch = cv2.warpPerspective(marker_image, matrix, roi_size, flags=cv2.INTER_LINEAR)
+        alpha = cv2.warpPerspective(np.ones((size, size), np.float32), matrix, roi_size, flags=cv2.INTER_LINEAR)
+
+        roi = frame[y0:y1, x0:x1]
+        alpha = alpha[..., None]
+        roi[:] = (roi * (1.0 - alpha) + patch * alpha).astype(np.uint8)
+
+        # 動態模糊: 沿 Marker 在影像中的移動方向模糊 (曝光時間約為半幀)
+        if motion is not None:
+            dx, dy = motion * 0.5
+            length = int(round(np.hypot(dx, dy)))
+            if length >= 2:
+                kernel = np.zeros((length * 2 + 1, length * 2 + 1), np.float32)
+                cv2.line(kernel, (int(length - dx / 2), int(length - dy / 2)),
+                         (int(length + dx / 2), int(length + dy / 2)), 1.0, 1)
+                kernel /= kernel.sum()
+                pad = length
+                bx0, by0 = max(x0 - pad, 0), max(y0 - pad, 0)
+                bx1, by1 = min(x1 + pad, self.frame_width), min(y1 + pad, self.frame_height)
+                region = frame[by0:by1, bx0:bx1]
+                region[:] = cv2.filter2D(region, -1, kernel)
+
+    def render_background(self):
+        """繪製靜態背景 (池邊、水面與固定 Marker)"""
+        frame = np.full((self.frame_height, self.frame_width, 3), (165, 170, 172), np.uint8)
+
+        # 水面 (以低頻紋理模擬水面的明暗變化)
+        outline = self.norm_to_image(self.rim_points(180)).astype(np.int32)
+        pool_mask = np.zeros((self.frame_height, self.frame_width), np.uint8)
+        cv2.fillPoly(pool_mask, [outline], 255)
+        texture = cv2.resize(self.rng.uniform(-12, 12, (9, 16)).astype(np.float32),
+                             (self.frame_width, self.frame_height), interpolation=cv2.INTER_CUBIC)
+        water = np.clip(np.array([120, 105, 60], np.float32) + texture[..., None], 0, 255).astype(np.uint8)
+        frame[pool_mask > 0] = water[pool_mask > 0]
+        cv2.polylines(frame, [outline], True, (215, 215, 210), 3, cv2.LINE_AA)
+
+        # 固定 Marker 平均放置在池邊外側
+        if self.fixed_marker_ids:
+            rim = self.rim_points(len(self.fixed_marker_ids)) * 1.12
+            for marker_id, position in zip(self.fixed_marker_ids, rim):
+                angle = np.arctan2(position[1], position[0]) + np.pi / 2
+                self.draw_marker(frame, marker_id, position, angle)
+        return frame
+
+    def create_noise_bank(self, count=8):
+        """預先產生數組感測器雜訊 (分為正、負兩部分，以飽和加減法快速套用)"""
+        if not self.noise_sigma:
+            return []
+        bank = []
+        for _ in range(count):
+            noise = self.rng.normal(0.0, self.noise_sigma, (self.frame_height, self.frame_width, 3))
+            positive = np.clip(noise, 0, 255).astype(np.uint8)
+            negative = np.clip(-noise, 0, 255).astype(np.uint8)
+            bank.append((positive, negative))
+        return bank
+
+    def render(self):
+        """繪製目前狀態的影像"""
+        frame = self.background.copy()
+        motion_pixels = None
+        if self.motion_blur and len(self.marker_ids):
+            # Marker 在一幀之間的影像位移
+            current = self.norm_to_image(self.positions)
+            previous = self.norm_to_image(self.positions - self.velocities * self.dt)
+            motion_pixels = current - previous
+
+        for i, marker_id in enumerate(self.marker_ids):
+            motion = motion_pixels[i] if motion_pixels is not None and not self.respawned[i] else None
+            self.draw_marker(frame, marker_id, self.positions[i], self.angles[i], motion)
+
+            if self.occlusion_frames[i] > 0:
+                # 以深色橢圓模擬手、陰影或水花的遮擋
+                center = self.norm_to_image(self.positions[i] + self.occlusion_offsets[i] * self.marker_size / self.pool_half_size)[0]
+                quad = self.marker_quad(self.positions[i], self.angles[i])
+                axis = int(np.linalg.norm(quad[1] - quad[0]) * 0.5)
+                cv2.ellipse(frame, (int(center[0]), int(center[1])), (axis, max(axis // 2, 1)),
+                            float(np.degrees(self.angles[i])), 0, 360, (45, 50, 55), -1, cv2.LINE_AA)
+
+        if self.blur_sigma:
+            frame = cv2.GaussianBlur(frame, (0, 0), self.blur_sigma)
+        if self.noise_bank:
+            positive, negative = self.noise_bank[self.frame_index % len(self.noise_bank)]
+            cv2.add(frame, positive, dst=frame)
+            cv2.subtract(frame, negative, dst=frame)
+        return frame
+
+    def ground_truth(self):
+        """
+        目前狀態的真實軌跡資料
+        position / velocity 與 ArUcoTracker 的世界座標相同(歸一化座標 × world_radius，單位公尺)，
+        rotation 與 ArUcoTracker 輸出的 Unity 旋轉角度相同(度)
+        """
+        image_positions = self.norm_to_image(self.positions) if len(self.marker_ids) else []
+        markers = []
+        for i, marker_id in enumerate(self.marker_ids):
+            # Marker 右上 -> 右下邊的方向角 (與 ArUcoTracker 的旋轉計算相同)
+            rotation = -(np.degrees(self.angles[i]) + 90.0)
+            rotation = (rotation + 180.0) % 360.0 - 180.0
+            markers.append({
+                "id": int(marker_id),
+                "position": (self.positions[i] * self.world_radius).tolist(),
+                "velocity": (self.velocities[i] * self.world_radius).tolist(),
+                "rotation": float(rotation),
+                "image_position": image_positions[i].tolist(),
+                "occluded": bool(self.occlusion_frames[i] > 0),
+                "respawned": bool(self.respawned[i]),
+            })
+        return {"frame": self.frame_index, "time": self.time, "markers": markers}
+
+    def next_frame(self):
+        """
+        產生下一幀影像
+        回傳: (frame, ground_truth)
+        """
+        frame = self.render()
+        ground_truth = self.ground_truth()
+        self.step()
+        return frame, ground_truth
+
+class SyntheticPoolCapture:
+    """
+    合成水池影像來源
+    具有與 cv2.VideoCapture 相同的 read() 介面，可直接傳入 FramePipeline 或測試程式；
+    每次讀取的真實軌跡保存在 last_ground_truth；
+    num_frames 讀完或 release() 後 finished 為 True (FramePipeline 據此結束管線)
+    """
+
+    def __init__(self, scene, num_frames=None, keep_ground_truth=False):
+        """
+        scene: SyntheticPoolScene
+        num_frames: 可讀取的幀數 (None 表示無限)
+        keep_ground_truth: 是否保留所有幀的真實軌跡 (ground_truth 列表)
+        """
+        self.scene = scene
+        self.num_frames = num_frames
+        self.keep_ground_truth = keep_ground_truth
+        self.frames_read = 0
+        self.last_ground_truth = None
+        self.ground_truth = []
+        self.opened = True
+        self.finished = False  # 影像來源已結束 (不會再有新的幀)
+
+    def read(self):
+        if not self.opened or (self.num_frames is not None and self.frames_read >= self.num_frames):
+            self.finished = True
+            return False, None
+        frame, ground_truth = self.scene.next_frame()
+        self.frames_read += 1
+        self.last_ground_truth = ground_truth
+        if self.keep_ground_truth:
+            self.ground_truth.append(ground_truth)
+        return True, frame
+
+    def isOpened(self):
+        return self.opened
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.scene.frame_width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.scene.frame_height)
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.scene.fps)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return float(self.num_frames) if self.num_frames is not None else -1.0
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.frames_read)
+        return 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self.opened = False
+        self.finished = True
+
+def ground_truth_path(video_path):
+    """影片對應的真實軌跡檔案路徑"""
+    return os.path.splitext(video_path)[0] + "_ground_truth.json"
+
+def write_video(scene, path, num_frames, fourcc="mp4v"):
+    """
+    將合成場景寫入影片，並將場景設定與每一幀的真實軌跡寫入 <影片名稱>_ground_truth.json
+    回傳: 真實軌跡檔案路徑
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), scene.fps,
+                             (scene.frame_width, scene.frame_height))
+    if not writer.isOpened():
+        raise RuntimeError(f"無法建立影片: {path}")
+
+    frames = []
+    try:
+        for _ in range(num_frames):
+            frame, ground_truth = scene.next_frame()
+            writer.write(frame)
+            frames.append(ground_truth)
+    finally:
+        writer.release()
+
+    output_path = ground_truth_path(path)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"scene": scene.describe(), "frames": frames}, f)
+    print(f"已輸出合成影片: {path} ({num_frames} 幀)")
+    print(f"已輸出真實軌跡: {output_path}")
+    return output_path
+
+def load_ground_truth(path):
+    """讀取真實軌跡檔案 (回傳 dict: scene, frames)"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def main():
+    """產生合成水池影片 (命令列工具)"""
+    parser = argparse.ArgumentParser(description="合成 ArUco 水池影片產生器")
+    parser.add_argument("--output", default="synthetic_pool.mp4", help="輸出影片路徑")
+    parser.add_argument("--frames", type=int, default=300, help="輸出幀數")
+    parser.add_argument("--size", default="1280x720", help="影像大小，例如 1280x720")
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--shape", choices=["circle", "rectangle"], default="circle", help="水池形狀")
+    parser.add_argument("--markers", type=int, default=5, help="浮動 Marker 數量")
+    parser.add_argument("--flow", choices=sorted(FLOW_FIELDS), default="vortex", help="流場")
+    parser.add_argument("--speed", type=float, default=0.15, help="流速 (每秒的歸一化距離)")
+    parser.add_argument("--tilt", type=float, default=0.1, help="相機俯角梯形程度")
+    parser.add_argument("--rotation", type=float, default=0.0, help="相機旋轉角度 (度)")
+    parser.add_argument("--noise", type=float, default=3.0, help="感測器雜訊標準差")
+    parser.add_argument("--blur", type=float, default=0.0, help="高斯模糊標準差")
+    parser.add_argument("--occlusion", type=float, default=0.0, help="每幀開始遮擋的機率")
+    parser.add_argument("--seed", type=int, default=0, help="亂數種子")
+    args = parser.parse_args()
+
+    frame_size = tuple(int(v) for v in args.size.lower().split("x"))
+    scene = SyntheticPoolScene(
+        frame_size=frame_size, pool_shape=args.shape, num_markers=args.markers, flow=args.flow,
+        flow_speed=args.speed, fps=args.fps, tilt=args.tilt, rotation_deg=args.rotation,
+        noise_sigma=args.noise, blur_sigma=args.blur, occlusion_rate=args.occlusion, seed=args.seed
+    )
+    write_video(scene, args.output, args.frames)
+
+if __name__ == "__main__":
+    main()
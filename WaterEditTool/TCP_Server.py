@@ -1,29 +1,75 @@
+import queue
 import socket
 import threading
 import struct
 import cv2
 import numpy as np
+from Performance_Metrics import metrics
+
+# 水池 ID 交握命令: Client 連線後傳送命令10 + 資料大小(4 bytes) + 水池 ID (UTF-8)，
+# Server 回覆訊息類型5 + 結果(1 byte，1 = 接受，0 = 未知的水池 ID)
+POOL_HANDSHAKE_COMMAND = 10
+POOL_HANDSHAKE_REPLY = 5
+
+def receive_exact(sock, size):
+    '''接收指定長度的資料(連線中斷時回傳 None)'''
+    received_data = b''
+    while len(received_data) < size:
+        chunk = sock.recv(min(4096, size - len(received_data)))
+        if not chunk:
+            return None
+        received_data += chunk
+    return received_data
+
+def receive_pool_id(sock):
+    '''接收水池 ID 交握的資料(命令10之後的部分)，失敗時回傳 None'''
+    size_data = receive_exact(sock, 4)
+    if size_data is None:
+        return None
+    pool_id = receive_exact(sock, struct.unpack('!I', size_data)[0])
+    return pool_id.decode('utf-8') if pool_id is not None else None
+
+def send_pool_reply(sock, accepted):
+    '''回覆水池 ID 交握的結果'''
+    sock.sendall(bytes([POOL_HANDSHAKE_REPLY, 1 if accepted else 0]))
 
 class FlowMapServer:
-    def __init__(self, host='0.0.0.0', port=8888):
-        '''Server初始化'''
+    def __init__(self, host='0.0.0.0', port=8888, pool_id=None):
+        '''
+        Server初始化
+        port 為 None 時不建立自己的監聽Socket，由 PoolRouter(Multi_Pool_Service.py) 依水池 ID 轉交Client連線
+        '''
         self.host = host # IP位址(設置為'0.0.0.0'，接受所有IP連線)
         self.port = port # 通訊Port號碼 (設置為8888，Client請求連線時須使用相同Port號碼)
+        self.pool_id = pool_id # 水池 ID (多水池服務中用於交握，None 表示接受任何水池 ID)
         # 建立Socket通訊Server(指定網路位址為IPv4、通訊協定為TCP)
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM) if port is not None else None
         self.client_socket = None # 儲存連接的Client Socket
         self.client_address = None # 儲存Client位址資訊
         self.client_connected = False # 標記是否有Client端連接
         self.running = False # Server運行狀態
 
-        self.received_img = None # 儲存從Client端接收到的圖片
+        self.received_img = None # 儲存從Client端接收到的圖片(jpg bytes)
+        self.received_frame = None # 解碼後的圖片
         self.video_frame = None # 儲存Video Frame
 
         self.frame_request = False # Client端是否請求當前串流影片的Frame
-        self.command_lock = threading.Lock() # 用於同步命令處理
+        self.snapshot_service = None # SnapshotService (設定後由其回應命令1/6，不需輪詢請求旗標)
+        self.snapshot_max_width = 0 # Client以命令9選擇的快照最大寬度 (0 表示原始解析度)
+        self.snapshot_quality = 0 # Client以命令9選擇的快照 JPEG 品質 (0 表示預設)
+        self.send_lock = threading.Lock() # 多個執行緒傳送訊息時，確保每則訊息完整連續地寫入Socket
+        self.command_lock = threading.Lock() # 只在交換狀態時持有(不包含網路接收與解碼)
+
+        # Client上傳的資料(編輯後的Frame、參考點、射水向量)由命令執行緒接收至緩衝區後放入佇列，
+        # 解碼、解析與預覽在處理執行緒中進行，不阻塞命令的接收
+        self.upload_queue = queue.Queue()
+        self.upload_thread = None
+        self.preview_uploads = True # 是否顯示接收到的編輯後Frame(5秒，在預覽執行緒中顯示，不阻塞其他上傳資料的處理)
+        self.preview_queue = queue.Queue()
 
         self.flowmap_streaming = False # 決定是否要開始傳遞生成完成的FlowMap給Client
 
+        self.pool_shape = "circle" # 目前編輯的水池形狀(多邊形水池的參考點為輪廓頂點，至少3個點)
         self.annotation_points = None # 紀錄Client傳遞的透是矩陣參考點像素座標值
         self.annotation_points_received = False # 是否接收到Client傳遞的參考點像素座標值
 
@@ -33,7 +79,21 @@ class FlowMapServer:
         self.water_jet_vectors= [] # 儲存Client傳遞的射水向量
         self.water_jet_vectors_received = False # 檢查是否有接收到Client傳遞的射水向量資料
 
+        self.metrics = metrics # 效能指標紀錄(傳送位元組數、各命令的數量)
+        self.verbose_commands = False # 是否輸出每個Client命令的記錄(除錯用；錯誤、未知命令與連線狀態一律輸出)
+
+        # 是否在傳送FlowMap時附帶時間標頭(幀序號與擷取時間)，由Client以命令8開啟
+        self.timestamp_header = False
+
     def start(self):
+        self.upload_thread = threading.Thread(target=self.process_uploads, daemon=True)
+        self.upload_thread.start()
+        if self.preview_uploads:
+            threading.Thread(target=self.preview_images, daemon=True).start()
+        if self.server_socket is None:
+            # 由 PoolRouter 轉交Client連線，不需監聽
+            self.running = True
+            return
         self.server_socket.bind((self.host, self.port)) # Server位址綁定
         # 開始監聽，等待Client連線
         # 設置最多允許5個(backlog)Client同時排隊等待accept
@@ -51,24 +111,7 @@ class FlowMapServer:
                 # Server接受Client連線請求
                 client_socket, addr = self.server_socket.accept()
                 print(f"[Client已連線，位址: {addr}]")
-            
-                # 如果已有Client端連接，關閉舊連接
-                if self.client_socket:
-                    try:
-                        self.client_socket.close()
-                    except:
-                        pass
-                
-                # 保存新的客戶端連接
-                self.client_socket = client_socket
-                self.client_address = addr
-                self.client_connected = True
-
-                # 建立並啟動用於監控Client連接狀態的Thread
-                threading.Thread(target=self.monitor_client,daemon=True).start()
-                # 建立並啟動用於處理Client命令的Thread
-                threading.Thread(target=self.handle_client_commands,daemon=True).start()
-
+                self.attach_client(client_socket, addr)
 
             # 接受Client連線出現問題
             except OSError as e:
@@ -76,6 +119,28 @@ class FlowMapServer:
                     # 正常關閉時產生的錯誤，可忽略
                     break
                 print(f"[Error accepting client] {e}")
+
+    def attach_client(self, client_socket, addr):
+        '''開始服務新的Client連線(自己的監聽Socket或 PoolRouter 轉交)'''
+        # 如果已有Client端連接，關閉舊連接
+        if self.client_socket:
+            try:
+                self.client_socket.close()
+            except:
+                pass
+        
+        # 保存新的客戶端連接
+        self.client_socket = client_socket
+        self.client_address = addr
+        self.client_connected = True
+        self.timestamp_header = False
+        self.snapshot_max_width = 0
+        self.snapshot_quality = 0
+
+        # 建立並啟動用於監控Client連接狀態的Thread
+        threading.Thread(target=self.monitor_client,daemon=True).start()
+        # 建立並啟動用於處理Client命令的Thread
+        threading.Thread(target=self.handle_client_commands,daemon=True).start()
     
     def monitor_client(self):
         '''檢查Client是否仍連線'''
@@ -98,7 +163,10 @@ class FlowMapServer:
                 self.client_connected = False
     
     def handle_client_commands(self):
-        '''處理客戶端發送的命令'''
+        '''
+        處理客戶端發送的命令
+        上傳資料只接收至緩衝區並放入處理佇列；command_lock 只在交換狀態旗標時持有
+        '''
         try:
             while self.client_connected and self.running:
                 try:
@@ -108,48 +176,63 @@ class FlowMapServer:
                         break  # 客戶端斷開連線
                     
                     cmd = int.from_bytes(cmd_type, byteorder='big')
-                    print(f"[收到客戶端命令: {cmd}]")
+                    self.metrics.increment("client_commands")
+                    self.metrics.increment(f"client_commands.{cmd}")
                     
-                    with self.command_lock:
-                        if cmd == 1:  # 請求當前 Frame
-                            self.frame_request = True
-                            print("[客戶端請求當前 Frame]")
-                        elif cmd == 2:  # 客戶端將發送編輯後的 Frame
-                            print("[客戶端將發送編輯後的 Frame]")
-                            received_data = self.receive_image_from_client()
-                            if received_data:
-                                print(f"[成功接收編輯後的 Frame: {len(received_data)} bytes]")
-                            else:
-                                print("[接收編輯後的 Frame 失敗]")
-                        elif cmd == 3: # 接收Client請求發送FlowMap
-                            print("Client請求傳遞生成完成的FlowMap")
+                    if cmd == 1:  # 請求當前 Frame
+                        self.log_command("[客戶端請求當前 Frame]")
+                        if self.snapshot_service is not None:
+                            self.snapshot_service.request("raw")
+                        else:
+                            with self.command_lock:
+                                self.frame_request = True
+                    elif cmd == 2:  # 客戶端將發送編輯後的 Frame
+                        self.log_command("[客戶端將發送編輯後的 Frame]")
+                        self.receive_upload(cmd, "編輯後的 Frame")
+                    elif cmd == 3: # 接收Client請求發送FlowMap
+                        self.log_command("Client請求傳遞生成完成的FlowMap")
+                        with self.command_lock:
                             self.flowmap_streaming = True
-                        elif cmd == 4: # 接收Client請求停止發送FlowMap
-                            print("Client請求停止傳遞生成完成的FlowMap")
+                    elif cmd == 4: # 接收Client請求停止發送FlowMap
+                        self.log_command("Client請求停止傳遞生成完成的FlowMap")
+                        with self.command_lock:
                             self.flowmap_streaming = False
-                        elif cmd == 5: # 接收Client發送的參考點像素座標數值
-                            print("接收Client傳遞的參考點像素座標數值")
-                            points = self.receive_annotation_point()
-                            if points:
-                                self.annotation_points = points
-                                self.annotation_points_received = True
-                                print(f"[成功接收參考點座標: {points}]")
-                            else:
-                                print("[接收參考點座標失敗]")
-                        elif cmd == 6: # 接收Client請求傳遞透視變換後的Frame
-                            print("Client請求傳遞透視變換後的Frame")
-                            self.frame_request_transformed = True
-                        elif cmd == 7: #接收Client傳遞的射水向量標註點像素座標數值
-                            print("接收Client傳遞的射水向量像素座標數值")
-                            vectors = self.receive_water_jet_vectors()
-                            if vectors:
-                                self.water_jet_vectors = vectors
-                                self.water_jet_vectors_received = True
-                                print(f"[成功接收射水向量像素座標數值: {vectors}]")
-                            else:
-                                print("[接收射水向量像素座標數值失敗]")
+                    elif cmd == 5: # 接收Client發送的參考點像素座標數值
+                        self.log_command("接收Client傳遞的參考點像素座標數值")
+                        self.receive_upload(cmd, "參考點座標")
+                    elif cmd == 6: # 接收Client請求傳遞透視變換後的Frame
+                        self.log_command("Client請求傳遞透視變換後的Frame")
+                        if self.snapshot_service is not None:
+                            self.snapshot_service.request("warped")
+                        else:
+                            with self.command_lock:
+                                self.frame_request_transformed = True
+                    elif cmd == 7: #接收Client傳遞的射水向量標註點像素座標數值
+                        self.log_command("接收Client傳遞的射水向量像素座標數值")
+                        self.receive_upload(cmd, "射水向量座標")
+                    elif cmd == 8: # 接收Client請求在FlowMap訊息中附帶時間標頭(延遲量測用)
+                        self.log_command("Client請求在FlowMap訊息中附帶時間標頭")
+                        with self.command_lock:
+                            self.timestamp_header = True
+                    elif cmd == 9: # 接收Client選擇的快照解析度與品質(最大寬度 2 bytes + JPEG 品質 1 byte，0 表示預設)
+                        settings = receive_exact(self.client_socket, 3)
+                        if settings is not None:
+                            max_width, quality = struct.unpack('!HB', settings)
+                            with self.command_lock:
+                                self.snapshot_max_width = max_width
+                                self.snapshot_quality = min(quality, 100)
+                            self.log_command(f"Client設定快照: 最大寬度 {max_width or '原始'}，品質 {quality or '預設'}")
+                    elif cmd == POOL_HANDSHAKE_COMMAND: # 水池 ID 交握(直接連線時只確認水池 ID)
+                        pool_id = receive_pool_id(self.client_socket)
+                        accepted = pool_id is not None and (self.pool_id is None or pool_id == self.pool_id)
+                        if accepted:
+                            self.log_command(f"Client交握水池 ID: {pool_id}")
                         else:
-                            print(f"[未知命令: {cmd}]")
+                            print(f"Client交握水池 ID: {pool_id} (未知的水池 ID)")
+                        with self.send_lock:
+                            send_pool_reply(self.client_socket, accepted)
+                    else:
+                        print(f"[未知命令: {cmd}]")
                 except socket.timeout:
                     continue  # 超時，繼續等待
                 except Exception as e:
@@ -161,75 +244,150 @@ class FlowMapServer:
             if self.client_connected:
                 print(f"Client端: {self.client_address}斷開連線")
 
-    def send_flowmap(self,img_bytes):
-        '''傳遞FlowMap(圖片bytes)給Client'''
+    def log_command(self, message):
+        '''輸出單一命令的記錄 (只在 verbose_commands 開啟時輸出，命令數量記錄於效能指標 client_commands.<命令>)'''
+        if self.verbose_commands:
+            print(message)
+
+    def receive_upload(self, cmd, description):
+        '''
+        [命令執行緒] 接收上傳資料(資料大小 4 bytes + 資料)至緩衝區，放入處理佇列
+        只進行網路接收，解碼與解析由處理執行緒完成
+        '''
+        size_data = receive_exact(self.client_socket, 4)
+        if size_data is None:
+            print(f"接收{description}大小失敗")
+            return False
+        data_size = struct.unpack('!I', size_data)[0]
+        self.log_command(f"[準備接收{description}，大小: {data_size} bytes]")
+        data = receive_exact(self.client_socket, data_size)
+        if data is None:
+            print(f"接收{description}資料中斷")
+            return False
+        self.metrics.increment("bytes_received", 4 + data_size)
+        self.upload_queue.put((cmd, data))
+        return True
+
+    def process_uploads(self):
+        '''[處理執行緒] 解碼/解析上傳資料，完成後在鎖內一次交換狀態'''
+        while True:
+            upload = self.upload_queue.get()
+            if upload is None:
+                break  # Server 關閉
+            cmd, data = upload
+            try:
+                with self.metrics.timer("upload.process"):
+                    if cmd == 2:
+                        self.process_uploaded_image(data)
+                    elif cmd == 5:
+                        self.process_annotation_points(data)
+                    elif cmd == 7:
+                        self.process_water_jet_vectors(data)
+            except Exception as e:
+                print(f"處理Client上傳的資料時發生錯誤: {e}")
+
+    def process_uploaded_image(self, data):
+        '''解碼Client編輯後的Frame'''
+        nparr = np.frombuffer(data, np.uint8)
+        img_np = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        with self.command_lock:
+            self.received_img = data
+            self.received_frame = img_np
+        print(f"[接收到來自Client傳遞的圖片，圖片大小: ({len(data)} bytes)]")
+        if img_np is None:
+            print("[警告] 圖片解碼失敗")
+            return
+        if self.preview_uploads:
+            self.preview_queue.put(img_np)
+
+    def preview_images(self):
+        '''[預覽執行緒] 顯示接收到的編輯後Frame 5 秒'''
+        while True:
+            img_np = self.preview_queue.get()
+            if img_np is None:
+                break  # Server 關閉
+            try:
+                cv2.imshow("Received Image", img_np)
+                cv2.waitKey(5000)  # 顯示 5 秒（5000 毫秒）
+                cv2.destroyWindow("Received Image")
+            except Exception as e:
+                print(f"[顯示圖片失敗] {e}")
+
+    def process_annotation_points(self, data):
+        '''解析標註參考點像素座標數值'''
+        # 解析座標資料 (格式: "x1,y1;x2,y2;x3,y3;x4,y4" -> 根據Unity Client傳遞的格式進行處理)
+        points = []
+        for point_str in data.decode('utf-8').split(';'):
+            if ',' in point_str:
+                x, y = point_str.split(',')
+                points.append((int(x), int(y)))
+        
+        # 確保有4個點(多邊形水池為輪廓頂點，至少3個點)
+        if self.pool_shape == "polygon":
+            if len(points) < 3:
+                print(f"[警告] 接收到 {len(points)} 個點，但多邊形水池需要至少3個點")
+                print("[接收參考點座標失敗]")
+                return
+        elif len(points) != 4:
+            print(f"[警告] 接收到 {len(points)} 個點，但需要4個點")
+            print("[接收參考點座標失敗]")
+            return
+        with self.command_lock:
+            self.annotation_points = points
+            self.annotation_points_received = True
+        print(f"[成功接收參考點座標: {points}]")
+
+    def process_water_jet_vectors(self, data):
+        '''解析射水向量座標'''
+        # 解析座標資料 (格式: "startX,startY,endX,endY;startX,startY,endX,endY;...")
+        vectors = []
+        for vector_str in data.decode('utf-8').split(';'):
+            if vector_str and vector_str.count(',') == 3:  # 確保有4個值 (startX,startY,endX,endY)
+                start_x, start_y, end_x, end_y = (int(part) for part in vector_str.split(','))
+                vectors.append((start_x, start_y, end_x, end_y))
+        if not vectors:
+            print("[接收射水向量像素座標數值失敗]")
+            return
+        with self.command_lock:
+            self.water_jet_vectors = vectors
+            self.water_jet_vectors_received = True
+        print(f"[成功接收射水向量像素座標數值: {vectors}]")
+
+    def send_flowmap(self,img_bytes,frame_seq=None,origin_ns=None):
+        '''
+        傳遞FlowMap(圖片bytes)給Client
+        若Client已開啟時間標頭(命令8)，改以訊息類型4傳送，並在圖片長度前附帶
+        幀序號(4 bytes)與擷取時間(time.monotonic_ns，8 bytes)
+        回傳: 是否成功傳送
+        '''
 
         # 傳遞FlowMap前檢查是否有Client連接
         if not self.client_connected:
             print("尚未有Client連線，無法傳送FlowMap")
-            return
+            return False
         try:
-            # 傳送命令類型 (1 = FlowMap)
-            self.client_socket.sendall(bytes([1]))
-            # 傳送圖片之前，先傳送圖片長度
-            self.client_socket.sendall(struct.pack('!I', len(img_bytes)))
-            # 傳送實際圖片的 bytes 資料
-            self.client_socket.sendall(img_bytes)
+            if self.timestamp_header and origin_ns is not None:
+                # 傳送命令類型 (4 = 附帶時間標頭的FlowMap)
+                header = bytes([4]) + struct.pack('!IQ', (frame_seq or 0) & 0xFFFFFFFF, origin_ns)
+            else:
+                # 傳送命令類型 (1 = FlowMap)
+                header = bytes([1])
+            with self.send_lock:
+                self.client_socket.sendall(header)
+                # 傳送圖片之前，先傳送圖片長度
+                self.client_socket.sendall(struct.pack('!I', len(img_bytes)))
+                # 傳送實際圖片的 bytes 資料
+                self.client_socket.sendall(img_bytes)
+            self.metrics.increment("bytes_sent", len(header) + 4 + len(img_bytes))
             # print(f"[Sent image ({len(img_bytes)} bytes)]")
+            return True
         except Exception as e:
             # 傳遞FlowMap失敗
             print("無法傳遞FlowMap")
             # print(f"[Error sending image] {e}")
             # 傳遞FlowMap失敗視為Client斷線
             self.client_connected = False
-    
-    def receive_annotation_point(self):
-        '''接收Client傳遞的標註參考點像素座標數值'''
-        if not self.client_connected:
-            print("尚未有Client連線，無法接收標註的參考點座標")
-            return None
-        try:
-            # 接收資料大小
-            size_data = self.client_socket.recv(4)
-            if not size_data:
-                print("接收標註的參考點座標大小失敗")
-                return None
-            
-            # 解析資料大小
-            data_size = struct.unpack('!I', size_data)[0]
-            print(f"[準備接收標註的參考點座標，大小: {data_size} bytes]")
-            
-            # 接收資料
-            received_data = b''
-            remaining = data_size
-            
-            while remaining > 0:
-                chunk = self.client_socket.recv(min(4096, remaining))
-                if not chunk:
-                    print("接收標註的參考點座標資料中斷")
-                    return None
-                received_data += chunk
-                remaining -= len(chunk)
-            
-            # 解析座標資料 (格式: "x1,y1;x2,y2;x3,y3;x4,y4" -> 根據Unity Client傳遞的格式進行處理)
-            points_str = received_data.decode('utf-8')
-            points = []
-            
-            for point_str in points_str.split(';'):
-                if ',' in point_str:
-                    x, y = point_str.split(',')
-                    points.append((int(x), int(y)))
-            
-            # 確保有4個點
-            if len(points) != 4:
-                print(f"[警告] 接收到 {len(points)} 個點，但需要4個點")
-                return None
-                
-            return points
-            
-        except Exception as e:
-            print(f"接收標註點座標時發生錯誤: {e}")
-            return None
+            return False
     
     def has_annotation_points(self):
         '''檢查是否已接收到標註點座標(功能函數提供外部呼叫)'''
@@ -237,136 +395,52 @@ class FlowMapServer:
     
     def get_annotation_points(self):
         '''獲取標註點座標(功能函數提供外部呼叫)'''
-        if self.annotation_points_received:
-            return self.annotation_points
-        return None
+        with self.command_lock:
+            if self.annotation_points_received:
+                return self.annotation_points
+            return None
     
     def reset_annotation_points(self):
         '''重置標註點座標狀態(功能函數提供外部呼叫)'''
-        self.annotation_points = None
-        self.annotation_points_received = False
+        with self.command_lock:
+            self.annotation_points = None
+            self.annotation_points_received = False
 
-    def receive_image_from_client(self):
-        '''接收Client編輯後的Frame'''
-        # 確認是否有Client連線
-        if not self.client_connected:
-            print("尚未有Client連線，無法接收圖片")
-            return None
-        try:
-            # 接收圖片大小
-            size_data = self.client_socket.recv(4) # Client傳送的圖片大小資訊
-            if not size_data:
-                print("接收圖片大小失敗")
-                return None
-            
-            # 解析圖片大小
-            image_size = struct.unpack('!I', size_data)[0]
-            print(f"[準備接收圖片，大小: {image_size} bytes]")
-            
-            # 接收圖片數據
-            received_data = b''
-            remaining = image_size
-            
-            while remaining > 0:
-                chunk = self.client_socket.recv(min(4096, remaining)) # 分批讀取接收的圖片資料(分批讀取最多4096 bytes)
-                if not chunk:
-                    print("接收圖片數據中斷")
-                    return None
-                received_data += chunk
-                remaining -= len(chunk)
-            
-            # 儲存接收到的圖片
-            self.received_image = received_data
-            print(f"[接收到來自Client傳遞的圖片，圖片大小: ({image_size} bytes)]")
-            # 顯示圖片 5 秒
-            try:
-                # 解碼 byte 為 OpenCV 圖片
-                nparr = np.frombuffer(received_data, np.uint8)
-                img_np = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                if img_np is not None:
-                    cv2.imshow("Received Image", img_np)
-                    cv2.waitKey(5000)  # 顯示 5 秒（5000 毫秒）
-                    cv2.destroyWindow("Received Image")
-                else:
-                    print("[警告] 圖片解碼失敗")
-            except Exception as e:
-                print(f"[顯示圖片失敗] {e}")
-            return received_data # 回傳圖片大小
-            
-        except Exception as e:
-            print(f"接收圖片時發生錯誤: {e}")
-            return None
-    
-    def receive_water_jet_vectors(self):
-        '''接收Client傳遞的射水向量座標'''
-        if not self.client_connected:
-            print("尚未有Client連線，無法接收射水向量座標")
-            return None
-        try:
-            # 接收資料大小
-            size_data = self.client_socket.recv(4)
-            if not size_data:
-                print("接收射水向量座標大小失敗")
-                return None
-            
-            # 解析資料大小
-            data_size = struct.unpack('!I', size_data)[0]
-            print(f"[準備接收射水向量座標，大小: {data_size} bytes]")
-            
-            # 接收資料
-            received_data = b''
-            remaining = data_size
-            
-            while remaining > 0:
-                chunk = self.client_socket.recv(min(4096, remaining))
-                if not chunk:
-                    print("接收射水向量座標資料中斷")
-                    return None
-                received_data += chunk
-                remaining -= len(chunk)
-            
-            # 解析座標資料 (格式: "startX,startY,endX,endY;startX,startY,endX,endY;...")
-            vectors_str = received_data.decode('utf-8')
-            vectors = []
-            
-            for vector_str in vectors_str.split(';'):
-                if vector_str and vector_str.count(',') == 3:  # 確保有4個值 (startX,startY,endX,endY)
-                    parts = vector_str.split(',')
-                    start_x = int(parts[0])
-                    start_y = int(parts[1])
-                    end_x = int(parts[2])
-                    end_y = int(parts[3])
-                    vectors.append((start_x, start_y, end_x, end_y))
-            
-            return vectors
-            
-        except Exception as e:
-            print(f"接收射水向量座標時發生錯誤: {e}")
-            return None
-    
     def has_water_jet_vectors(self):
         '''檢查是否已接收到射水向量座標'''
         return self.water_jet_vectors_received
     
     def get_water_jet_vectors(self):
         '''獲取射水向量座標'''
-        if self.water_jet_vectors_received:
-            return self.water_jet_vectors
-        return []
+        with self.command_lock:
+            if self.water_jet_vectors_received:
+                return self.water_jet_vectors
+            return []
     
     def reset_water_jet_vectors(self):
         '''重置射水向量狀態'''
-        self.water_jet_vectors_received = False
+        with self.command_lock:
+            self.water_jet_vectors_received = False
 
     def save_video_frame(self,frame_bytes):
         '''儲存串流影片中特定的Frame，用於傳遞給Client進行後續編輯處理'''
         self.video_frame = frame_bytes
         # print("已儲存串流影片的Frame!")
     
-    def send_video_frame_to_client(self):
-        '''傳遞串流影片中特定的Frame給Client進行編輯'''
+    def get_snapshot_settings(self):
+        '''取得Client選擇的快照設定 (最大寬度, JPEG 品質)'''
+        with self.command_lock:
+            return self.snapshot_max_width, self.snapshot_quality
+
+    def send_video_frame_to_client(self, frame_bytes=None):
+        '''
+        傳遞串流影片中特定的Frame給Client進行編輯
+        frame_bytes: 編碼後的Frame (None 時傳送 save_video_frame 儲存的Frame)
+        '''
+        if frame_bytes is None:
+            frame_bytes = self.video_frame
         # 確認是否有串流影片的Frame可傳遞給Client
-        if not self.video_frame:
+        if not frame_bytes:
             print("尚未有串流影片的Frame可傳送")
             return False
         
@@ -375,13 +449,16 @@ class FlowMapServer:
             return False
         
         try:
-            # 傳送命令類型 (2 = 當前 Frame)
-            self.client_socket.sendall(bytes([2]))
-            # 傳送圖片大小給Client(傳遞實際圖片前先傳遞圖片大小)
-            self.client_socket.sendall(struct.pack('!I', len(self.video_frame)))
-            # 傳送實際圖片給Client
-            self.client_socket.sendall(self.video_frame)
-            print(f"[已傳遞串流影片的Frame給Client]大小:({len(self.video_frame)} bytes)")
+            with self.send_lock:
+                # 傳送命令類型 (2 = 當前 Frame)
+                self.client_socket.sendall(bytes([2]))
+                # 傳送圖片大小給Client(傳遞實際圖片前先傳遞圖片大小)
+                self.client_socket.sendall(struct.pack('!I', len(frame_bytes)))
+                # 傳送實際圖片給Client
+                self.client_socket.sendall(frame_bytes)
+            self.metrics.increment("bytes_sent", 5 + len(frame_bytes))
+            print(f"[已傳遞串流影片的Frame給Client]大小:({len(frame_bytes)} bytes)")
+            return True
 
         except Exception as e:
             print(f"傳遞串流影片的Frame給Client發生錯誤: {e}")
@@ -415,12 +492,14 @@ class FlowMapServer:
             print("尚未有Client連線，無法傳遞透視變換後的Frame")
             return False
         try:
-            # 傳送命令類型(3=透視變換後的Frame)
-            self.client_socket.sendall(bytes([3]))
-            # 傳送圖片大小給Client
-            self.client_socket.sendall(struct.pack('!I',len(frame_bytes)))
-            # 傳送實際透視變換後的Frame圖片給Client
-            self.client_socket.sendall(frame_bytes)
+            with self.send_lock:
+                # 傳送命令類型(3=透視變換後的Frame)
+                self.client_socket.sendall(bytes([3]))
+                # 傳送圖片大小給Client
+                self.client_socket.sendall(struct.pack('!I',len(frame_bytes)))
+                # 傳送實際透視變換後的Frame圖片給Client
+                self.client_socket.sendall(frame_bytes)
+            self.metrics.increment("bytes_sent", 5 + len(frame_bytes))
             return True
         except Exception as e:
             print(f"傳遞透視變換後的Frame給Client發生錯誤:{e}")
@@ -430,6 +509,8 @@ class FlowMapServer:
     def stop(self):
         '''手動關閉Server'''
         self.running = False # Server運行狀態設為關閉
+        self.upload_queue.put(None) # 結束上傳資料的處理執行緒與預覽執行緒
+        self.preview_queue.put(None)
 
         # 關閉Server之前先關閉Client Socket(如果當前有Client連線)
         if self.client_socket:
@@ -438,6 +519,8 @@ class FlowMapServer:
             except:
                 pass
         # 關閉Server Socket
+        if self.server_socket is None:
+            return
         try:
             self.server_socket.close()
             print("Server已關閉")
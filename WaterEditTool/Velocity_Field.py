@@ -0,0 +1,123 @@
+import cv2
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy import sparse
+
+def encode_velocity_field(velocity, max_velocity, background_color=(0, 128, 128), min_speed=0.01):
+    """
+    將速度場編碼為 FlowMap 顏色 (向量化處理，編碼方式與 FlowMapGenerator 的筆刷軌跡相同)
+    R、G 依速度方向決定，顏色強度依速度大小在背景色與方向色之間內插；速度低於 min_speed 的位置為背景色
+
+    velocity: (H, W, 2) 速度場
+    max_velocity: 速度正規化的最大速度
+    回傳: (H, W, 3) BGR uint8
+    """
+    vx = velocity[..., 0]
+    vy = velocity[..., 1]
+    speed = np.sqrt(vx * vx + vy * vy)
+    moving = speed >= min_speed
+    safe_speed = np.where(moving, speed, 1.0)
+
+    # 方向色 (與筆刷軌跡相同: R 對應 x 方向，G 對應 -y 方向)
+    r_base = 75 + 125 * (vx / safe_speed + 1) / 2
+    g_base = 75 + 125 * (-vy / safe_speed + 1) / 2
+
+    # 顏色強度 (速度越大越接近方向色)，靜止的位置強度為0(背景色)
+    velocity_factor = np.minimum(speed / max(max_velocity, 1e-6), max_velocity)
+    intensity = np.where(moving, 0.1 + 0.9 * velocity_factor, 0.0)
+
+    blue, green, red = background_color
+    encoded = np.empty(velocity.shape[:2] + (3,), dtype=np.uint8)
+    encoded[..., 0] = np.clip(blue * (1 - intensity), 0, 255)
+    encoded[..., 1] = np.clip(green * (1 - intensity) + g_base * intensity, 0, 255)
+    encoded[..., 2] = np.clip(red * (1 - intensity) + r_base * intensity, 0, 255)
+    return encoded
+
+class VelocityFieldInterpolator:
+    """
+    稀疏 Marker 速度的空間內插
+    在粗網格上由 Marker 的位置與速度建立整個水池的稠密速度場，再放大到畫布大小：
+    idw: KD-tree 最近 k 個 Marker 的反距離加權 (每個網格點都有速度)
+    rbf: 緊支撐徑向基底函數 (Wendland C2) 內插，超出支撐半徑的位置速度為0
+    """
+
+    def __init__(self, grid_width=64, grid_height=64, method="idw", k=8, power=2.0, support_radius=0.6,
+                 regularization=1e-3):
+        """
+        grid_width / grid_height: 粗網格大小
+        method: "idw" 或 "rbf"
+        k: IDW 使用的最近 Marker 數量
+        power: IDW 的距離次方
+        support_radius: RBF 的支撐半徑 (歸一化座標，水池寬度為2)
+        regularization: RBF 線性系統的正則化係數 (Marker 過於接近時保持數值穩定)
+        """
+        if method not in ("idw", "rbf"):
+            raise ValueError(f"不支援的內插方法: {method}")
+        self.grid_width = grid_width
+        self.grid_height = grid_height
+        self.method = method
+        self.k = k
+        self.power = power
+        self.support_radius = support_radius
+        self.regularization = regularization
+
+        # 網格中心點的歸一化座標 (-1~1)，與 FlowMap 的位置映射相同
+        xs = (np.arange(grid_width) + 0.5) / grid_width * 2 - 1
+        ys = (np.arange(grid_height) + 0.5) / grid_height * 2 - 1
+        grid_x, grid_y = np.meshgrid(xs, ys)
+        self.grid_points = np.column_stack([grid_x.ravel(), grid_y.ravel()])
+        self.grid_tree = cKDTree(self.grid_points) if method == "rbf" else None
+
+    def wendland(self, distance):
+        """Wendland C2 緊支撐核函數"""
+        r = np.clip(distance / self.support_radius, 0.0, 1.0)
+        return (1 - r) ** 4 * (4 * r + 1)
+
+    def interpolate(self, positions, velocities):
+        """
+        由 Marker 的位置與速度內插網格速度場
+
+        positions: (N, 2) 歸一化座標 (-1~1)
+        velocities: (N, 2) 速度
+        回傳: (grid_height, grid_width, 2) float32 速度場 (沒有 Marker 時全為0)
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        velocities = np.asarray(velocities, dtype=np.float64).reshape(-1, 2)
+        if len(positions) == 0:
+            return np.zeros((self.grid_height, self.grid_width, 2), dtype=np.float32)
+
+        if self.method == "idw":
+            grid_velocity = self.interpolate_idw(positions, velocities)
+        else:
+            grid_velocity = self.interpolate_rbf(positions, velocities)
+        return grid_velocity.reshape(self.grid_height, self.grid_width, 2).astype(np.float32)
+
+    def interpolate_idw(self, positions, velocities):
+        """KD-tree 最近 k 個 Marker 的反距離加權"""
+        k = min(self.k, len(positions))
+        distances, indices = cKDTree(positions).query(self.grid_points, k=k)
+        if k == 1:
+            return velocities[indices]
+        weights = 1.0 / (distances ** self.power + 1e-9)
+        weights /= weights.sum(axis=1, keepdims=True)
+        return np.einsum("gk,gkd->gd", weights, velocities[indices])
+
+    def interpolate_rbf(self, positions, velocities):
+        """緊支撐 RBF 內插 (求解 Marker 之間的稀疏線性系統，再以稀疏矩陣計算網格上的值)"""
+        marker_tree = cKDTree(positions)
+
+        # Marker 之間的核矩陣 (N x N)，求解權重係數
+        pairs = marker_tree.sparse_distance_matrix(marker_tree, self.support_radius, output_type="coo_matrix")
+        kernel = sparse.coo_matrix((self.wendland(pairs.data), (pairs.row, pairs.col)), shape=pairs.shape).toarray()
+        kernel[np.diag_indices_from(kernel)] += self.regularization
+        coefficients = np.linalg.solve(kernel, velocities)
+
+        # 網格點與 Marker 之間的核矩陣 (G x N，只包含支撐半徑內的點)
+        grid_pairs = self.grid_tree.sparse_distance_matrix(marker_tree, self.support_radius, output_type="coo_matrix")
+        grid_kernel = sparse.csr_matrix((self.wendland(grid_pairs.data), (grid_pairs.row, grid_pairs.col)),
+                                        shape=grid_pairs.shape)
+        return grid_kernel @ coefficients
+
+    def upsample(self, grid_field, width, height, dst=None):
+        """將網格資料放大到畫布大小 (雙線性內插，指定 dst 時直接寫入)"""
+        return cv2.resize(grid_field, (width, height), dst=dst, interpolation=cv2.INTER_LINEAR)